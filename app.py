@@ -1,22 +1,30 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import gspread
 from google.oauth2.service_account import Credentials
 from datetime import datetime, timedelta, date
 import time
 import requests
-import plotly.express as px
 import base64
 import hashlib
 import math
+import numbers
 import re
 import random
 import calendar
-import matplotlib.pyplot as plt
 import io
-import matplotlib.font_manager as fm
 import os
-from PIL import Image
+import json
+import sqlite3
+import threading
+import heapq
+import itertools
+import contextlib
+import functools
+import uuid
+from PIL import Image, ImageOps, features
+from concurrent.futures import ThreadPoolExecutor
 
 # --- 1. 系統全域設定 ---
 st.set_page_config(
@@ -109,23 +117,101 @@ st.markdown("""
 # --- 設定區 ---
 GOOGLE_SHEET_URL = "https://docs.google.com/spreadsheets/d/1oCdUsYy8AGp8slJyrlYw2Qy2POgL2eaIp7_8aTVcX3w/edit?gid=1626161493#gid=1626161493"
 SHEET_HEADERS = ["SKU", "Name", "Category", "Size", "Qty", "Price", "Cost", "Last_Updated", "Image_URL", "Safety_Stock", "Orig_Currency", "Orig_Cost", "Qty_CN"]
+LOG_HEADERS = ["Timestamp", "User", "Action", "Details"]
+USER_HEADERS = ["Name", "Password", "Role", "Status", "Created_At"]
+SHIFT_HEADERS = ["Date", "Staff", "Shift_Type", "Note", "Notify", "Updated_By"]
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
 
 # --- OMEGA 防禦層 ---
+# Google Sheets 配額以「每分鐘、每個使用者 (服務帳號)」計：讀、寫各一組權杖桶，整個行程共用，所有連線依優先序排隊。
+# 任何一次呼叫收到 429 時全行程一起退避，不再各自重試而加劇配額風暴；結帳 (高優先) 永遠排在背景同步 (低優先) 之前。
+SHEETS_QUOTA_PER_MIN = {"read": int(os.environ.get("IFUKUK_READ_QUOTA", 60)), "write": int(os.environ.get("IFUKUK_WRITE_QUOTA", 60))}
+PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW = 0, 1, 2
+RETRY_BUDGET = {PRIORITY_HIGH: 45, PRIORITY_NORMAL: 20, PRIORITY_LOW: 120}  # 單次呼叫 (含排隊與重試) 最長秒數
+TRANSIENT_ERRORS = ["429", "Quota exceeded", "1006", "500", "503", "502"]
+WRITE_CALLS = ("batch_update", "update", "append", "delete", "add_", "insert", "clear", "resize", "values_append", "values_update", "values_batch_update", "values_clear")
+
+class ApiLimiter:
+    def __init__(self, quotas):
+        self.rate = {k: q / 60.0 for k, q in quotas.items()}; self.capacity = dict(quotas)
+        self.tokens = {k: float(q) for k, q in quotas.items()}; self.stamp = {k: time.monotonic() for k in quotas}
+        self.waiters = {k: [] for k in quotas}  # (優先序, 序號) 的 heap
+        self.cond = threading.Condition(); self.seq = itertools.count()
+        self.blocked_until = 0.0; self.strikes = 0
+        self.stats = {"calls": {k: 0 for k in quotas}, "throttled": 0, "retried": 0, "failed": 0, "wait_s": 0.0}
+
+    def _refill(self, kind, now):
+        self.tokens[kind] = min(self.capacity[kind], self.tokens[kind] + (now - self.stamp[kind]) * self.rate[kind]); self.stamp[kind] = now
+
+    def acquire(self, kind, priority, deadline):
+        """排隊取得一枚權杖；輪到自己、未在全域退避中且桶內有權杖才放行，超過 deadline 回傳 False。"""
+        with self.cond:
+            ticket = (priority, next(self.seq)); heapq.heappush(self.waiters[kind], ticket)
+            t0 = time.monotonic(); waited = False
+            try:
+                while True:
+                    now = time.monotonic(); self._refill(kind, now)
+                    head = self.waiters[kind][0] == ticket
+                    if head and now >= self.blocked_until and self.tokens[kind] >= 1:
+                        self.tokens[kind] -= 1; self.stats["calls"][kind] += 1
+                        if waited: self.stats["throttled"] += 1; self.stats["wait_s"] += now - t0
+                        return True
+                    if now >= deadline: return False
+                    waited = True
+                    delay = max(self.blocked_until - now, (1 - self.tokens[kind]) / self.rate[kind]) if head else 0.5
+                    self.cond.wait(max(0.01, min(delay, deadline - now)))
+            finally:
+                self.waiters[kind].remove(ticket); heapq.heapify(self.waiters[kind]); self.cond.notify_all()
+
+    def penalize(self):
+        with self.cond:
+            self.strikes += 1; self.stats["retried"] += 1
+            self.blocked_until = max(self.blocked_until, time.monotonic() + min(60, 2 ** self.strikes) + random.uniform(0, 1))
+
+    def reward(self):
+        if self.strikes:
+            with self.cond: self.strikes = 0
+
+    def snapshot(self):
+        with self.cond:
+            now = time.monotonic()
+            for k in self.tokens: self._refill(k, now)
+            return {"tokens": {k: int(v) for k, v in self.tokens.items()}, "queued": sum(len(w) for w in self.waiters.values()),
+                    "backoff_s": max(0.0, self.blocked_until - now), **{k: (dict(v) if isinstance(v, dict) else v) for k, v in self.stats.items()}}
+
+@st.cache_resource(show_spinner=False)
+def get_limiter():
+    return ApiLimiter(SHEETS_QUOTA_PER_MIN)
+
+_api_ctx = threading.local()
+
+@contextlib.contextmanager
+def api_priority(level):
+    """在此區塊內 (同執行緒) 發出的 Sheets 呼叫使用指定優先序。"""
+    prev = getattr(_api_ctx, "priority", PRIORITY_NORMAL); _api_ctx.priority = level
+    try: yield
+    finally: _api_ctx.priority = prev
+
+def api_kind(func):
+    return "write" if getattr(func, "__name__", "").startswith(WRITE_CALLS) else "read"
+
 def retry_action(func, *args, **kwargs):
-    max_retries = 15
-    for i in range(max_retries):
+    limiter = get_limiter(); kind = api_kind(func)
+    priority = getattr(_api_ctx, "priority", PRIORITY_NORMAL)
+    deadline = time.monotonic() + RETRY_BUDGET[priority]; attempt = 0
+    while limiter.acquire(kind, priority, deadline):
         try:
-            return func(*args, **kwargs)
+            result = func(*args, **kwargs); limiter.reward()
+            return result
         except Exception as e:
-            if any(err in str(e) for err in ["429", "Quota exceeded", "1006", "500", "503", "502"]):
-                wait_time = (1.5 ** i) + random.uniform(0.5, 1.5)
-                if i > 2: st.toast(f"⏳ 雲端連線忙碌中... 自動重試 ({i+1}/{max_retries})")
-                time.sleep(wait_time)
+            if any(err in str(e) for err in TRANSIENT_ERRORS):
+                attempt += 1; limiter.penalize()
+                if attempt > 2 and priority != PRIORITY_LOW: st.toast(f"⏳ 雲端連線忙碌中... 全域排隊重試 (第 {attempt} 次)")
                 continue
             else:
                 raise e
-    st.error("❌ 雲端同步失敗，請檢查網路。")
+    limiter.stats["failed"] += 1
+    if priority != PRIORITY_LOW: st.error("❌ 雲端同步失敗，請檢查網路。")
     return None
 
 @st.cache_resource(ttl=600)
@@ -136,59 +222,458 @@ def get_connection():
     creds = Credentials.from_service_account_info(st.secrets["gcp_service_account"], scopes=SCOPES)
     return gspread.authorize(creds)
 
-@st.cache_data(ttl=10, show_spinner=False)
+def _values_to_df(raw_data, expected_headers=None):
+    if not raw_data or len(raw_data) < 2: 
+        return pd.DataFrame(columns=expected_headers) if expected_headers else pd.DataFrame()
+    
+    headers = raw_data[0]
+    seen = {}; new_headers = []
+    for h in headers:
+        if h in seen: seen[h] += 1; new_headers.append(f"{h}_{seen[h]}")
+        else: seen[h] = 0; new_headers.append(h)
+    
+    rows = raw_data[1:]
+    df = pd.DataFrame(rows)
+    
+    if expected_headers:
+        for col in expected_headers:
+            if col not in new_headers:
+                df[col] = ""; new_headers.append(col)
+                
+    df.columns = new_headers[:len(df.columns)]
+    
+    if 'SKU' in df.columns:
+        df['SKU'] = df['SKU'].astype(str).str.strip()
+        df = df[df['SKU'] != '']
+        
+    return df
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _load_sheet_df(title, version, expected_headers=None):
+    # 以 (工作表, 版本) 為鍵：任一表寫入只會讓該表的快取失效，其他表與其他終端機不受影響
+    return _values_to_df(get_mirror().read(title), expected_headers)
+
 def get_data_safe(_ws, expected_headers=None):
     if _ws is None: return pd.DataFrame(columns=expected_headers) if expected_headers else pd.DataFrame()
-    for attempt in range(5):
-        try:
-            raw_data = _ws.get_all_values()
-            if not raw_data or len(raw_data) < 2: 
-                return pd.DataFrame(columns=expected_headers) if expected_headers else pd.DataFrame()
-            
-            headers = raw_data[0]
-            seen = {}; new_headers = []
-            for h in headers:
-                if h in seen: seen[h] += 1; new_headers.append(f"{h}_{seen[h]}")
-                else: seen[h] = 0; new_headers.append(h)
-            
-            rows = raw_data[1:]
-            df = pd.DataFrame(rows)
-            
-            if expected_headers:
-                for col in expected_headers:
-                    if col not in new_headers:
-                        df[col] = ""; new_headers.append(col)
-                        
-            df.columns = new_headers[:len(df.columns)]
-            
-            if 'SKU' in df.columns:
-                df['SKU'] = df['SKU'].astype(str).str.strip()
-                df = df[df['SKU'] != '']
-                
-            return df
-        except Exception as e:
-            time.sleep(1.5 ** (attempt + 1))
-            continue
-    return pd.DataFrame(columns=expected_headers) if expected_headers else pd.DataFrame()
+    version = ensure_mirror(_ws)
+    if version is None: return pd.DataFrame(columns=expected_headers) if expected_headers else pd.DataFrame()
+    return _load_sheet_df(_ws.title, version, expected_headers)
 
 @st.cache_resource(ttl=600)
 def init_db():
     try: return get_connection().open_by_url(GOOGLE_SHEET_URL)
     except: return None
 
+# --- 工作表註冊表 ---
+# 一次 metadata 請求取得所有分頁 (含 sheetId 與格線大小) 並跨 rerun 共用；只有找不到分頁、寫入回報結構錯誤
+# 或超過 REGISTRY_TTL 才重抓。缺少的分頁在同一個 batchUpdate 內建立並寫入表頭。
+REGISTRY_TTL = 600
+
+class WorksheetRegistry:
+    def __init__(self):
+        self.sh = None; self.sheets = {}; self.loaded_at = 0.0
+        self.lock = threading.RLock()
+
+    def load(self):
+        wss = retry_action(self.sh.worksheets)
+        if wss is None: return False
+        with self.lock: self.sheets = {ws.title: ws for ws in wss}; self.loaded_at = time.time()
+        return True
+
+    def invalidate(self):
+        with self.lock: self.loaded_at = 0.0
+
+    def grid(self, title):
+        ws = self.sheets.get(title)
+        return (ws.row_count, ws.col_count) if ws is not None else None
+
+    def create(self, specs):
+        used = {ws.id for ws in self.sheets.values()}; reqs = []
+        for title, headers in specs.items():
+            sid = random.randint(1, 2 ** 31 - 1)
+            while sid in used: sid = random.randint(1, 2 ** 31 - 1)
+            used.add(sid)
+            reqs.append({"addSheet": {"properties": {"sheetId": sid, "title": title, "gridProperties": {"rowCount": 100, "columnCount": max(20, len(headers))}}}})
+            reqs.append({"updateCells": {"rows": [_row_data(headers)], "fields": "userEnteredValue", "start": {"sheetId": sid, "rowIndex": 0, "columnIndex": 0}}})
+        try: retry_action(self.sh.batch_update, {"requests": reqs})
+        except Exception: pass  # 多終端同時建立時對方已建好，重新載入即可
+
+    def resolve(self, specs):
+        """{分頁名稱: 表頭} -> {分頁名稱: Worksheet 或 None}。"""
+        with self.lock:
+            stale = not self.sheets or time.time() - self.loaded_at > REGISTRY_TTL
+            if stale or any(t not in self.sheets for t in specs): self.load()
+            missing = {t: h for t, h in specs.items() if t not in self.sheets}
+            if missing: self.create(missing); self.load()
+            return {t: self.sheets.get(t) for t in specs}
+
+@st.cache_resource(show_spinner=False)
+def _worksheet_registry(spreadsheet_id):
+    return WorksheetRegistry()
+
+def get_registry(sh):
+    reg = _worksheet_registry(sh.id); reg.sh = sh
+    return reg
+
 def get_worksheet_safe(sh, title, headers):
-    try: return sh.worksheet(title)
-    except gspread.WorksheetNotFound:
-        try:
-            ws = sh.add_worksheet(title, rows=100, cols=20)
-            ws.append_row(headers)
-            return ws
-        except: return None
-    except Exception:
+    return get_registry(sh).resolve({title: headers})[title]
+
+# ==========================================
+# 🗄️ 本地鏡像層 (SQLite Mirror)
+# ==========================================
+# 畫面一律讀本地 SQLite；Google Sheets 為同步遠端，只在寫入後或鏡像過期時才下載。
+MIRROR_DB_PATH = os.environ.get("IFUKUK_MIRROR_DB", "ifukuk_mirror.db")
+MIRROR_TTL = 20          # 秒：超過即於背景向雲端靜默同步
+MIRROR_MAX_STALE = 600   # 秒：超過則視同冷啟動，阻塞同步後再渲染
+APPEND_ONLY_SHEETS = {"Logs"}  # 只增不減的表：增量抓取尾段，偵測到刪列才整表重抓
+COLD_PREFIX = "Logs_"          # 日誌封存分區：封存後不再變動，不因過期而阻塞同步，背景確認也拉長間隔
+COLD_TTL = 6 * 3600
+DIRTY_TAIL, DIRTY_FULL = 1, 2
+
+class LocalMirror:
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.syncing = set()
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS sheet_rows (sheet TEXT, row_num INTEGER, data TEXT, PRIMARY KEY (sheet, row_num))")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS sheet_meta (sheet TEXT PRIMARY KEY, headers TEXT, digest TEXT, synced_at REAL, version INTEGER, dirty INTEGER)")
+            if "gen" not in [c[1] for c in self.conn.execute("PRAGMA table_info(sheet_meta)")]:
+                self.conn.execute("ALTER TABLE sheet_meta ADD COLUMN gen INTEGER DEFAULT 0")
+
+    def meta(self, sheet):
+        with self.lock:
+            r = self.conn.execute("SELECT headers, digest, synced_at, version, dirty, gen FROM sheet_meta WHERE sheet=?", (sheet,)).fetchone()
+        if not r: return None
+        return {"headers": json.loads(r[0]), "digest": r[1], "synced_at": r[2], "version": r[3], "dirty": r[4], "gen": r[5] or 0}
+
+    def begin(self, sheet):
+        """抓取雲端前先取號：(髒標記世代, 開始時間)。抓取期間若有 mark_dirty，世代會變，完成時就不清除髒標記；
+        synced_at 一律記開始時間 (抓到的內容只保證反映這個時間點之前的寫入)。"""
+        meta = self.meta(sheet)
+        return (meta["gen"] if meta else 0, time.time())
+
+    def _settle(self, sheet, ticket, **cols):
+        gen, started = ticket
+        sets = ", ".join(f"{k}=?" for k in cols)
+        self.conn.execute(f"UPDATE sheet_meta SET {sets}{', ' if sets else ''}synced_at=?, dirty=CASE WHEN gen=? THEN 0 ELSE dirty END WHERE sheet=?",
+                          (*cols.values(), started, gen, sheet))
+
+    def read(self, sheet):
+        with self.lock:
+            meta = self.meta(sheet)
+            if meta is None: return []
+            rows = self.conn.execute("SELECT data FROM sheet_rows WHERE sheet=? ORDER BY row_num", (sheet,)).fetchall()
+        return [meta["headers"]] + [json.loads(r[0]) for r in rows]
+
+    def replace(self, sheet, values, ticket=None):
+        """以雲端完整內容覆蓋鏡像；內容未變時只更新同步時間，不遞增版本。ticket 為抓取前 begin() 的結果。"""
+        ticket = ticket or self.begin(sheet)
+        headers = values[0] if values else []
+        payload = [json.dumps(r, ensure_ascii=False) for r in values[1:]]
+        digest = hashlib.sha1("\n".join([json.dumps(headers, ensure_ascii=False)] + payload).encode()).hexdigest()
+        with self.lock, self.conn:
+            meta = self.meta(sheet)
+            if meta and meta["digest"] == digest:
+                self._settle(sheet, ticket)
+                return meta["version"]
+            version = (meta["version"] + 1) if meta else 1
+            self.conn.execute("DELETE FROM sheet_rows WHERE sheet=?", (sheet,))
+            self.conn.executemany("INSERT INTO sheet_rows (sheet, row_num, data) VALUES (?, ?, ?)", [(sheet, i + 2, d) for i, d in enumerate(payload)])
+            if meta is None:
+                self.conn.execute("INSERT INTO sheet_meta (sheet, headers, digest, synced_at, version, dirty, gen) VALUES (?, ?, ?, ?, ?, 0, 0)",
+                                  (sheet, json.dumps(headers, ensure_ascii=False), digest, ticket[1], version))
+            else: self._settle(sheet, ticket, headers=json.dumps(headers, ensure_ascii=False), digest=digest, version=version)
+            return version
+
+    def row_count(self, sheet):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM sheet_rows WHERE sheet=?", (sheet,)).fetchone()[0]
+
+    def row(self, sheet, row_num):
+        with self.lock:
+            r = self.conn.execute("SELECT data FROM sheet_rows WHERE sheet=? AND row_num=?", (sheet, row_num)).fetchone()
+        return json.loads(r[0]) if r else None
+
+    def append(self, sheet, start_row, rows, ticket=None):
+        """增量寫入尾段新列 (start_row 為第一筆新列在雲端的列號)。"""
+        ticket = ticket or self.begin(sheet)
+        payload = [json.dumps(r, ensure_ascii=False) for r in rows]
+        with self.lock, self.conn:
+            meta = self.meta(sheet)
+            digest = hashlib.sha1("\n".join([meta["digest"]] + payload).encode()).hexdigest()
+            self.conn.executemany("INSERT OR REPLACE INTO sheet_rows (sheet, row_num, data) VALUES (?, ?, ?)", [(sheet, start_row + i, d) for i, d in enumerate(payload)])
+            self._settle(sheet, ticket, digest=digest, version=meta["version"] + 1)
+            return meta["version"] + 1
+
+    def touch(self, sheet, ticket=None):
+        ticket = ticket or self.begin(sheet)
+        with self.lock, self.conn: self._settle(sheet, ticket)
+
+    def mark_dirty(self, *sheets, full=False):
+        level = DIRTY_FULL if full else DIRTY_TAIL
+        with self.lock, self.conn:
+            if sheets: self.conn.executemany("UPDATE sheet_meta SET dirty=MAX(dirty, ?), gen=gen+1 WHERE sheet=?", [(level, s) for s in sheets])
+            else: self.conn.execute("UPDATE sheet_meta SET dirty=MAX(dirty, ?), gen=gen+1", (level,))
+
+@st.cache_resource(show_spinner=False)
+def get_mirror():
+    return LocalMirror(MIRROR_DB_PATH)
+
+def fetch_sheet_values(ws):
+    try: return retry_action(ws.get_all_values)
+    except Exception: return None
+
+def col_letter(n): return re.sub(r"\d", "", gspread.utils.rowcol_to_a1(1, n))
+
+def _tail_plan(title, meta):
+    mirror = get_mirror(); n = mirror.row_count(title)
+    width = max(len(meta["headers"]), 1); anchor_row = n + 1
+    return anchor_row, width, (mirror.row(title, anchor_row) if n else meta["headers"])
+
+def _apply_tail(title, plan, tail, ticket):
+    anchor_row, width, anchor = plan; mirror = get_mirror()
+    tail = [list(r) + [""] * (width - len(r)) for r in tail]
+    if not tail or tail[0][:width] != (list(anchor) + [""] * width)[:width]: return None
+    if len(tail) > 1: mirror.append(title, anchor_row + 1, tail[1:], ticket)
+    else: mirror.touch(title, ticket)
+    return True
+
+def sync_tail(ws, meta):
+    """只抓 Logs 尾段：從本地最後一列 (錨點) 抓到底，錨點不符代表雲端有刪列，回傳 None 要求整表重抓。"""
+    plan = _tail_plan(ws.title, meta); ticket = get_mirror().begin(ws.title)
+    try: tail = retry_action(ws.get, f"A{plan[0]}:{col_letter(plan[1])}")
+    except Exception: return False
+    if tail is None: return False
+    return _apply_tail(ws.title, plan, tail, ticket)
+
+def sync_sheet(ws):
+    meta = get_mirror().meta(ws.title)
+    if ws.title in APPEND_ONLY_SHEETS and meta and meta["dirty"] != DIRTY_FULL:
+        result = sync_tail(ws, meta)
+        if result is not None: return result
+    ticket = get_mirror().begin(ws.title)
+    values = fetch_sheet_values(ws)
+    if values is None: return False
+    get_mirror().replace(ws.title, values, ticket)
+    return True
+
+def needs_blocking_sync(meta, title=""):
+    if meta is None or meta["dirty"]: return True
+    return not title.startswith(COLD_PREFIX) and time.time() - meta["synced_at"] > MIRROR_MAX_STALE
+
+def _a1_title(title): return "'" + str(title).replace("'", "''") + "'"
+
+def sync_sheets_batch(sh, titles):
+    """冷啟動 / 寫入後：把所有需要阻塞同步的表 (整表或 Logs 尾段) 合成一次 values_batch_get，
+    延遲只剩一次往返；失敗時不做任何事，各表稍後仍由 ensure_mirror 個別補抓。"""
+    mirror = get_mirror(); plans = {}
+    for t in titles:
+        meta = mirror.meta(t)
+        if not needs_blocking_sync(meta, t): continue
+        tail = t in APPEND_ONLY_SHEETS and meta is not None and meta["dirty"] != DIRTY_FULL
+        plans[t] = _tail_plan(t, meta) if tail else None
+    if not plans: return
+    ranges = [f"{_a1_title(t)}!A{p[0]}:{col_letter(p[1])}" if p else _a1_title(t) for t, p in plans.items()]
+    tickets = {t: mirror.begin(t) for t in plans}
+    try: resp = retry_action(sh.values_batch_get, ranges)
+    except Exception: return
+    if not resp: return
+    refetch = []
+    for (t, plan), vr in zip(plans.items(), resp.get("valueRanges", [])):
+        values = vr.get("values", [])
+        if plan is None: mirror.replace(t, gspread.utils.fill_gaps(values) if values else [], tickets[t])
+        elif _apply_tail(t, plan, values, tickets[t]) is None: refetch.append(t)
+    if refetch:
+        mirror.mark_dirty(*refetch, full=True); sync_sheets_batch(sh, refetch)
+
+def _background_sync(ws):
+    mirror = get_mirror()
+    try:
+        with api_priority(PRIORITY_LOW): sync_sheet(ws)
+    finally:
+        with mirror.lock: mirror.syncing.discard(ws.title)
+
+def ensure_mirror(ws):
+    """確保鏡像可讀並回傳該表目前版本 (從未同步成功則為 None)。"""
+    mirror = get_mirror()
+    meta = mirror.meta(ws.title)
+    age = time.time() - meta["synced_at"] if meta else None
+    if needs_blocking_sync(meta, ws.title):
+        sync_sheet(ws)
+    elif age > (COLD_TTL if ws.title.startswith(COLD_PREFIX) else MIRROR_TTL):
+        with mirror.lock:
+            start = ws.title not in mirror.syncing
+            mirror.syncing.add(ws.title)
+        if start: threading.Thread(target=_background_sync, args=(ws,), daemon=True).start()
+    return sheet_version(ws.title)
+
+def sheet_version(title):
+    meta = get_mirror().meta(title)
+    return meta["version"] if meta else None
+
+def refresh_mirror(*titles, full=False):
+    """寫入後呼叫：只標記被寫入的工作表，下一次讀取才向雲端同步該表。未指定則全部標記；有刪列時請帶 full=True。"""
+    get_mirror().mark_dirty(*titles, full=full)
+
+# ==========================================
+# 🧭 列號索引 (Key → Row Index)
+# ==========================================
+# 由鏡像建立 主鍵→列號 與 分組→列號 索引 (Items: SKU / 品名；Users: 帳號；Shifts: 日期)，每個版本只建一次。
+# 寫入前只對目標列做一次 batch_get 驗證，索引失準 (他人增刪列) 時整表重新同步後再定位。
+INDEX_GROUP_COL = {"Items": 1, "Shifts": 0}
+
+class RowIndex:
+    def __init__(self, values, group_col=None):
+        self.width = len(values[0]) if values else 0
+        self.key_rows = {}; self.group_rows = {}
+        for i, r in enumerate(values[1:]):
+            if not r: continue
+            key = str(r[0]).strip()
+            if key and key not in self.key_rows: self.key_rows[key] = i + 2
+            if group_col is not None and len(r) > group_col: self.group_rows.setdefault(r[group_col], []).append(i + 2)
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def _build_row_index(title, version):
+    return RowIndex(get_mirror().read(title), INDEX_GROUP_COL.get(title))
+
+def get_row_index(ws):
+    return _build_row_index(ws.title, ensure_mirror(ws))
+
+def _read_verified(ws, rows, check):
+    """一次 batch_get 讀取指定列，回傳 (通過驗證的 {列號: 值}, 是否有列失準)；讀取失敗 (配額耗盡等) 時前者為 None。"""
+    if not rows: return {}, False
+    width = max(get_row_index(ws).width, 1)
+    live = retry_action(ws.batch_get, [f"A{r}:{col_letter(width)}{r}" for r in rows])
+    if live is None: return None, False
+    ok = {}; stale = False
+    for r, vr in zip(rows, live):
+        vals = list(vr[0]) if vr else []
+        vals += [""] * (width - len(vals))
+        if check(r, vals): ok[r] = vals
+        else: stale = True
+    return ok, stale
+
+def locate_rows(ws, keys):
+    """回傳 {主鍵: (列號, 即時列值)}；找不到的主鍵不會出現在結果中。雲端讀取失敗回傳 None (不可當成找不到)。"""
+    keys = list(dict.fromkeys(keys))
+    for attempt in range(2):
+        index = get_row_index(ws)
+        rows = {k: index.key_rows[k] for k in keys if k in index.key_rows}
+        by_row = {r: k for k, r in rows.items()}
+        ok, stale = _read_verified(ws, list(by_row), lambda r, v: str(v[0]).strip() == by_row[r])
+        if ok is None: return None
+        if not stale and len(rows) == len(keys): break
+        refresh_mirror(ws.title, full=True)
+    return {by_row[r]: (r, v) for r, v in ok.items()}
+
+def locate_groups(ws, group_values):
+    """一次定位多個分組 (例如多個排班日期)，回傳 {分組值: [(列號, 即時列值)]}；雲端讀取失敗回傳 None。"""
+    col = INDEX_GROUP_COL[ws.title]; group_values = list(dict.fromkeys(group_values))
+    for attempt in range(2):
+        groups = get_row_index(ws).group_rows
+        by_row = {r: g for g in group_values for r in groups.get(g, [])}
+        ok, stale = _read_verified(ws, sorted(by_row), lambda r, v: v[col] == by_row[r])
+        if ok is None: return None
+        if not stale: break
+        refresh_mirror(ws.title, full=True)
+    out = {g: [] for g in group_values}
+    for r, v in sorted(ok.items()): out[v[col]].append((r, v))
+    return out
+
+def locate_group_rows(ws, group_value):
+    """回傳同一分組 (例如同品名) 的 [(列號, 即時列值)]。"""
+    return (locate_groups(ws, [group_value]) or {}).get(group_value, [])
+
+STALE_LOG_MSG = "❌ 這筆紀錄已被其他終端異動或封存，已重新同步日誌，請重新選取後再試。"
+
+def log_row_key(vals):
+    """日誌列的比對鍵 (Timestamp, User, Details)。"""
+    vals = [str(x) for x in vals] + [""] * 4
+    return vals[0], vals[1], vals[3]
+
+def verify_log_rows(ws_logs, expected):
+    """刪除 Logs 列之前，一次讀回涵蓋 expected {列號: log_row_key} 的區間，確認每個列號上仍是預期那一筆。
+    任一列不符 (其他終端刪列或歸檔造成位移) 就整表重新同步並回傳 False，呼叫端放棄這次刪除。"""
+    if not expected: return True
+    lo, hi = min(expected), max(expected)
+    live = retry_action(ws_logs.batch_get, [f"A{lo}:{col_letter(len(LOG_HEADERS))}{hi}"])
+    rows = list(live[0]) if live else []
+    if live is not None and all(r - lo < len(rows) and log_row_key(rows[r - lo]) == key for r, key in expected.items()): return True
+    refresh_mirror(ws_logs.title, full=True)
+    return False
+
+# ==========================================
+# 📦 寫入合併器 (Batch Writer)
+# ==========================================
+def _cell_value(v):
+    if isinstance(v, bool): return {"boolValue": v}
+    if isinstance(v, numbers.Integral): return {"numberValue": int(v)}
+    if isinstance(v, numbers.Real): return {"numberValue": float(v)}
+    return {"stringValue": "" if v is None else str(v)}
+
+def _row_data(values): return {"values": [{"userEnteredValue": _cell_value(v)} for v in values]}
+
+class SheetBatch:
+    """收集一次使用者動作的儲存格更新、附加列與刪列，commit 時以單一 spreadsheets.batchUpdate 送出。
+    列號一律以動作開始前的雲端狀態為準：先更新、再由下往上刪列、最後附加。"""
+    def __init__(self):
+        self.sh = None
+        self.updates = []   # (ws, row, col, value)
+        self.deletes = {}   # sheetId -> (ws, set(row))
+        self.appends = {}   # sheetId -> (ws, [row values])
+        self.hooks = []     # 送出成功後才執行 (例如記下已備份的圖片)
+
+    def _track(self, ws):
+        if self.sh is None: self.sh = ws.spreadsheet
+
+    def update(self, ws, row, col, value):
+        self._track(ws); self.updates.append((ws, row, col, value))
+
+    def update_cells(self, ws, cells):
+        for c in cells: self.update(ws, c.row, c.col, c.value)
+
+    def append(self, ws, values):
+        self._track(ws); self.appends.setdefault(ws.id, (ws, []))[1].append(list(values))
+
+    def append_rows(self, ws, rows):
+        for r in rows: self.append(ws, r)
+
+    def delete_row(self, ws, row):
+        self._track(ws); self.deletes.setdefault(ws.id, (ws, set()))[1].add(row)
+
+    def on_commit(self, fn): self.hooks.append(fn)
+
+    def requests(self):
+        reqs = []
+        for ws, row, col, value in self.updates:
+            reqs.append({"updateCells": {"rows": [_row_data([value])], "fields": "userEnteredValue",
+                                         "start": {"sheetId": ws.id, "rowIndex": row - 1, "columnIndex": col - 1}}})
+        for ws, rows in self.deletes.values():
+            ranges = []
+            for r in sorted(rows, reverse=True):
+                if ranges and ranges[-1][0] == r + 1: ranges[-1][0] = r
+                else: ranges.append([r, r])
+            for start, end in ranges:
+                reqs.append({"deleteDimension": {"range": {"sheetId": ws.id, "dimension": "ROWS", "startIndex": start - 1, "endIndex": end}}})
+        for ws, rows in self.appends.values():
+            reqs.append({"appendCells": {"sheetId": ws.id, "rows": [_row_data(r) for r in rows], "fields": "userEnteredValue"}})
+        return reqs
+
+    def commit(self):
+        reqs = self.requests()
+        if not reqs: return True
         try:
-            time.sleep(2)
-            return init_db().worksheet(title)
-        except: return None
+            if retry_action(self.sh.batch_update, {"requests": reqs}) is None: return False
+        except gspread.exceptions.APIError:
+            get_registry(self.sh).invalidate(); raise
+        touched = {ws.title for ws, *_ in self.updates} | {ws.title for ws, _ in self.appends.values()}
+        deleted = {ws.title for ws, _ in self.deletes.values()}
+        if touched - deleted: refresh_mirror(*(touched - deleted))
+        if deleted: refresh_mirror(*deleted, full=True)
+        for fn in self.hooks: fn()
+        return True
 
 # --- 工具模組 ---
 def get_taiwan_time_str(): return (datetime.utcnow() + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S")
@@ -203,35 +688,498 @@ def get_live_rate():
 def make_hash(password): return hashlib.sha256(str(password).encode()).hexdigest()
 def check_hash(password, hashed_text): return make_hash(password) == hashed_text
 
-def render_image_url(url_input):
-    if not url_input or pd.isna(url_input): return "https://i.ibb.co/W31w56W/placeholder.png"
+# ==========================================
+# 🔒 庫存樂觀鎖 (Compare-and-Swap)
+# ==========================================
+# Sheets 沒有交易，以每列 Last_Updated 當版本戳：讀取即時列後，用 findReplace (整格比對、只限該格) 把讀到的版本戳
+# 換成租約 "LOCK|權杖|到期"，換成功且該列仍是同一個 SKU 才代表讀取後沒有其他終端動過此列。所有 SKU 都租到才在同一個 batchUpdate
+# 寫入新庫存、新版本戳與日誌；任一列租不到就歸還已租的列、重新讀取再試。同一行程內另以 SKU 鎖排隊，自己人不互搶。
+STAMP_COL = SHEET_HEADERS.index("Last_Updated") + 1
+LEASE_PREFIX = "LOCK|"
+LEASE_TTL = 90      # 秒：需大於高優先呼叫的重試預算；逾期 (終端當機) 的租約可被接手
+CAS_ATTEMPTS = 6
+
+def new_version_stamp(): return (datetime.utcnow() + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+def lease_active(stamp):
+    if not stamp.startswith(LEASE_PREFIX): return False
+    try: return float(stamp.split("|")[2]) > time.time()
+    except (IndexError, ValueError): return False
+
+class SkuLocks:
+    def __init__(self):
+        self.guard = threading.Lock(); self.locks = {}
+
+    @contextlib.contextmanager
+    def hold(self, skus):
+        """依排序取得多個 SKU 鎖，兩筆交易不會交叉等待。"""
+        with self.guard: locks = [self.locks.setdefault(s, threading.Lock()) for s in sorted(set(skus))]
+        for lk in locks: lk.acquire()
+        try: yield
+        finally:
+            for lk in reversed(locks): lk.release()
+
+@st.cache_resource(show_spinner=False)
+def get_sku_locks():
+    return SkuLocks()
+
+def _swap_stamps(ws, swaps):
+    """swaps: [(列號, 預期值, 新值)]，一次 batchUpdate 逐格比對置換；回傳置換成功的列號。"""
+    if not swaps: return set()
+    reqs = [{"findReplace": {"find": old, "replacement": new, "matchCase": True, "matchEntireCell": True,
+                             "range": {"sheetId": ws.id, "startRowIndex": row - 1, "endRowIndex": row, "startColumnIndex": STAMP_COL - 1, "endColumnIndex": STAMP_COL}}}
+            for row, old, new in swaps]
+    resp = retry_action(ws.spreadsheet.batch_update, {"requests": reqs})
+    if resp is None: return set()
+    return {row for (row, _, _), rep in zip(swaps, resp.get("replies", [])) if rep.get("findReplace", {}).get("occurrencesChanged", 0)}
+
+def commit_stock_deltas(ws, deltas, build=None, guard=True, skip_missing=False):
+    """以 CAS 協定套用庫存增減。deltas: {SKU: {欄號: 增減量}}；build(batch, live) 把日誌等一併放進同一次寫入。
+    guard=True 時扣減後不得為負。build 回傳 False 代表要一併修改的列已失準，歸還租約放棄寫入。回傳 (狀態, 細節)：
+    ("ok", live) / ("short", (SKU, 現有量)) / ("missing", SKU) / ("busy", None) / ("stale", None) / ("failed", None)；
+    讀不到雲端即時列時回傳 ("failed", "read")，代表尚未寫入任何東西。"""
+    unmatched = {}
+    with get_sku_locks().hold(deltas):
+        for attempt in range(CAS_ATTEMPTS):
+            if attempt: time.sleep(random.uniform(0.1, 0.4) * attempt)
+            live = locate_rows(ws, list(deltas))
+            if live is None: return "failed", "read"   # 讀不到雲端不等於商品不存在
+            missing = [s for s in deltas if s not in live]
+            if missing and not skip_missing: return "missing", missing[0]
+            skus = sorted(s for s in deltas if s in live)
+            for s in skus:
+                for col, d in deltas[s].items():
+                    q = int(live[s][1][col - 1] or 0)
+                    if guard and d < 0 and q + d < 0: return "short", (s, q)
+            stamps = {s: str(live[s][1][STAMP_COL - 1]) for s in skus}
+            if any(lease_active(v) for v in stamps.values()): continue
+            # findReplace 無法比對空白格；同一版本戳連續兩次置換失敗 (雲端格式化後與讀到的不同) 也一併改寫成標準版本戳再重讀
+            blank = [s for s in skus if not stamps[s] or unmatched.get(s) == stamps[s]]
+            if blank:
+                batch = SheetBatch()
+                for s in blank: batch.update(ws, live[s][0], STAMP_COL, new_version_stamp())
+                batch.commit(); continue
+            lease = f"{LEASE_PREFIX}{uuid.uuid4().hex[:12]}|{time.time() + LEASE_TTL:.0f}"
+            got = _swap_stamps(ws, [(live[s][0], stamps[s], lease) for s in skus]) if skus else set()
+            release = [(live[s][0], lease, stamps[s]) for s in skus if live[s][0] in got]
+            try:  # 從拿到租約到送出為止任何例外都要歸還租約，否則其他終端要等 LEASE_TTL 才能接手
+                if len(got) < len(skus):
+                    unmatched = {s: stamps[s] for s in skus if live[s][0] not in got}
+                    _swap_stamps(ws, release); continue
+                # 版本戳可能在多列相同 (同批寫入)：租到後再確認每列仍是原本的 SKU，列號若已位移就歸還、重建索引再試
+                by_row = {live[s][0]: s for s in skus}
+                held, moved = _read_verified(ws, list(by_row), lambda r, v: str(v[0]).strip() == by_row[r] and v[STAMP_COL - 1] == lease)
+                if held is None or moved or len(held) < len(skus):
+                    _swap_stamps(ws, release); refresh_mirror(ws.title, full=True); continue
+                batch = SheetBatch(); stamp = new_version_stamp()
+                for s in skus:
+                    row, vals = live[s]
+                    for col, d in deltas[s].items(): batch.update(ws, row, col, int(vals[col - 1] or 0) + d)
+                    batch.update(ws, row, STAMP_COL, stamp)
+                if build and build(batch, live) is False:
+                    _swap_stamps(ws, release); return "stale", None
+                if batch.commit(): return "ok", live
+                _swap_stamps(ws, release); return "failed", None
+            except Exception:
+                _swap_stamps(ws, release); raise
+    return "busy", None
+
+# ==========================================
+# 📮 離線結帳佇列 (Sale Journal)
+# ==========================================
+# 結帳先寫進本地 SQLite 佇列 (與鏡像同檔、WAL 持久化) 並立刻回報成功，由背景重播器推送到雲端：多筆合併成一次 CAS 提交，
+# 合併批次庫存不足時逐筆重送以找出衝突單，衝突單留在佇列等店長處理。每筆日誌帶 Ref 編號，回應遺失 (不確定是否已寫入)
+# 時先比對雲端 Logs 再決定是否重送，避免重複扣庫存。
+JOURNAL_BATCH = 20
+JOURNAL_IDLE = 5        # 秒：佇列空閒時的輪詢間隔
+JOURNAL_BACKOFF = 30    # 秒：雲端失敗後的等待時間
+JOURNAL_KEEP = 7 * 86400
+JOURNAL_OPEN = ("pending", "conflict")
+
+class SaleJournal:
+    def __init__(self, mirror):
+        self.conn, self.lock = mirror.conn, mirror.lock
+        with self.lock, self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS sale_journal (id TEXT PRIMARY KEY, created_at REAL, ts TEXT, user TEXT, deltas TEXT, content TEXT, "
+                              "status TEXT, attempts INTEGER DEFAULT 0, error TEXT, synced_at REAL)")
+
+    def add(self, user, deltas, content, jid=None, error=None):
+        jid = jid or new_journal_id()
+        with self.lock, self.conn:
+            self.conn.execute("INSERT INTO sale_journal (id, created_at, ts, user, deltas, content, status, error) VALUES (?, ?, ?, ?, ?, ?, 'pending', ?)",
+                              (jid, time.time(), get_taiwan_time_str(), user, json.dumps(deltas), content, error))
+        return jid
+
+    @staticmethod
+    def _deltas(raw): return {sku: {int(c): d for c, d in cols.items()} for sku, cols in json.loads(raw).items()}
+
+    def entries(self, *statuses, limit=None):
+        sql = f"SELECT id, ts, user, deltas, content, status, attempts, error FROM sale_journal WHERE status IN ({','.join('?' * len(statuses))}) ORDER BY created_at"
+        with self.lock: rows = self.conn.execute(sql + (f" LIMIT {int(limit)}" if limit else ""), statuses).fetchall()
+        return [{"id": r[0], "ts": r[1], "user": r[2], "deltas": self._deltas(r[3]), "content": r[4], "status": r[5], "attempts": r[6], "error": r[7]} for r in rows]
+
+    def mark(self, ids, status, error=None):
+        with self.lock, self.conn:
+            self.conn.executemany("UPDATE sale_journal SET status=?, error=?, synced_at=? WHERE id=?", [(status, error, time.time(), i) for i in ids])
+
+    def bump(self, ids, error):
+        with self.lock, self.conn:
+            self.conn.executemany("UPDATE sale_journal SET attempts=attempts+1, error=? WHERE id=?", [(error, i) for i in ids])
+
+    def counts(self):
+        with self.lock: return dict(self.conn.execute("SELECT status, COUNT(*) FROM sale_journal WHERE status IN (?, ?) GROUP BY status", JOURNAL_OPEN).fetchall())
+
+    def overlay(self, fetch_start):
+        """尚未反映在鏡像中的庫存異動 {SKU: {欄號: 增減}}：未同步 / 衝突的單，以及鏡像開始抓取之後才確認上雲的單。
+        fetch_start 是鏡像那次抓取的開始時間 (sheet_meta.synced_at)：之後才確認的寫入可能沒被讀到，一律疊加；
+        確認時間不早於實際寫入時間，所以寧可重複扣 (畫面偏保守) 也不會漏扣。"""
+        with self.lock:
+            rows = self.conn.execute("SELECT deltas FROM sale_journal WHERE status IN (?, ?) OR (status='synced' AND synced_at > ?)", (*JOURNAL_OPEN, fetch_start or 0)).fetchall()
+        out = {}
+        for (raw,) in rows:
+            for sku, cols in self._deltas(raw).items():
+                for col, d in cols.items(): out.setdefault(sku, {}).setdefault(col, 0); out[sku][col] += d
+        return out
+
+    def prune(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM sale_journal WHERE status IN ('synced', 'void') AND synced_at < ?", (time.time() - JOURNAL_KEEP,))
+
+@st.cache_resource(show_spinner=False)
+def get_sale_journal():
+    return SaleJournal(get_mirror())
+
+def new_journal_id(): return uuid.uuid4().hex[:12]
+def journal_log_row(e): return [e["ts"], e["user"], "Sale", f"{e['content']} | Ref:{e['id']}"]
+
+class SaleReplayer:
+    def __init__(self, journal):
+        self.journal = journal; self.ws = None; self.thread = None
+        self.wake = threading.Event(); self.lock = threading.Lock(); self.last_error = None
+
+    def kick(self, ws_items, ws_logs):
+        with self.lock:
+            self.ws = (ws_items, ws_logs)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, daemon=True); self.thread.start()
+        self.wake.set()
+
+    def _run(self):
+        while True:
+            self.wake.wait(JOURNAL_IDLE); self.wake.clear()
+            try:
+                with api_priority(PRIORITY_LOW): ok = self.drain()
+            except Exception as e: self.last_error = str(e); ok = False
+            if not ok: time.sleep(JOURNAL_BACKOFF)
+
+    def _push(self, entries, guard=True):
+        ws_items, ws_logs = self.ws; ids = [e["id"] for e in entries]; deltas = {}
+        for e in entries:
+            for sku, cols in e["deltas"].items():
+                for col, d in cols.items(): deltas.setdefault(sku, {}).setdefault(col, 0); deltas[sku][col] += d
+        try: status, info = commit_stock_deltas(ws_items, deltas, build=lambda batch, live: batch.append_rows(ws_logs, [journal_log_row(e) for e in entries]), guard=guard)
+        except Exception as ex: self.last_error = str(ex); status, info = "failed", None
+        # short / missing 只會出現在成功讀到雲端即時列之後；讀取失敗 (info == "read") 什麼都沒寫入，不必比對 Ref，照常重試
+        uncertain = status == "failed" and info != "read"
+        if status == "ok": self.journal.mark(ids, "synced")
+        elif status in ("short", "missing") and len(entries) == 1:
+            self.journal.mark(ids, "conflict", f"雲端庫存不足 ({info[0]} 剩 {info[1]})" if status == "short" else f"雲端找不到 {info}")
+        elif guard: self.journal.bump(ids, "uncertain" if uncertain else None if status == "failed" else status)
+        else: self.journal.bump(ids, "uncertain+force" if uncertain else "force")  # 保留店長的強制入帳決定
+        return status
+
+    def _reconcile(self, ws_logs, entries):
+        """回應遺失的單：到雲端 Logs 找 Ref，已入帳的直接標記完成。"""
+        if not sync_sheet(ws_logs): return False
+        refs = set(re.findall(r'Ref:([0-9a-f]{12})', " ".join(r[3] for r in get_mirror().read(ws_logs.title)[1:] if len(r) > 3)))
+        done = [e["id"] for e in entries if e["id"] in refs]
+        if done: self.journal.mark(done, "synced")
+        for force in (False, True):
+            self.journal.bump([e["id"] for e in entries if e["id"] not in refs and e["error"].endswith("force") == force], "force" if force else None)
+        return True
+
+    def drain(self):
+        """推送一批待同步的單；雲端失敗回傳 False (稍後重試)。"""
+        if self.ws is None: return True
+        pending = self.journal.entries("pending", limit=JOURNAL_BATCH)
+        if not pending: self.journal.prune(); return True
+        uncertain = [e for e in pending if (e["error"] or "").startswith("uncertain")]
+        if uncertain:
+            if not self._reconcile(self.ws[1], uncertain): return False
+            pending = self.journal.entries("pending", limit=JOURNAL_BATCH)
+        forced = [e for e in pending if e["error"] == "force"]; normal = [e for e in pending if e["error"] != "force"]
+        for e in forced:  # 店長確認強制入帳：允許雲端庫存扣成負數
+            if self._push([e], guard=False) not in ("ok", "short", "missing"): return False
+        if normal:
+            status = self._push(normal)
+            if status in ("short", "missing") and len(normal) > 1:
+                for e in normal:
+                    if self._push([e]) not in ("ok", "short", "missing"): return False
+            elif status not in ("ok", "short", "missing"): return False
+        if len(pending) == JOURNAL_BATCH: self.wake.set()
+        return True
+
+@st.cache_resource(show_spinner=False)
+def get_sale_replayer():
+    return SaleReplayer(get_sale_journal())
+
+def apply_stock_overlay(df, overlay):
+    """把佇列中尚未上雲的庫存異動疊加到畫面用的商品表 (不動快照本身)。"""
+    df = df.copy()
+    for col in sorted({c for cols in overlay.values() for c in cols}):
+        name = SHEET_HEADERS[col - 1]; adj = {sku: cols[col] for sku, cols in overlay.items() if col in cols}
+        df[name] = df[name] + df['SKU'].map(adj).fillna(0).astype(df[name].dtype)
+    return df
+
+# ==========================================
+# 🖼️ 內容定址圖庫 (Image Store)
+# ==========================================
+# 圖片以內容雜湊命名存於 static/img，經 Streamlit 靜態檔服務以可長期快取的網址提供；Items 儲存格只留
+# "img:<雜湊>" 短參照。Images 工作表是耐久備份 (base64 分段存放)，容器重啟後本機缺檔時才整批補回。
+# 每張圖另有多個尺寸版本 (<雜湊>@thumb / @card)：雜湊取自主圖 (detail)，其他版本可隨時由主圖重建，只有主圖需要備份。
+PLACEHOLDER_IMG = "https://i.ibb.co/W31w56W/placeholder.png"
+IMAGE_REF_PREFIX = "img:"
+IMAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "img")
+IMAGE_URL_BASE = "app/static/img"
+IMAGE_HEADERS = ["Hash", "Mime", "Created_At", "Chunks", "Data"]
+IMAGE_CELL_CHARS = 45000  # 單一儲存格上限 50,000 字元，留餘裕
+IMAGE_EXT = {"image/jpeg": "jpg", "image/png": "png", "image/webp": "webp", "image/gif": "gif"}
+RENDITIONS = {"detail": 800, "card": 320, "thumb": 120}  # 主圖 / POS 卡片 / 庫存縮圖 (長邊像素)
+IMAGE_MIME = "image/webp" if features.check("webp") else "image/jpeg"
+
+def _to_rgb(img):
+    if img.mode in ('RGBA', 'P', 'LA'):
+        img = img.convert('RGBA'); background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[3]); return background
+    return img if img.mode == 'RGB' else img.convert('RGB')
+
+def _encode(img, mime):
+    buf = io.BytesIO()
+    if mime == "image/webp": img.save(buf, format="WEBP", quality=80, method=4)
+    else: img.save(buf, format="JPEG", quality=80, optimize=True)
+    return buf.getvalue()
+
+def build_renditions(data, sizes=None, mime=IMAGE_MIME):
+    """一次解碼、依大到小逐級縮圖並編碼；回傳 {版本: bytes}。純函式，可丟進執行緒池。"""
+    sizes = sizes or RENDITIONS
+    img = Image.open(io.BytesIO(data))
+    img.draft('RGB', (max(sizes.values()),) * 2)  # JPEG 直接以縮小比例解碼，省下大部分解碼時間
+    img = _to_rgb(ImageOps.exif_transpose(img))
+    out = {}
+    for name, px in sorted(sizes.items(), key=lambda kv: -kv[1]):
+        img = img.copy() if img.width <= px and img.height <= px else img.resize(_fit(img.size, px), Image.LANCZOS)
+        out[name] = _encode(img, mime)
+    return out
+
+def _fit(size, px):
+    w, h = size; r = px / max(w, h)
+    return max(1, round(w * r)), max(1, round(h * r))
+
+class ImageStore:
+    def __init__(self, root):
+        self.root = root; os.makedirs(root, exist_ok=True)
+        self.files = {}      # 雜湊 或 雜湊@版本 -> 檔名
+        self.sources = {}    # 原始上傳檔雜湊 -> 主圖雜湊 (重複上傳同一張不再重算)
+        self.remote = None   # Images 工作表已有的雜湊 (首次需要時才讀取 A 欄)
+        self.unavailable = set()
+        self.lock = threading.RLock()
+        for fn in os.listdir(root):
+            key, _, ext = fn.rpartition(".")
+            if key and not key.startswith(".") and ext in IMAGE_EXT.values(): self.files[key] = fn
+
+    @staticmethod
+    def digest(data): return hashlib.sha256(data).hexdigest()[:32]
+
+    def put(self, data, mime="image/jpeg", key=None):
+        key = key or self.digest(data)
+        if key not in self.files:
+            fn = f"{key}.{IMAGE_EXT.get(mime, 'jpg')}"; tmp = os.path.join(self.root, f".{fn}.{threading.get_ident()}")
+            with open(tmp, "wb") as f: f.write(data)
+            os.replace(tmp, os.path.join(self.root, fn))
+            with self.lock: self.files[key] = fn
+        return key
+
+    def ingest(self, data):
+        """原始上傳檔 -> 產生全部尺寸並存檔，回傳主圖雜湊；同一原檔只處理一次。"""
+        src = self.digest(data)
+        h = self.sources.get(src)
+        if h and all(f"{h}@{n}" in self.files for n in RENDITIONS if n != "detail"): return h
+        r = build_renditions(data)
+        h = self.put(r["detail"], IMAGE_MIME)
+        for name, b in r.items():
+            if name != "detail": self.put(b, IMAGE_MIME, f"{h}@{name}")
+        with self.lock: self.sources[src] = h
+        return h
+
+    def derive(self, h):
+        """由主圖補產生缺少的尺寸版本 (遷移來的舊圖或自備份還原後)。"""
+        fn = self.files.get(h)
+        if not fn: return
+        with open(os.path.join(self.root, fn), "rb") as f: data = f.read()
+        sizes = {n: px for n, px in RENDITIONS.items() if n != "detail" and f"{h}@{n}" not in self.files}
+        for name, b in build_renditions(data, sizes).items(): self.put(b, IMAGE_MIME, f"{h}@{name}")
+
+    def url(self, h, size="card"):
+        if size != "detail" and f"{h}@{size}" not in self.files and h in self.files:
+            try: self.derive(h)
+            except Exception: pass
+        fn = self.files.get(h if size == "detail" else f"{h}@{size}") or self.files.get(h)
+        return f"{IMAGE_URL_BASE}/{fn}" if fn else None
+
+    def remote_hashes(self, ws_images):
+        if self.remote is None:
+            col = retry_action(ws_images.col_values, 1) or []
+            with self.lock: self.remote = set(col[1:])
+        return self.remote
+
+    def record(self, h, mime, b64):
+        chunks = [b64[i:i + IMAGE_CELL_CHARS] for i in range(0, len(b64), IMAGE_CELL_CHARS)] or [""]
+        return [h, mime, get_taiwan_time_str(), len(chunks)] + chunks
+
+    def backup(self, h, ws_images, batch):
+        """主圖若雲端尚無備份，將備份列加入同一個 SheetBatch。"""
+        if ws_images is None or h in self.remote_hashes(ws_images) or h in pending_image_hashes(batch, ws_images): return
+        fn = self.files[h]
+        with open(os.path.join(self.root, fn), "rb") as f: data = f.read()
+        mime = next((m for m, e in IMAGE_EXT.items() if fn.endswith("." + e)), "image/jpeg")
+        batch.append(ws_images, self.record(h, mime, base64.b64encode(data).decode('ascii')))
+        batch.on_commit(lambda: self.remote.add(h))  # 送出成功才算已備份，之後重傳同一張圖不會再附加一列
+
+    def save(self, data, mime, ws_images, batch):
+        """既有圖檔原樣存為主圖 (不重新編碼) 並備份；回傳 img: 參照。"""
+        h = self.put(data, mime); self.backup(h, ws_images, batch)
+        return IMAGE_REF_PREFIX + h
+
+    def missing(self, refs):
+        return {h for h in refs if h not in self.files and h not in self.unavailable}
+
+    def ensure(self, refs, ws_images):
+        """本機缺檔時從 Images 工作表一次補齊 (每個行程每批雜湊最多讀一次)。"""
+        missing = self.missing(refs)
+        if not missing or ws_images is None: return
+        with self.lock:
+            missing = {h for h in missing if h not in self.files}
+            if not missing: return
+            rows = retry_action(ws_images.get_all_values) or []
+            self.remote = {r[0] for r in rows[1:] if r}
+            for r in rows[1:]:
+                if not r or r[0] not in missing or len(r) < 5: continue
+                try:
+                    n = int(r[3] or 1); data = base64.b64decode("".join(r[4:4 + n]))
+                    if self.digest(data) == r[0]: self.put(data, r[1], r[0])
+                except Exception: pass
+            self.unavailable |= {h for h in missing if h not in self.files}
+
+def pending_image_hashes(batch, ws_images):
+    return {r[0] for r in batch.appends.get(ws_images.id, (None, []))[1]}
+
+@st.cache_resource(show_spinner=False)
+def get_image_store():
+    return ImageStore(IMAGE_DIR)
+
+@st.cache_resource(show_spinner=False)
+def get_image_pool():
+    # Pillow 的解碼 / 縮圖 / 編碼都會釋放 GIL，執行緒池即可吃滿多核心，也不必把 Streamlit 腳本序列化進子行程
+    return ThreadPoolExecutor(max_workers=max(2, os.cpu_count() or 2), thread_name_prefix="img")
+
+def image_refs(urls):
+    return frozenset(u[len(IMAGE_REF_PREFIX):] for u in urls if isinstance(u, str) and u.startswith(IMAGE_REF_PREFIX))
+
+def render_image_url(url_input, size="card"):
+    if not url_input or pd.isna(url_input): return PLACEHOLDER_IMG
     s = str(url_input).strip()
+    if s.startswith(IMAGE_REF_PREFIX): return get_image_store().url(s[len(IMAGE_REF_PREFIX):], size) or PLACEHOLDER_IMG
     if s.startswith("http") or s.startswith("data:image"): return s
-    return "https://i.ibb.co/W31w56W/placeholder.png"
+    return PLACEHOLDER_IMG
 
-def process_image_to_base64(image_file):
+def process_image_to_ref(image_file, ws_images, batch):
     if not image_file: return None
     try:
-        img = Image.open(image_file)
-        if img.mode in ('RGBA', 'P'): 
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            background.paste(img, mask=img.split()[3] if len(img.split()) >= 4 else None)
-            img = background
-        img.thumbnail((350, 350))
-        output_buffer = io.BytesIO()
-        img.save(output_buffer, format="JPEG", quality=75) 
-        b64_str = base64.b64encode(output_buffer.getvalue()).decode('utf-8')
-        return f"data:image/jpeg;base64,{b64_str}"
+        h = get_image_store().ingest(image_file.getvalue()); get_image_store().backup(h, ws_images, batch)
+        return IMAGE_REF_PREFIX + h
     except Exception as e:
-        st.error(f"❌ 圖片壓縮與編碼失敗: {e}")
+        st.error(f"❌ 圖片壓縮與儲存失敗: {e}")
         return None
 
-def log_event(ws_logs, user, action, detail):
-    try: retry_action(ws_logs.append_row, [get_taiwan_time_str(), user, action, detail])
+def get_style_code(sku):
+    """款式代碼 = SKU 去掉尾端尺寸段 (TOP-2410-001-M -> TOP-2410-001)。"""
+    head, _, tail = str(sku).rpartition("-")
+    return head if head and tail in SIZE_ORDER else str(sku)
+
+# --- 批量上傳 (背景處理) ---
+class ImageJob:
+    """一批上傳檔在背景執行緒池產生各尺寸版本；畫面只輪詢進度，不會卡住。"""
+    def __init__(self, files):
+        store, pool = get_image_store(), get_image_pool()
+        self.names = [name for name, _ in files]
+        self.futures = {name: pool.submit(store.ingest, data) for name, data in files}
+        self.started = time.time()
+
+    @property
+    def done(self): return sum(f.done() for f in self.futures.values())
+
+    @property
+    def finished(self): return self.done == len(self.futures)
+
+    def results(self):
+        ok, err = {}, {}
+        for name, f in self.futures.items():
+            if not f.done(): continue
+            try: ok[name] = f.result()
+            except Exception as e: err[name] = str(e)
+        return ok, err
+
+def match_images_to_styles(names, skus):
+    """檔名 (不含副檔名) 對應款式代碼或完整 SKU，不分大小寫；回傳 {檔名: 款式代碼}。"""
+    styles = {}
+    for sku in skus: styles.setdefault(get_style_code(sku).upper(), get_style_code(sku)); styles.setdefault(str(sku).upper(), get_style_code(sku))
+    out = {}
+    for name in names:
+        stem = os.path.splitext(os.path.basename(name))[0].strip().upper()
+        if stem in styles: out[name] = styles[stem]
+    return out
+
+def apply_style_images(ws_items, ws_images, df, style_refs, chunk=40):
+    """把 {款式代碼: 主圖雜湊} 寫入該款全部尺寸的 Image_URL；每批一次 batchUpdate。回傳 (更新列數, 失敗批數)。"""
+    store = get_image_store(); style_of = df['SKU'].map(get_style_code)
+    skus = df.loc[style_of.isin(style_refs.keys()), 'SKU'].tolist(); done = failed = 0
+    for i in range(0, len(skus), chunk):
+        batch = SheetBatch(); live = locate_rows(ws_items, skus[i:i + chunk])
+        if live is None: failed += 1; continue
+        for sku, (row_num, vals) in live.items():
+            h = style_refs[get_style_code(sku)]; store.backup(h, ws_images, batch)
+            batch.update(ws_items, row_num, 9, IMAGE_REF_PREFIX + h)
+        n = len(batch.updates)
+        if n and batch.commit(): done += n
+        elif n: failed += 1
+    return done, failed
+
+def migrate_inline_images(ws_items, ws_images, df, chunk=40, progress=None):
+    """把 Items 內舊的 base64 data URI 轉存圖庫並改寫為 img: 參照；每批一次 batchUpdate。回傳 (轉換列數, 失敗批數)。"""
+    skus = df.loc[df['Image_URL'].astype(str).str.startswith("data:image"), 'SKU'].tolist()
+    store = get_image_store(); done = failed = 0
+    for i in range(0, len(skus), chunk):
+        batch = SheetBatch(); live = locate_rows(ws_items, skus[i:i + chunk])
+        if live is None: failed += 1; continue
+        for sku, (row_num, vals) in live.items():
+            cell = str(vals[8]) if len(vals) > 8 else ""
+            if not cell.startswith("data:image"): continue
+            try:
+                head, b64 = cell.split(",", 1); mime = head[5:].split(";")[0] or "image/jpeg"
+                batch.update(ws_items, row_num, 9, store.save(base64.b64decode(b64), mime, ws_images, batch))
+            except Exception: continue
+        n = len(batch.updates)
+        if n and batch.commit(): done += n
+        elif n: failed += 1
+        if progress: progress(min(i + chunk, len(skus)) / len(skus))
+    return done, failed
+
+def log_event(ws_logs, user, action, detail, batch=None):
+    if batch is not None: batch.append(ws_logs, [get_taiwan_time_str(), user, action, detail]); return
+    try: retry_action(ws_logs.append_row, [get_taiwan_time_str(), user, action, detail]); refresh_mirror(ws_logs.title)
     except: pass
 
 SIZE_ORDER = ["F", "XXS", "XS", "S", "M", "L", "XL", "2XL", "3XL", "4XL"]
-def get_size_sort_key(size_str): return SIZE_ORDER.index(size_str) if size_str in SIZE_ORDER else 99 
 
 def generate_smart_style_code(category, existing_skus):
     prefix_map = {"上衣(Top)": "TOP", "褲子(Btm)": "BTM", "外套(Out)": "OUT", "套裝(Suit)": "SET", "鞋類(Shoe)": "SHOE", "包款(Bag)": "BAG", "帽子(Hat)": "HAT", "飾品(Acc)": "ACC", "其他(Misc)": "MSC"}
@@ -243,36 +1191,535 @@ def generate_smart_style_code(category, existing_skus):
             except: pass
     return f"{prefix}-{str(max_seq + 1).zfill(3)}"
 
-def calculate_realized_revenue(logs_df):
-    total = 0
-    if logs_df.empty or 'Action' not in logs_df.columns: return 0
-    sales_logs = logs_df[logs_df['Action'] == 'Sale']
-    for _, row in sales_logs.iterrows():
-        try: 
-            match = re.search(r'Total:\s*\$?\s*(\d+)', str(row['Details']))
-            if match: total += int(match.group(1))
-        except: pass
-    return total
-
-def calculate_sunk_cost(logs_df, cost_map):
-    sunk_total = 0
-    if logs_df.empty or 'Action' not in logs_df.columns: return 0
-    int_logs = logs_df[logs_df['Action'] == 'Internal_Use']
-    for _, row in int_logs.iterrows():
-        try:
-            parts = str(row['Details']).split(' | ')
-            sku = parts[0].split(' -')[0].strip()
-            qty = int(parts[0].split(' -')[1])
-            
-            unit_cost = 0
-            if len(parts) > 4 and "Cost:" in parts[4]:
-                unit_cost = int(parts[4].replace("Cost:", "").strip())
+# ==========================================
+# 🧾 銷售帳本與指標引擎 (Sales Ledger & Metrics)
+# ==========================================
+# 每筆 Sale 日誌只解析一次：以列內容雜湊為鍵快取解析結果，Logs 每出一個新版本只解析新出現的列，
+# 且新列一律以 pandas 字串向量運算整批解析，不再逐列 re.search。
+SALES_COLUMNS = ["_SheetRow", "Timestamp", "ts", "date", "total", "channel", "payment", "seller", "items", "raw", "ok"]
+PARSED_SALE_COLUMNS = ["total", "channel", "payment", "seller", "items", "ok"]
+INTERNAL_COLUMNS = ["_SheetRow", "Timestamp", "sku", "qty", "user", "reason", "note", "unit_cost", "total_cost", "has_detail"]
+
+def _split_items(items_str):
+    if not isinstance(items_str, str): return None
+    return tuple((part.split(' x')[0].strip(), part.split(' x')[1].strip() if ' x' in part else "?") for part in items_str.split(','))
+
+def parse_sales_block(d, user):
+    """向量化解析 Sale 明細字串 (d, user 為同索引的 Series)。"""
+    d = d.astype(str); user = user.astype(str); d_bar = d + " |"
+    total = pd.to_numeric(d.str.extract(r'Total:\s*\$?\s*(\d+)', expand=False), errors='coerce').fillna(0).astype('int64')
+
+    ch_new = d_bar.str.extract(r'Channel:(.*?) \|', expand=False).str.strip()
+    ch_old = d.str.extract(r' \| (門市|官網|直播|網路|其他)', expand=False)
+    channel = ch_new.where(d.str.contains("Channel:", regex=False), ch_old.where(d.str.contains(" | ", regex=False))).fillna("未分類")
+
+    payment = d_bar.str.extract(r'Pay:(.*?) \|', expand=False).str.strip().where(d.str.contains("Pay:", regex=False)).fillna("未分類")
+
+    by = d.str.extract(r'By:([a-zA-Z0-9_\u4e00-\u9fa5]+)', expand=False)
+    seller = by.where(d.str.contains("By:", regex=False) & by.notna(), user)
+
+    items_str = d.str.extract(r'Items:(.*?) \|', expand=False)
+    has_items = d.str.contains("Items:", regex=False)
+    items = items_str.where(has_items).map(_split_items)
+    return pd.DataFrame({"total": total, "channel": channel, "payment": payment, "seller": seller, "items": items, "ok": ~has_items | items_str.notna()}, index=d.index)
+
+class SalesLedger:
+    def __init__(self):
+        self.parsed = pd.DataFrame(columns=PARSED_SALE_COLUMNS, index=pd.Index([], dtype='uint64'))
+        self.lock = threading.Lock()
+
+    def frame(self, logs_df):
+        if logs_df.empty or 'Action' not in logs_df.columns: return pd.DataFrame(columns=SALES_COLUMNS)
+        sales = logs_df[logs_df['Action'] == 'Sale']
+        if sales.empty: return pd.DataFrame(columns=SALES_COLUMNS)
+        keys = pd.util.hash_pandas_object(sales[['Timestamp', 'User', 'Details']].astype(str), index=False)
+        with self.lock:
+            fresh = ~keys.isin(self.parsed.index)
+            if fresh.any():
+                block = sales[fresh.values]
+                parsed = parse_sales_block(block['Details'], block['User'])
+                parsed.index = keys[fresh.values].values
+                parsed = parsed[~parsed.index.duplicated()]
+                self.parsed = parsed if self.parsed.empty else pd.concat([self.parsed, parsed])
+            out = self.parsed.loc[keys.values]
+        out.index = sales.index
+        ts_str = sales['Timestamp'].astype(str)
+        out.insert(0, "_SheetRow", sales.index + 2)
+        out.insert(1, "Timestamp", ts_str)
+        out.insert(2, "ts", pd.to_datetime(ts_str, format="%Y-%m-%d %H:%M:%S", errors="coerce"))
+        out.insert(3, "date", pd.to_datetime(ts_str.str.split(' ').str[0], format="%Y-%m-%d", errors="coerce"))
+        out["raw"] = sales['Details'].astype(str)
+        out["total"] = out["total"].astype('int64'); out["ok"] = out["ok"].astype(bool)
+        return out[SALES_COLUMNS]
+
+@st.cache_resource(show_spinner=False)
+def get_sales_ledger():
+    return SalesLedger()
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def load_sales_ledger(_logs_df, logs_version):
+    """依 Logs 版本快取的型別化銷售帳本 (唯讀共用，請勿原地修改)。"""
+    return get_sales_ledger().frame(_logs_df)
+
+def parse_internal_use(logs_df, cost_map):
+    """向量化解析 Internal_Use 日誌；無法解析數量或成本的列直接剔除 (與舊版 try/except 相同)。"""
+    if logs_df.empty or 'Action' not in logs_df.columns: return pd.DataFrame(columns=INTERNAL_COLUMNS)
+    iu = logs_df[logs_df['Action'] == 'Internal_Use']
+    if iu.empty: return pd.DataFrame(columns=INTERNAL_COLUMNS)
+    parts = iu['Details'].astype(str).str.split(' | ', regex=False)
+    head = parts.str[0].str.split(' -', regex=False)
+    sku = head.str[0].str.strip()
+    qty = pd.to_numeric(head.str[1].str.strip(), errors='coerce')
+    p4 = parts.str[4]
+    has_cost = p4.str.contains("Cost:", regex=False, na=False)
+    logged_cost = pd.to_numeric(p4.str.replace("Cost:", "", regex=False).str.strip(), errors='coerce')
+    unit_cost = logged_cost.where(has_cost, sku.map(cost_map).fillna(0))
+    valid = qty.notna() & (qty == qty.round()) & unit_cost.notna() & (unit_cost == unit_cost.round())
+    n_parts = parts.str.len()
+    out = pd.DataFrame({
+        "_SheetRow": iu.index + 2, "Timestamp": iu['Timestamp'], "sku": sku,
+        "qty": qty.fillna(0).astype('int64'), "user": parts.str[1].str.strip(), "reason": parts.str[2].str.strip(),
+        "note": parts.str[3].str.strip().where(n_parts > 3, ""), "unit_cost": unit_cost.fillna(0).astype('int64'),
+        "has_detail": n_parts >= 3
+    }, index=iu.index)[valid]
+    out["total_cost"] = out["unit_cost"] * out["qty"]
+    return out[INTERNAL_COLUMNS]
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def load_internal_use(_logs_df, _cost_map, logs_version, items_version):
+    return parse_internal_use(_logs_df, _cost_map)
+
+def summarize_sales(sales_df):
+    """單次彙總：營收與通路 / 付款 / 人員小計。"""
+    if sales_df.empty: return {"revenue": 0, "count": 0, "by_channel": {}, "by_payment": {}, "by_staff": {}}
+    total = sales_df['total']
+    return {
+        "revenue": int(total.sum()), "count": int(len(sales_df)),
+        "by_channel": total.groupby(sales_df['channel']).sum().to_dict(),
+        "by_payment": total.groupby(sales_df['payment']).sum().to_dict(),
+        "by_staff": total.groupby(sales_df['seller']).sum().to_dict(),
+    }
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def load_log_metrics(_sales_df, _internal_df, logs_version, items_version):
+    """全期指標 (已售營收、沉沒成本與各維度小計)，依資料版本記憶。"""
+    metrics = summarize_sales(_sales_df)
+    metrics["sunk_cost"] = int(_internal_df['total_cost'].sum()) if not _internal_df.empty else 0
+    return metrics
+
+# ==========================================
+# 🗄️ 日誌歸檔 (Logs Partitions)
+# ==========================================
+# 已結束的月份整月搬到 Logs_YYYYMM 分區表：附加分區、寫入 Archive_Index、刪除熱表列在同一次 batchUpdate 完成，
+# Logs 熱表只留當期。索引記下每個分區的營收與沉沒成本，全期指標不必讀分區；戰情室與稽核看板只在
+# 選取的日期區間涵蓋到封存月份時才同步並讀取對應分區 (分區不再變動，鏡像同步一次即可長期使用)。
+ARCHIVE_INDEX = "Archive_Index"
+ARCHIVE_INDEX_HEADERS = ["Sheet", "Month", "Rows", "Revenue", "Sunk_Cost", "Archived_At", "Archived_By"]
+ARCHIVE_GRACE = JOURNAL_KEEP + 86400   # 月底後的保留期：須長於離線佇列保存期，重播比對 Ref 時原始日誌仍在熱表
+ARCHIVE_TS = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+def archive_cutoff():
+    """早於此時間字串的日誌可封存：(台灣時間 - 保留期) 所在月份的月初。"""
+    return (datetime.utcnow() + timedelta(hours=8) - timedelta(seconds=ARCHIVE_GRACE)).strftime("%Y-%m-01 00:00:00")
+
+def plan_log_archive(values, cutoff):
+    """{月份 YYYYMM: [列號]}：Timestamp 早於 cutoff 的列依月份分組；無法辨識時間的列留在熱表。"""
+    plan = {}
+    for i, r in enumerate(values[1:]):
+        ts = str(r[0]) if r else ""
+        if ARCHIVE_TS.match(ts) and ts < cutoff: plan.setdefault(ts[:4] + ts[5:7], []).append(i + 2)
+    return plan
+
+class LogArchive:
+    def __init__(self, index_df):
+        self.parts = {}; self.rows = self.revenue = self.sunk_cost = 0
+        if not index_df.empty:
+            nums = {c: pd.to_numeric(index_df[c], errors='coerce').fillna(0).astype('int64') for c in ["Rows", "Revenue", "Sunk_Cost"]}
+            valid = index_df['Month'].astype(str).str.fullmatch(r"\d{6}")
+            self.parts = dict(zip(index_df.loc[valid, 'Month'].astype(str).tolist(), index_df.loc[valid, 'Sheet'].astype(str).tolist()))
+            self.rows, self.revenue, self.sunk_cost = (int(nums[c][valid].sum()) for c in ["Rows", "Revenue", "Sunk_Cost"])
+        self.months = sorted(self.parts)
+
+    @property
+    def hot_start(self):
+        """熱表涵蓋的第一天 (最後一個封存月份的下個月一日)；尚未封存過回傳 None。"""
+        if not self.months: return None
+        y, m = int(self.months[-1][:4]), int(self.months[-1][4:])
+        return date(y + m // 12, m % 12 + 1, 1)
+
+    def sheets_for(self, start_d, end_d):
+        lo, hi = start_d.strftime("%Y%m"), end_d.strftime("%Y%m")
+        return [self.parts[m] for m in self.months if lo <= m <= hi]
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _load_log_archive(_index_df, version):
+    return LogArchive(_index_df)
+
+def get_log_archive(ws_index):
+    index_df = get_data_safe(ws_index, ARCHIVE_INDEX_HEADERS); version = sheet_version(ARCHIVE_INDEX)
+    return LogArchive(index_df) if ws_index is None or version is None else _load_log_archive(index_df, version)
+
+def archived_logs(sh, archive, start_d, end_d):
+    """日期區間需要的封存分區 [(分區名, 日誌 DataFrame, 版本)]；區間都在熱表內時不碰任何分區。"""
+    titles = archive.sheets_for(start_d, end_d)
+    if not titles: return []
+    wss = get_registry(sh).resolve({t: LOG_HEADERS for t in titles})
+    sync_sheets_batch(sh, [t for t, ws in wss.items() if ws is not None])
+    return [(t, get_data_safe(ws, LOG_HEADERS), sheet_version(t)) for t, ws in wss.items() if ws is not None]
+
+# 封存列的 _SheetRow 設為 0：列號屬於分區表，不可拿去編修熱表
+@st.cache_resource(max_entries=24, show_spinner=False)
+def _archived_sales(_part_df, title, version):
+    return get_sales_ledger().frame(_part_df).assign(_SheetRow=0)
+
+@st.cache_resource(max_entries=24, show_spinner=False)
+def _archived_internal_use(_part_df, _cost_map, title, version):
+    return parse_internal_use(_part_df, _cost_map).assign(_SheetRow=0)
+
+def sales_in_range(sh, archive, sales_df, start_d, end_d):
+    frames = [_archived_sales(d, t, v) for t, d, v in archived_logs(sh, archive, start_d, end_d)] + [sales_df]
+    rng = pd.concat(frames, ignore_index=True) if len(frames) > 1 else sales_df
+    return rng[rng['ok'] & (rng['total'] > 0) & (rng['date'] >= pd.Timestamp(start_d)) & (rng['date'] <= pd.Timestamp(end_d))]
+
+def internal_use_in_range(sh, archive, internal_df, cost_map, start_d, end_d):
+    frames = [_archived_internal_use(d, cost_map, t, v) for t, d, v in archived_logs(sh, archive, start_d, end_d)] + [internal_df]
+    rng = pd.concat(frames, ignore_index=True) if len(frames) > 1 else internal_df
+    day = pd.to_datetime(rng['Timestamp'].astype(str).str.split(' ').str[0], format="%Y-%m-%d", errors="coerce")
+    return rng[(day >= pd.Timestamp(start_d)) & (day <= pd.Timestamp(end_d))]
+
+def archive_closed_logs(sh, ws_logs, ws_index, cost_map, user, progress=None):
+    """逐月把已結束月份的日誌搬到分區表 (由舊到新)，每個月一次 batchUpdate；每月搬移前都整表同步 Logs 取得正確列號。
+    回傳 (已搬移列數, 已完成月份數, 失敗的月份或 None)；中途失敗可再次執行續做。"""
+    cutoff = archive_cutoff(); moved = done = 0
+    refresh_mirror(ws_logs.title, full=True); sync_sheet(ws_logs)
+    total = len(plan_log_archive(get_mirror().read(ws_logs.title), cutoff))
+    for _ in range(total):
+        values = get_mirror().read(ws_logs.title); plan = plan_log_archive(values, cutoff)
+        if not plan: break
+        month = min(plan); rows = plan[month]; title = f"{COLD_PREFIX}{month}"
+        ws_part = get_worksheet_safe(sh, title, LOG_HEADERS)
+        if ws_part is None: return moved, done, month
+        data = [(list(values[r - 1]) + [""] * len(LOG_HEADERS))[:len(LOG_HEADERS)] for r in rows]
+        part_df = pd.DataFrame(data, columns=LOG_HEADERS)
+        revenue = summarize_sales(get_sales_ledger().frame(part_df))["revenue"]
+        internal = parse_internal_use(part_df, cost_map); sunk = int(internal['total_cost'].sum()) if not internal.empty else 0
+        batch = SheetBatch()
+        batch.append_rows(ws_part, data)
+        batch.append(ws_index, [title, month, len(rows), revenue, sunk, get_taiwan_time_str(), user])
+        for r in rows: batch.delete_row(ws_logs, r)
+        if not verify_log_rows(ws_logs, {r: log_row_key(values[r - 1]) for r in rows}): return moved, done, month
+        try: ok = batch.commit()
+        except Exception: ok = False
+        if not ok: return moved, done, month
+        moved += len(rows); done += 1
+        if progress: progress(done / total)
+        sync_sheet(ws_logs)
+    return moved, done, None
+
+# ==========================================
+# 🔎 商品搜尋索引 (Search Index)
+# ==========================================
+# 每列預先串好小寫的 SKU / 品名 / 分類 / 尺寸，再建 n-gram 倒排索引：查詢時取查詢字串各 gram 的
+# 位置清單求交集，只對少量候選列做子字串確認。索引以搜尋文字內容雜湊快取，庫存數量異動不會觸發重建。
+SEARCH_FIELDS = ["SKU", "Name", "Category", "Size"]
+SEARCH_GRAM = 3
+
+class SearchIndex:
+    def __init__(self, text, skus):
+        self.text = text; self.skus = skus; self.n = len(text)
+        self.postings = {}; self.memo = {}
+        self.lock = threading.Lock()
+        self.sku_pos = {}
+        for i, s in enumerate(skus): self.sku_pos.setdefault(s, []).append(i)
+        self._grams(SEARCH_GRAM)
+
+    def _grams(self, n):
+        # 各長度的倒排表在第一次需要時才建立 (短查詢才用得到 1/2-gram)
+        if n not in self.postings:
+            post = {}
+            for i, t in enumerate(self.text):
+                for g in {t[j:j + n] for j in range(len(t) - n + 1)}: post.setdefault(g, []).append(i)
+            self.postings[n] = {g: np.asarray(v, dtype=np.int32) for g, v in post.items()}
+        return self.postings[n]
+
+    def lookup(self, query):
+        """回傳 (位置, 排名層級)；層級 0=SKU 完全相符、1=SKU 前綴、2=其餘子字串相符。"""
+        q = str(query).strip().lower()
+        if not q: return np.arange(self.n, dtype=np.int32), np.full(self.n, 2, dtype=np.int8)
+        with self.lock:
+            if q in self.memo: return self.memo[q]
+            n = min(SEARCH_GRAM, len(q)); post = self._grams(n)
+            lists = [post.get(g) for g in {q[j:j + n] for j in range(len(q) - n + 1)}]
+            if any(a is None for a in lists): cand = np.empty(0, dtype=np.int32)
             else:
-                unit_cost = cost_map.get(sku, 0)
-                
-            sunk_total += (unit_cost * qty)
-        except: pass
-    return sunk_total
+                lists.sort(key=len); cand = lists[0]
+                for a in lists[1:]:
+                    if len(cand) == 0: break
+                    cand = np.intersect1d(cand, a, assume_unique=True)
+                if len(q) > n: cand = np.fromiter((i for i in cand if q in self.text[i]), dtype=np.int32)
+            tier = np.full(len(cand), 2, dtype=np.int8)
+            if len(cand):
+                tier[np.char.startswith(self.skus[cand], q)] = 1
+                tier[self.skus[cand] == q] = 0
+                order = np.lexsort((cand, tier)); cand, tier = cand[order], tier[order]
+            if len(self.memo) > 256: self.memo.clear()
+            self.memo[q] = (cand, tier)
+            return cand, tier
+
+    def search(self, query):
+        return self.lookup(query)[0]
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _build_search_index(_text, _skus, digest):
+    return SearchIndex(_text, _skus)
+
+def get_search_index(df):
+    if df.empty: return SearchIndex([], np.array([], dtype=str))
+    cols = df.reindex(columns=SEARCH_FIELDS).fillna("").astype(str)
+    text = (cols['SKU'] + "\x1f" + cols['Name'] + "\x1f" + cols['Category'] + "\x1f" + cols['Size']).str.lower()
+    digest = hashlib.sha1(pd.util.hash_pandas_object(text, index=False).values.tobytes()).hexdigest()
+    return _build_search_index(text.tolist(), cols['SKU'].str.strip().str.lower().to_numpy(dtype=str), digest)
+
+# --- 日誌 SKU 翻譯 (單次掃描) ---
+# 所有 SKU 合成一條前綴樹化的交替式正規表示式，一次掃描即替換完整段文字 (較長 SKU 優先)；
+# 翻譯結果依原文記憶，只在品項內容 (SKU / 品名 / 尺寸) 改變時重建。
+def _trie_pattern(node):
+    alts = [re.escape(ch) + _trie_pattern(sub) for ch, sub in sorted(node.items()) if ch]
+    if not alts: return ""
+    body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+    return f"(?:{body})?" if "" in node else body
+
+class SkuTranslator:
+    def __init__(self, product_map):
+        self.repl = {str(k): f"[{v}]" for k, v in product_map.items() if str(k)}
+        trie = {}
+        for sku in self.repl:
+            node = trie
+            for ch in sku: node = node.setdefault(ch, {})
+            node[""] = {}
+        self.pattern = re.compile(_trie_pattern(trie)) if self.repl else None
+        self.memo = {}; self.lock = threading.Lock()
+
+    def translate(self, txt):
+        txt = str(txt)
+        if self.pattern is None: return txt
+        out = self.memo.get(txt)
+        if out is None:
+            out = self.pattern.sub(lambda m: self.repl[m.group(0)], txt)
+            with self.lock:
+                if len(self.memo) > 500000: self.memo.clear()
+                self.memo[txt] = out
+        return out
+
+    def translate_series(self, s):
+        return pd.Series([self.translate(t) for t in s.astype(str).tolist()], index=s.index, dtype=object)
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _build_sku_translator(_product_map, digest):
+    return SkuTranslator(_product_map)
+
+def get_sku_translator(product_map):
+    digest = hashlib.sha1("\x1e".join(f"{k}\x1f{v}" for k, v in product_map.items()).encode()).hexdigest()
+    return _build_sku_translator(product_map, digest)
+
+# ==========================================
+# 📦 商品快照 (Items Snapshot)
+# ==========================================
+# Items 每個版本只轉型一次並由所有連線共用：數量為 int32、分類 / 尺寸 / 幣別為 categorical，
+# 另附 SKU 對照表。快照為唯讀物件，畫面端只可切片或 assign 出新表，不可原地改欄位。
+ITEM_TEXT_COLS = ["SKU", "Name", "Category", "Size", "Last_Updated", "Image_URL", "Orig_Currency"]
+ITEM_QTY_COLS = ["Qty", "Qty_CN", "Safety_Stock"]
+ITEM_MONEY_COLS = ["Price", "Cost", "Orig_Cost"]
+ITEM_CAT_COLS = ["Category", "Size", "Orig_Currency"]
+
+class StyleIndex:
+    """款式 (品名) → 列位置的分組索引：款式依品名排序、款內依尺寸排序，並預先彙總每款的台灣 / 中國庫存與補貨建議。
+    列位置對應快照 df，分頁只需切片 styles，不必每頁對整張表重新過濾。"""
+    def __init__(self, df):
+        codes, self.names = pd.factorize(df['Name'].astype(str), sort=True)
+        size_rank = pd.Categorical(df['Size'].astype(str), categories=SIZE_ORDER, ordered=True).codes
+        size_rank = np.where(size_rank < 0, len(SIZE_ORDER), size_rank)
+        self.order = np.lexsort((np.arange(len(df)), size_rank, codes))
+        self.style_of = codes[self.order]
+        self.starts = np.searchsorted(self.style_of, np.arange(len(self.names) + 1))
+        self.totals = self._aggregate(df, self.order, self.style_of, len(self.names))
+
+    @staticmethod
+    def _aggregate(df, rows, seg, n):
+        qty = df['Qty'].to_numpy()[rows]; safe = df['Safe_Level'].to_numpy()[rows]; low = qty < safe
+        return {"tw": np.bincount(seg, qty, n).astype('int64'), "cn": np.bincount(seg, df['Qty_CN'].to_numpy()[rows], n).astype('int64'),
+                "restock": np.bincount(seg, np.where(low, safe - qty, 0), n).astype('int64'), "warn": np.bincount(seg, low, n) > 0}
+
+    def select(self, positions):
+        mask = np.zeros(len(self.order), dtype=bool); mask[positions] = True
+        return mask
+
+    def styles(self, mask=None):
+        """有符合列的款式編號 (依品名排序)；mask 為對應 df 的布林陣列。"""
+        return np.arange(len(self.names)) if mask is None else np.unique(self.style_of[mask[self.order]])
+
+    def rows(self, style, mask=None):
+        r = self.order[self.starts[style]:self.starts[style + 1]]
+        return r if mask is None else r[mask[r]]
+
+    def page(self, df, styles, mask=None, exact=True):
+        """回傳 [(款式編號, 依尺寸排序的列位置)] 與該頁彙總；exact=False (有篩選或畫面庫存被疊加) 時只針對本頁重算。"""
+        rows = [self.rows(s, mask) for s in styles]
+        if exact and mask is None: totals = {k: v[styles] for k, v in self.totals.items()}
+        else:
+            flat = np.concatenate(rows) if rows else np.array([], dtype='int64')
+            totals = self._aggregate(df, flat, np.repeat(np.arange(len(rows)), [len(r) for r in rows]), len(rows))
+        return list(zip(styles.tolist(), rows)), totals
+
+class ItemsSnapshot:
+    def __init__(self, raw_df):
+        df = raw_df.copy()
+        for c in ITEM_TEXT_COLS:
+            if c not in df.columns: df[c] = ""
+        for c in ITEM_QTY_COLS + ITEM_MONEY_COLS:
+            num = pd.to_numeric(df[c], errors='coerce').fillna(0) if c in df.columns else pd.Series(0, index=df.index)
+            df[c] = num.astype('int32' if c in ITEM_QTY_COLS else 'int64')
+        df['Safe_Level'] = df['Safety_Stock'].where(df['Safety_Stock'] != 0, 5).astype('int32')
+        df['SKU'] = df['SKU'].astype(str)
+        for c in ITEM_CAT_COLS: df[c] = df[c].astype(str).astype('category')
+        self.df = df.reset_index(drop=True)
+
+        skus = self.df['SKU'].tolist()
+        self.product_map = dict(zip(skus, (self.df['Name'].astype(str) + " (" + self.df['Size'].astype(str) + ")").tolist()))
+        self.cost_map = dict(zip(skus, self.df['Cost'].tolist()))
+        self.sku_pos = {s: i for i, s in reversed(list(enumerate(skus)))}
+        self.image_refs = image_refs(self.df['Image_URL'].tolist())
+        self.search = get_search_index(self.df)
+        self._translator = None; self._styles = None
+
+    def row(self, sku):
+        """依 SKU 取第一筆資料列 (Series)；找不到回傳 None。"""
+        pos = self.sku_pos.get(str(sku))
+        return None if pos is None else self.df.iloc[pos]
+
+    @property
+    def styles(self):
+        if self._styles is None: self._styles = StyleIndex(self.df)
+        return self._styles
+
+    @property
+    def translator(self):
+        if self._translator is None: self._translator = get_sku_translator(self.product_map)
+        return self._translator
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _load_items_snapshot(version):
+    return ItemsSnapshot(_values_to_df(get_mirror().read("Items"), SHEET_HEADERS))
+
+def get_items_snapshot(_ws):
+    version = ensure_mirror(_ws) if _ws is not None else None
+    if version is None: return ItemsSnapshot(pd.DataFrame(columns=SHEET_HEADERS))
+    return _load_items_snapshot(version)
+
+# --- POS 購物車 (以 SKU 為鍵) ---
+# 車內只存 {SKU: 數量}，同一件重複掃描只累加數量；品名 / 售價 / 成本 / 現貨結算時由 SKU 索引一次取出。
+CART_INFO_COLS = ['Name', 'Size', 'Price', 'Cost', 'Qty']
+
+class Cart:
+    def __init__(self):
+        self.lines = {}   # SKU -> 數量，依首次加入排序
+
+    def __bool__(self): return bool(self.lines)
+    def __len__(self): return len(self.lines)
+
+    def qty(self, sku): return self.lines.get(sku, 0)
+    def add(self, sku, qty=1): self.lines[sku] = self.lines.get(sku, 0) + qty
+    def clear(self): self.lines.clear()
+
+    def frame(self, df, sku_pos):
+        """購物車明細：SKU / qty 加上商品表對應列的 Name / Size / Price / Cost / Qty(現貨) 與 subtotal。
+        sku_pos 為快照的 SKU → 列位置索引 (df 須與快照同列序)；已不在快照中的 SKU 資訊欄為空值。"""
+        out = pd.DataFrame({'SKU': list(self.lines), 'qty': list(self.lines.values())}, columns=['SKU', 'qty'])
+        pos = out['SKU'].map(sku_pos); hit = pos.notna().to_numpy()
+        out = out.join(df[CART_INFO_COLS].iloc[pos[hit].astype('int64').tolist()].set_axis(out.index[hit]))
+        out['subtotal'] = out['Price'] * out['qty']
+        return out
+
+    def deltas(self):
+        return {sku: {5: -q} for sku, q in self.lines.items()}
+
+def validate_cart(lines):
+    """整張購物車一次比對現貨 (Cart.frame 的結果)：回傳格式同 commit_stock_deltas 的
+    ("ok", None) / ("missing", SKU) / ("short", (SKU, 現有量))。"""
+    missing = lines.loc[lines['Qty'].isna(), 'SKU']
+    if len(missing): return "missing", missing.iloc[0]
+    short = lines[lines['Qty'] < lines['qty']]
+    if len(short): return "short", (short['SKU'].iloc[0], int(short['Qty'].iloc[0]))
+    return "ok", None
+
+# --- 連續掃描暫存 ---
+# 掃描槍每按一次 Enter 只重跑掃描區這個小 fragment：條碼對記憶體中的 SKU 索引解析後累計在暫存，
+# 掃完一疊再一次併入購物車 (整頁只重跑一次)。
+SCAN_RECENT = 8
+
+class ScanBuffer:
+    def __init__(self):
+        self.counts = {}; self.unknown = []; self.recent = []; self.notice = None
+
+    @property
+    def total(self): return sum(self.counts.values())
+
+    def feed(self, text, sku_pos):
+        """解析一次輸入 (掃描槍連發時可能黏成一串，以空白 / 逗號切開)；回傳本次解析成功的件數。"""
+        hit = 0
+        for code in re.split(r'[\s,;]+', text.strip()):
+            if not code: continue
+            sku = code if code in sku_pos else code.upper() if code.upper() in sku_pos else None
+            if sku is None: self.unknown.append(code); continue
+            self.counts[sku] = self.counts.get(sku, 0) + 1; hit += 1
+            if sku in self.recent: self.recent.remove(sku)
+            self.recent.append(sku)
+        self.recent = self.recent[-SCAN_RECENT:]; self.unknown = self.unknown[-SCAN_RECENT:]
+        return hit
+
+    def flush(self, cart, df, sku_pos):
+        """併入購物車 (不超過現貨扣掉車內已有的量)；回傳 (加入件數, {SKU: 超出未加入件數})。
+        掃描後才被刪除 / 改名的 SKU 不加入，與掃不到的條碼一樣列在 unknown。"""
+        added, over, gone = 0, {}, []
+        for sku, n in self.counts.items():
+            pos = sku_pos.get(sku)
+            if pos is None: gone.append(sku); continue
+            room = max(0, int(df['Qty'].iat[pos]) - cart.qty(sku)); take = min(n, room)
+            if take: cart.add(sku, take); added += take
+            if n > take: over[sku] = n - take
+        self.clear(); self.unknown = gone[-SCAN_RECENT:]
+        return added, over
+
+    def clear(self):
+        self.counts = {}; self.unknown = []; self.recent = []
+
+def render_bulk_image_job(sh, ws_items, df):
+    job = st.session_state.get('img_job')
+    if job is None: return
+    n = len(job.futures); done = job.done
+    if not job.finished:
+        st.progress(done / n, text=f"⏳ 背景處理中 {done}/{n} 張，可繼續操作其他功能")
+        return
+    ok, err = job.results()
+    st.progress(1.0, text=f"✅ 已產生 {len(ok)} 張多尺寸圖片 ({time.time() - job.started:.1f}s)")
+    matched = match_images_to_styles(ok.keys(), df['SKU'].tolist())
+    if matched: st.dataframe(pd.DataFrame({"檔名": list(matched.keys()), "款式代碼": list(matched.values())}), use_container_width=True, hide_index=True)
+    unmatched = [name for name in ok if name not in matched]
+    if unmatched: st.warning(f"找不到對應款式：{', '.join(unmatched[:20])}{' ...' if len(unmatched) > 20 else ''}")
+    if err: st.error(f"無法解析：{', '.join(err)}")
+    c_a1, c_a2 = st.columns(2)
+    if c_a1.button(f"✅ 套用到 {len(set(matched.values()))} 個款式", type="primary", disabled=not matched, use_container_width=True):
+        with st.spinner("寫入商品圖片中..."):
+            style_refs = {matched[name]: ok[name] for name in matched}
+            done_rows, failed = apply_style_images(ws_items, get_worksheet_safe(sh, "Images", IMAGE_HEADERS), df, style_refs)
+        if failed: st.warning(f"已更新 {done_rows} 列，{failed} 批寫入失敗，可再按一次續傳。")
+        else: del st.session_state['img_job']; st.success(f"已更新 {done_rows} 列商品圖片"); time.sleep(1); st.rerun()
+    if c_a2.button("🧹 清除此批", use_container_width=True): del st.session_state['img_job']; st.rerun()
+
+def _poll_bulk_image_job(sh, ws_items, df):
+    job = st.session_state.get('img_job')
+    if job is not None and job.finished: st.rerun()
+    render_bulk_image_job(sh, ws_items, df)
 
 def render_navbar(user_initial):
     d_str = (datetime.utcnow() + timedelta(hours=8)).strftime("%Y/%m/%d")
@@ -302,92 +1749,177 @@ def get_staff_color_map(users_list):
     PALETTE = ["#2563EB", "#059669", "#7C3AED", "#DB2777", "#D97706", "#DC2626", "#0891B2", "#4F46E5", "#BE123C", "#B45309"]
     return {u: PALETTE[i % len(PALETTE)] for i, u in enumerate(sorted([x for x in users_list if x != "全店"]))}
 
-@st.cache_resource(show_spinner=False)
-def setup_matplotlib_chinese():
-    font_path = "NotoSansTC.ttf"
-    if not os.path.exists(font_path):
-        try:
-            url = "https://github.com/google/fonts/raw/main/ofl/notosanstc/NotoSansTC-Regular.ttf"
-            r = requests.get(url, timeout=20)
-            if r.status_code == 200:
-                with open(font_path, 'wb') as f: f.write(r.content)
-        except: pass
-            
-    if os.path.exists(font_path):
-        fm.fontManager.addfont(font_path)
-        prop = fm.FontProperties(fname=font_path)
-        plt.rcParams['font.family'] = prop.get_name()
-        return True
-    return False
+# 中文字型依序使用：專案內 fonts/、舊版下載位置、本機快取、系統已安裝的 CJK 字型 (Streamlit Cloud 由 packages.txt 安裝
+# fonts-noto-cjk)；全部找不到才下載一次到快取。matplotlib 在第一次畫班表時才載入，登入頁與一般分頁不必付出匯入成本。
+FONT_FILE = "NotoSansTC-Regular.ttf"
+FONT_URL = f"https://github.com/google/fonts/raw/main/ofl/notosanstc/{FONT_FILE}"
+FONT_CACHE_DIR = os.environ.get("IFUKUK_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ifukuk"))
+FONT_CANDIDATES = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts", FONT_FILE), "NotoSansTC.ttf", os.path.join(FONT_CACHE_DIR, FONT_FILE)]
+CJK_FONT_FAMILIES = ["Noto Sans CJK TC", "Noto Sans TC", "Noto Sans CJK JP", "Noto Sans CJK SC", "Microsoft JhengHei", "PingFang TC", "Heiti TC", "WenQuanYi Zen Hei", "AR PL UMing TW"]
+
+def load_px():
+    import plotly.express as px
+    return px
 
-def generate_roster_image_buffer(year, month, shifts_df, days_in_month, color_map):
+def _download_font():
     try:
-        setup_matplotlib_chinese()
-        fig, ax = plt.subplots(figsize=(14, 10), facecolor='#f8fafc')
-        ax.axis('off')
-        
-        ax.text(0.5, 0.95, f"IFUKUK 專業排班表 - {year}/{month}", ha='center', va='center', fontsize=26, color='#0f172a')
-        
-        cols = ["週一 Mon", "週二 Tue", "週三 Wed", "週四 Thu", "週五 Fri", "週六 Sat", "週日 Sun"]
-        cal = calendar.monthcalendar(year, month)
-        table_data = [cols]
-        
-        for week in cal:
-            row_data = []
-            for day in week:
-                if day == 0: row_data.append("")
-                else:
-                    date_str = f"{year}-{str(month).zfill(2)}-{str(day).zfill(2)}"
-                    day_shifts = shifts_df[shifts_df['Date'] == date_str]
-                    is_closed = any((r['Staff'] == "全店" and r['Type'] == "公休") for _, r in day_shifts.iterrows())
-                    
-                    cell_text = f"{day}\n"
-                    if is_closed: cell_text += "\n[全店公休]"
-                    else:
-                        for _, r in day_shifts.iterrows():
-                            s_short = r['Type'].replace("早班","早").replace("晚班","晚").replace("全班","全").replace("公休","休")
-                            cell_text += f"● {r['Staff']} ({s_short})\n"
-                    row_data.append(cell_text.strip())
-            table_data.append(row_data)
-
-        table = ax.table(cellText=table_data, loc='center', cellLoc='center', bbox=[0, 0, 1, 0.9])
-        table.auto_set_font_size(False)
-        table.set_fontsize(14) 
-        
-        for (i, j), cell in table.get_celld().items():
-            cell.set_edgecolor('#cbd5e1')
-            if i == 0:
-                cell.set_facecolor('#e2e8f0')
-                cell.set_height(0.06)
-                cell.get_text().set_color('#0f172a') 
+        r = requests.get(FONT_URL, timeout=8)
+        if r.status_code != 200: return None
+        os.makedirs(FONT_CACHE_DIR, exist_ok=True); path = FONT_CANDIDATES[-1]
+        with open(path + ".part", 'wb') as f: f.write(r.content)
+        os.replace(path + ".part", path)
+        return path
+    except Exception: return None
+
+@st.cache_resource(show_spinner=False)
+def setup_matplotlib_chinese():
+    import matplotlib
+    from matplotlib import font_manager as fm
+    path = next((p for p in FONT_CANDIDATES if os.path.exists(p)), None)
+    if path is None:
+        installed = {f.name for f in fm.fontManager.ttflist}
+        family = next((f for f in CJK_FONT_FAMILIES if f in installed), None)
+        if family: matplotlib.rcParams['font.family'] = family; return True
+        path = _download_font()
+    if path is None: return False
+    fm.fontManager.addfont(path)
+    matplotlib.rcParams['font.family'] = fm.FontProperties(fname=path).get_name()
+    return True
+
+class RosterMonth:
+    """單月排班：一次掃描建立 日期 → 當日班表 (保留原始順序) 與全店公休旗標，月曆、列表、編輯區、LINE 文字與截圖共用。"""
+    def __init__(self, shifts_df, year, month):
+        self.year, self.month = year, month; self.prefix = f"{year}-{month:02d}"
+        self.days = {}; self.closed = set(); self.digest = self.prefix
+        if shifts_df.empty: return
+        m = shifts_df[shifts_df['Date'].astype(str).str.startswith(self.prefix)]
+        for d, staff, typ, note in zip(m['Date'].tolist(), m['Staff'].tolist(), m['Type'].tolist(), m['Note'].tolist()):
+            self.days.setdefault(d, []).append({"Staff": staff, "Type": typ, "Note": note})
+            if staff == "全店" and typ == "公休": self.closed.add(d)
+        self.digest = hashlib.sha1(json.dumps([self.prefix, self.days], ensure_ascii=False, sort_keys=True, default=str).encode()).hexdigest()
+
+    def date_str(self, day): return f"{self.prefix}-{day:02d}"
+
+    def shifts(self, date_str): return self.days.get(date_str, [])
+
+    def ordered(self):
+        """LINE 通告用：依日期、人員排序的 (日期, 班表)。"""
+        return [(d, r) for d in sorted(self.days) for r in sorted(self.days[d], key=lambda r: r['Staff'])]
+
+@st.cache_resource(max_entries=12, show_spinner=False)
+def _roster_month(_shifts_df, version, year, month):
+    return RosterMonth(_shifts_df, year, month)
+
+def get_roster_month(shifts_df, version, year, month):
+    if version is None: return RosterMonth(shifts_df, year, month)
+    return _roster_month(shifts_df, version, year, month)
+
+def replace_shifts(ws_shifts, dates, drop, rows=()):
+    """刪除指定日期中 drop(列值) 為真的排班並附加新列，一次 SheetBatch 寫入；列號由鏡像索引定位、寫入前逐列驗證。"""
+    found = locate_groups(ws_shifts, dates)
+    if found is None: st.error("⚠️ 連線忙碌，請重試"); return False
+    batch = SheetBatch()
+    for hits in found.values():
+        for row_num, vals in hits:
+            if drop(vals): batch.delete_row(ws_shifts, row_num)
+    batch.append_rows(ws_shifts, rows)
+    return batch.commit()
+
+# --- 班表截圖 (背景渲染 + 快取) ---
+# 以 (班表內容雜湊, dpi) 為鍵快取 PNG；排班一變動就由單一背景執行緒先畫好預覽與高清兩種解析度，
+# 按下截圖時多半已完成。matplotlib 只用物件式 Figure API，不碰 pyplot 的全域狀態。
+ROSTER_FULL_DPI, ROSTER_PREVIEW_DPI = 200, 72
+ROSTER_CACHE_SIZE = 24
+
+def render_roster_png(roster, dpi=ROSTER_FULL_DPI):
+    from matplotlib.figure import Figure
+    setup_matplotlib_chinese()
+    fig = Figure(figsize=(14, 10), facecolor='#f8fafc'); ax = fig.subplots()
+    ax.axis('off')
+    
+    ax.text(0.5, 0.95, f"IFUKUK 專業排班表 - {roster.year}/{roster.month}", ha='center', va='center', fontsize=26, color='#0f172a')
+    
+    cols = ["週一 Mon", "週二 Tue", "週三 Wed", "週四 Thu", "週五 Fri", "週六 Sat", "週日 Sun"]
+    cal = calendar.monthcalendar(roster.year, roster.month)
+    table_data = [cols]
+    
+    for week in cal:
+        row_data = []
+        for day in week:
+            if day == 0: row_data.append("")
             else:
-                cell.set_height(0.16)
-                cell.set_facecolor('#ffffff')
-                cell.get_text().set_color('#334155')
-                txt = cell.get_text().get_text()
-                if "全店公休" in txt:
-                    cell.set_facecolor('#fee2e2')
-                    cell.get_text().set_color('#991b1b')
-
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', dpi=200, bbox_inches='tight', facecolor=fig.get_facecolor())
-        buf.seek(0); plt.close(fig)
-        return buf
-    except Exception as e: return str(e)
+                date_str = roster.date_str(day)
+                cell_text = f"{day}\n"
+                if date_str in roster.closed: cell_text += "\n[全店公休]"
+                else:
+                    for r in roster.shifts(date_str):
+                        s_short = r['Type'].replace("早班","早").replace("晚班","晚").replace("全班","全").replace("公休","休")
+                        cell_text += f"● {r['Staff']} ({s_short})\n"
+                row_data.append(cell_text.strip())
+        table_data.append(row_data)
+
+    table = ax.table(cellText=table_data, loc='center', cellLoc='center', bbox=[0, 0, 1, 0.9])
+    table.auto_set_font_size(False)
+    table.set_fontsize(14) 
+    
+    for (i, j), cell in table.get_celld().items():
+        cell.set_edgecolor('#cbd5e1')
+        if i == 0:
+            cell.set_facecolor('#e2e8f0')
+            cell.set_height(0.06)
+            cell.get_text().set_color('#0f172a') 
+        else:
+            cell.set_height(0.16)
+            cell.set_facecolor('#ffffff')
+            cell.get_text().set_color('#334155')
+            txt = cell.get_text().get_text()
+            if "全店公休" in txt:
+                cell.set_facecolor('#fee2e2')
+                cell.get_text().set_color('#991b1b')
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=dpi, bbox_inches='tight', facecolor=fig.get_facecolor())
+    return buf.getvalue()
+
+class RosterRenderer:
+    def __init__(self):
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="roster")
+        self.lock = threading.Lock(); self.jobs = {}   # (雜湊, dpi) -> Future，依最近使用排序
+
+    def submit(self, roster, dpi):
+        key = (roster.digest, dpi)
+        with self.lock:
+            fut = self.jobs.pop(key, None)
+            if fut is None or (fut.done() and fut.exception() is not None): fut = self.pool.submit(render_roster_png, roster, dpi)
+            self.jobs[key] = fut
+            while len(self.jobs) > ROSTER_CACHE_SIZE: self.jobs.pop(next(iter(self.jobs)))
+        return fut
+
+    def prefetch(self, roster):
+        for dpi in (ROSTER_PREVIEW_DPI, ROSTER_FULL_DPI): self.submit(roster, dpi)
+
+    def get(self, roster, dpi):
+        return self.submit(roster, dpi).result()
+
+@st.cache_resource(show_spinner=False)
+def get_roster_renderer():
+    return RosterRenderer()
 
+@st.fragment
 def render_roster_system(sh, users_list, user_name):
-    ws_shifts = get_worksheet_safe(sh, "Shifts", ["Date", "Staff", "Shift_Type", "Note", "Notify", "Updated_By"])
+    ws_shifts = get_worksheet_safe(sh, "Shifts", SHIFT_HEADERS)
     if ws_shifts is None:
         st.warning("⚠️ 系統連線中，請稍候重新整理...")
         return
 
-    shifts_df = get_data_safe(ws_shifts, ["Date", "Staff", "Shift_Type", "Note", "Notify", "Updated_By"])
+    shifts_df = get_data_safe(ws_shifts, SHIFT_HEADERS)
     if not shifts_df.empty:
         if 'Shift_Type' in shifts_df.columns and 'Type' not in shifts_df.columns: shifts_df['Type'] = shifts_df['Shift_Type']
         if 'Type' not in shifts_df.columns: shifts_df['Type'] = '上班'
     else:
         shifts_df = pd.DataFrame(columns=["Date", "Staff", "Type", "Note", "Notify", "Updated_By"])
 
+    shifts_version = sheet_version(ws_shifts.title)
     staff_color_map = get_staff_color_map(users_list)
     st.markdown("<div class='roster-header'><h3 style='margin:0;'>🗓️ 專業排班中心</h3></div>", unsafe_allow_html=True)
     now = datetime.utcnow() + timedelta(hours=8)
@@ -406,6 +1938,8 @@ def render_roster_system(sh, users_list, user_name):
             view_mode = st.radio("👁️ 檢視模式", ["📅 電腦月曆", "📝 手機列表"], horizontal=True, label_visibility="collapsed")
 
     st.markdown("---")
+    roster = get_roster_month(shifts_df, shifts_version, sel_year, sel_month)
+    get_roster_renderer().prefetch(roster)
 
     if view_mode == "📅 電腦月曆":
         cal = calendar.monthcalendar(sel_year, sel_month)
@@ -418,18 +1952,16 @@ def render_roster_system(sh, users_list, user_name):
             for i, day in enumerate(week):
                 with cols[i]:
                     if day != 0:
-                        date_str = f"{sel_year}-{str(sel_month).zfill(2)}-{str(day).zfill(2)}"
-                        day_shifts = shifts_df[shifts_df['Date'] == date_str] if not shifts_df.empty else pd.DataFrame()
+                        date_str = roster.date_str(day); day_shifts = roster.shifts(date_str)
                         
                         if st.button(f"📅 {day}", key=f"d_grid_{date_str}", use_container_width=True):
                             st.session_state['roster_date'] = date_str
-                            st.rerun()
+                            st.rerun(scope="fragment")
 
-                        is_store_closed = any((r['Staff'] == "全店" and r['Type'] == "公休") for _, r in day_shifts.iterrows())
                         html_content = ""
-                        if is_store_closed: html_content = "<div class='store-closed'>🔴 全店公休</div>"
+                        if date_str in roster.closed: html_content = "<div class='store-closed'>🔴 全店公休</div>"
                         else:
-                            for _, r in day_shifts.iterrows():
+                            for r in day_shifts:
                                 bg_color = "#EF4444" if r['Type'] == "公休" else staff_color_map.get(r['Staff'], "#6B7280")
                                 html_content += f"<div class='desktop-shift-pill' style='background-color:{bg_color};'>{r['Staff']} - {r['Type']}</div>"
                         st.markdown(f"<div class='day-cell'>{html_content}</div>", unsafe_allow_html=True)
@@ -440,15 +1972,13 @@ def render_roster_system(sh, users_list, user_name):
         for week in cal:
             for day in week:
                 if day != 0:
-                    date_str = f"{sel_year}-{str(sel_month).zfill(2)}-{str(day).zfill(2)}"
-                    day_shifts = shifts_df[shifts_df['Date'] == date_str] if not shifts_df.empty else pd.DataFrame()
+                    date_str = roster.date_str(day); day_shifts = roster.shifts(date_str)
                     weekday_str = ["週一","週二","週三","週四","週五","週六","週日"][datetime(sel_year, sel_month, day).weekday()]
                     
-                    is_store_closed = any((r['Staff'] == "全店" and r['Type'] == "公休") for _, r in day_shifts.iterrows())
                     content_html = ""
-                    if is_store_closed: content_html = "<span class='store-closed-mobile'><span style='color:#EF4444 !important;'>🔴 全店公休</span></span>"
-                    elif not day_shifts.empty:
-                        for _, r in day_shifts.iterrows():
+                    if date_str in roster.closed: content_html = "<span class='store-closed-mobile'><span style='color:#EF4444 !important;'>🔴 全店公休</span></span>"
+                    elif day_shifts:
+                        for r in day_shifts:
                             bg_color = "#EF4444" if r['Type'] == "公休" else staff_color_map.get(r['Staff'], "#6B7280")
                             content_html += f"<span class='shift-pill' style='background-color:{bg_color};'><span style='color:white !important;'>{r['Staff']} {r['Type']}</span></span>"
                     else: content_html = "<span style='color:#94a3b8;font-size:0.8rem;'>尚無排班</span>"
@@ -461,7 +1991,7 @@ def render_roster_system(sh, users_list, user_name):
                     """, unsafe_allow_html=True)
                     
                     if st.button(f"編輯 {date_str}", key=f"btn_list_{date_str}", use_container_width=True):
-                        st.session_state['roster_date'] = date_str; st.rerun()
+                        st.session_state['roster_date'] = date_str; st.rerun(scope="fragment")
 
     st.markdown("---")
     c_edit, c_smart = st.columns([1, 1])
@@ -471,25 +2001,19 @@ def render_roster_system(sh, users_list, user_name):
             t_date = st.session_state['roster_date']
             st.markdown(f"#### ✏️ 編輯排班: {t_date}")
             
-            current_day_shifts = shifts_df[shifts_df['Date'] == t_date] if not shifts_df.empty else pd.DataFrame()
-            is_closed = any((r['Staff'] == "全店" and r['Type'] == "公休") for _, r in current_day_shifts.iterrows())
+            t_roster = roster if t_date.startswith(roster.prefix) else get_roster_month(shifts_df, shifts_version, int(t_date[:4]), int(t_date[5:7]))
+            current_day_shifts = t_roster.shifts(t_date); is_closed = t_date in t_roster.closed
 
             if is_closed:
                 st.error("🔴 目前設定為：全店公休")
                 if st.button("🔓 解除全店公休", use_container_width=True):
-                      for idx, row in enumerate(ws_shifts.get_all_values()):
-                          if len(row) > 1 and row[0] == t_date and row[1] == "全店":
-                              retry_action(ws_shifts.delete_rows, idx + 1); break
-                      st.success("已解除"); time.sleep(0.5); st.cache_data.clear(); st.rerun()
+                      if replace_shifts(ws_shifts, [t_date], lambda row: row[1] == "全店"): st.success("已解除"); time.sleep(0.5); st.rerun()
             else:
-                if not current_day_shifts.empty:
+                if current_day_shifts:
                     st.caption("已安排 (點擊❌移除):")
-                    for _, r in current_day_shifts.iterrows():
+                    for r in current_day_shifts:
                         if st.button(f"❌ {r['Staff']} ({r['Type']})", key=f"del_{r['Staff']}_{t_date}"):
-                            for idx, row in enumerate(ws_shifts.get_all_values()):
-                                if len(row) > 1 and row[0] == t_date and row[1] == r['Staff']:
-                                    retry_action(ws_shifts.delete_rows, idx + 1); break
-                            st.success("已移除"); time.sleep(0.5); st.cache_data.clear(); st.rerun()
+                            if replace_shifts(ws_shifts, [t_date], lambda row, staff=r['Staff']: row[1] == staff): st.success("已移除"); time.sleep(0.5); st.rerun()
 
                 with st.form("add_shift_pro"):
                     s_staff = st.selectbox("人員", users_list)
@@ -497,19 +2021,13 @@ def render_roster_system(sh, users_list, user_name):
                     s_note = st.text_input("備註 (可選)")
                     if st.form_submit_button("➕ 新增/更新排班", use_container_width=True):
                         try:
-                            rows_to_del = [idx + 1 for idx, row in enumerate(ws_shifts.get_all_values()) if len(row) > 1 and row[0] == t_date and row[1] == s_staff]
-                            for r_idx in reversed(rows_to_del): retry_action(ws_shifts.delete_rows, r_idx)
-                            retry_action(ws_shifts.append_row, [t_date, s_staff, s_type, s_note, "FALSE", user_name])
-                            st.cache_data.clear(); st.success(f"已更新"); time.sleep(0.5); st.rerun()
+                            if replace_shifts(ws_shifts, [t_date], lambda row: row[1] == s_staff, [[t_date, s_staff, s_type, s_note, "FALSE", user_name]]): st.success("已更新"); time.sleep(0.5); st.rerun()
                         except Exception as e: st.error(f"寫入失敗: {e}")
 
                 st.markdown("---")
                 if st.button("🔴 設定為全店公休 (Store Closed)", type="primary", use_container_width=True):
                     try:
-                        rows_to_del = [idx + 1 for idx, row in enumerate(ws_shifts.get_all_values()) if len(row) > 1 and row[0] == t_date]
-                        for r_idx in reversed(rows_to_del): retry_action(ws_shifts.delete_rows, r_idx)
-                        retry_action(ws_shifts.append_row, [t_date, "全店", "公休", "Store Closed", "FALSE", user_name])
-                        st.cache_data.clear(); st.success("已設定全店公休"); st.rerun()
+                        if replace_shifts(ws_shifts, [t_date], lambda row: True, [[t_date, "全店", "公休", "Store Closed", "FALSE", user_name]]): st.success("已設定全店公休"); st.rerun()
                     except Exception as e: st.error(f"設定失敗: {e}")
         else:
             st.info("👈 請點選上方列表日期進行編輯")
@@ -520,32 +2038,35 @@ def render_roster_system(sh, users_list, user_name):
             if st.button("📤 生成 LINE 通告文字 (行動端優化版)", use_container_width=True):
                 line_txt = f"📅 【IFUKUK {sel_month}月班表公告】\n"
                 line_txt += "━━━━━━━━━━━━━━\n"
-                m_prefix = f"{sel_year}-{str(sel_month).zfill(2)}"
-                m_data = shifts_df[shifts_df['Date'].str.startswith(m_prefix)].sort_values(['Date', 'Staff'])
+                m_data = roster.ordered()
                 
-                if not m_data.empty:
+                if m_data:
                     last_date = ""
-                    for _, r in m_data.iterrows():
-                        d_obj = datetime.strptime(r['Date'], "%Y-%m-%d")
+                    for r_date, r in m_data:
+                        d_obj = datetime.strptime(r_date, "%Y-%m-%d")
                         weekday_str = ["一","二","三","四","五","六","日"][d_obj.weekday()]
                         d_short = f"{d_obj.month}/{d_obj.day} (週{weekday_str})"
                         if d_short != last_date: 
                             line_txt += f"\n🔹 {d_short}\n"
                             last_date = d_short
-                        if r['Staff'] == "全店" and r['Type'] == "公休": line_txt += f"🔴 全店公休\n"
+                        if r['Staff'] == "全店" and r['Type'] == "公休": line_txt += "🔴 全店公休\n"
                         else: 
                             note_str = f" ({r['Note']})" if pd.notna(r['Note']) and r['Note'].strip() != "" else ""
                             line_txt += f"👤 {r['Staff']} ({r['Type']}){note_str}\n"
                     st.text_area("請複製下方文字，貼上至 LINE 絕對整齊：", value=line_txt, height=250)
                 else: st.warning("本月尚無任何排班資料")
 
+            fast_preview = st.toggle("⚡ 低解析度快速預覽 (下載仍為高清)", value=True, key="roster_fast_preview")
             if st.button("📸 一鍵生成班表截圖 (Image)", use_container_width=True):
-                with st.spinner("字型防禦引擎已啟動，正在渲染滿版圖片 (請稍候 3 秒)..."):
-                    img_buf = generate_roster_image_buffer(sel_year, sel_month, shifts_df, calendar.monthrange(sel_year, sel_month)[1], staff_color_map)
-                    if isinstance(img_buf, io.BytesIO):
-                        st.image(img_buf, caption=f"IFUKUK_{sel_year}_{sel_month}_Roster", use_container_width=True)
-                        st.download_button("💾 下載高清 PNG 圖片", data=img_buf, file_name=f"IFUKUK_{sel_year}_{sel_month}_Roster.png", mime="image/png", use_container_width=True)
-                    else: st.error(f"❌ 發生未預期的系統錯誤：\n`{img_buf}`")
+                renderer = get_roster_renderer()
+                try:
+                    with st.spinner("班表圖片準備中 (已於背景預先渲染)..."):
+                        preview = renderer.get(roster, ROSTER_PREVIEW_DPI if fast_preview else ROSTER_FULL_DPI)
+                    st.image(preview, caption=f"IFUKUK_{sel_year}_{sel_month}_Roster", use_container_width=True)
+                    with st.spinner("高清圖片準備中..."):
+                        full_png = renderer.get(roster, ROSTER_FULL_DPI)
+                    st.download_button("💾 下載高清 PNG 圖片", data=full_png, file_name=f"IFUKUK_{sel_year}_{sel_month}_Roster.png", mime="image/png", use_container_width=True)
+                except Exception as e: st.error(f"❌ 發生未預期的系統錯誤：\n`{e}`")
 
         with st.expander("🎯 精準排班與公休設定 (日期多選)", expanded=False):
             wc_tab1, wc_tab2 = st.tabs(["👤 人員精準排班", "🔴 精準全店公休"])
@@ -562,15 +2083,9 @@ def render_roster_system(sh, users_list, user_name):
                 selected_dates = st.multiselect("點選日期 (可複選多天)", cal_dates, placeholder="請選擇要排班的日期...")
                 if st.button("🚀 執行精準排班寫入", use_container_width=True):
                     if selected_dates:
-                        all_vals = ws_shifts.get_all_values() 
-                        added = 0
-                        for d_full in selected_dates:
-                            d_str = d_full.split(" ")[0] 
-                            rows_to_del = [idx+1 for idx, row in enumerate(all_vals) if len(row)>1 and row[0]==d_str and row[1]==p_staff]
-                            for r_idx in reversed(rows_to_del): retry_action(ws_shifts.delete_rows, r_idx)
-                            retry_action(ws_shifts.append_row, [d_str, p_staff, p_type, "Auto", "FALSE", user_name])
-                            added += 1
-                        st.cache_data.clear(); st.success(f"完美寫入！共新增 {added} 筆排班紀錄"); st.rerun()
+                        d_strs = [d_full.split(" ")[0] for d_full in selected_dates]
+                        if replace_shifts(ws_shifts, d_strs, lambda row: row[1] == p_staff, [[d_str, p_staff, p_type, "Auto", "FALSE", user_name] for d_str in d_strs]):
+                            st.success(f"完美寫入！共新增 {len(d_strs)} 筆排班紀錄"); st.rerun()
                     else: st.warning("⚠️ 請至少選擇一天日期")
 
             with wc_tab2:
@@ -578,21 +2093,885 @@ def render_roster_system(sh, users_list, user_name):
                 selected_closed_dates = st.multiselect("點選全店公休日期 (可複選多天)", cal_dates, key="sc_dates_micro", placeholder="請選擇公休日...")
                 if st.button("🔴 執行全店公休設定", use_container_width=True):
                     if selected_closed_dates:
-                        all_vals = ws_shifts.get_all_values()
-                        added = 0
-                        for d_full in selected_closed_dates:
-                            d_str = d_full.split(" ")[0]
-                            rows_to_del = [idx+1 for idx, row in enumerate(all_vals) if len(row)>0 and row[0] == d_str]
-                            for r_idx in reversed(rows_to_del): retry_action(ws_shifts.delete_rows, r_idx)
-                            retry_action(ws_shifts.append_row, [d_str, "全店", "公休", "Store Closed", "FALSE", user_name])
-                            added += 1
-                        st.cache_data.clear(); st.success(f"完成！共設定 {added} 天全店公休"); st.rerun()
+                        d_strs = [d_full.split(" ")[0] for d_full in selected_closed_dates]
+                        if replace_shifts(ws_shifts, d_strs, lambda row: True, [[d_str, "全店", "公休", "Store Closed", "FALSE", user_name] for d_str in d_strs]):
+                            st.success(f"完成！共設定 {len(d_strs)} 天全店公休"); st.rerun()
                     else: st.warning("⚠️ 請至少選擇一天日期")
 
+# --- 功能分頁 (Fragments) ---
+# 每個分頁是一個 st.fragment：分頁內的點擊只重跑該分頁。fragment 重跑沿用的是上次整頁執行傳入的參數，
+# 所以只傳工作表，庫存 / 日誌等資料一律在分頁開頭以 AppView 從鏡像重讀 (依版本快取，沒有新寫入時幾乎不花成本)；
+# 寫入雲端後的 st.rerun() 仍為整頁重跑，讓頂部指標與其他分頁拿到新快照。
+class AppView:
+    """一次執行 (整頁或單一 fragment) 看到的資料，全部由鏡像讀出；各屬性第一次用到才載入。"""
+    def __init__(self, wss): self.wss = wss
+
+    @functools.cached_property
+    def stock(self):
+        # 先取快照 (必要時同步)，再用鏡像的 synced_at (最近一次抓取的開始時間) 取佇列疊加量
+        items = get_items_snapshot(self.wss["Items"])
+        return items, get_sale_journal().overlay((get_mirror().meta("Items") or {}).get("synced_at"))
+
+    items = property(lambda self: self.stock[0])
+    stock_overlay = property(lambda self: self.stock[1])
+
+    @functools.cached_property
+    def df(self): return apply_stock_overlay(self.items.df, self.stock_overlay) if self.stock_overlay else self.items.df
+
+    @functools.cached_property
+    def journal_counts(self): return get_sale_journal().counts()
+
+    @functools.cached_property
+    def logs_df(self): return get_data_safe(self.wss["Logs"], LOG_HEADERS)
+
+    @functools.cached_property
+    def users_df(self): return get_data_safe(self.wss["Users"], USER_HEADERS)
+
+    @functools.cached_property
+    def staff_list(self): return self.users_df['Name'].tolist() if not self.users_df.empty and 'Name' in self.users_df.columns else []
+
+    @functools.cached_property
+    def sales_df(self): return load_sales_ledger(self.logs_df, sheet_version("Logs"))
+
+    @functools.cached_property
+    def internal_df(self): return load_internal_use(self.logs_df, self.items.cost_map, sheet_version("Logs"), sheet_version("Items"))
+
+    @functools.cached_property
+    def archive(self): return get_log_archive(self.wss[ARCHIVE_INDEX])   # 熱表之外的封存月份只計入索引中的小計
+
+    @functools.cached_property
+    def metrics(self):
+        m = load_log_metrics(self.sales_df, self.internal_df, sheet_version("Logs"), sheet_version("Items"))
+        return {**m, "revenue": m["revenue"] + self.archive.revenue, "sunk_cost": m["sunk_cost"] + self.archive.sunk_cost}
+
+    @functools.cached_property
+    def rmb_stock_value(self):
+        df = self.df
+        if df.empty or 'Orig_Currency' not in df.columns: return 0
+        rmb_items = df[df['Orig_Currency'] == 'CNY']
+        return ((rmb_items['Qty'] + rmb_items['Qty_CN']) * rmb_items['Orig_Cost']).sum() if not rmb_items.empty else 0
+
+@st.fragment
+def render_inventory_tab(sh, wss):
+    v = AppView(wss); ws_items = wss["Items"]
+    items, df, stock_overlay, search_idx = v.items, v.df, v.stock_overlay, v.items.search
+    inv_t1, inv_t2 = st.tabs(["📦 庫存巡報區 (Smart Alert)", "💰 成本與毛利總覽矩陣 (Cost Matrix)"])
+    
+    with inv_t1:
+        if not df.empty:
+            c1, c2 = st.columns([1, 1])
+            with c1:
+                px = load_px()
+                fig_pie = px.pie(df, names='Category', values='Qty', hole=0.5, color_discrete_sequence=px.colors.qualitative.Pastel)
+                fig_pie.update_traces(textposition='inside', textinfo='percent+label')
+                fig_pie.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font_color='#0f172a', margin=dict(t=0, b=0, l=0, r=0))
+                st.plotly_chart(fig_pie, use_container_width=True)
+            with c2:
+                top = df.groupby(['Name']).agg({'Qty':'sum'}).reset_index().sort_values(by='Qty', ascending=False).head(10)
+                fig_bar = px.bar(top, x='Qty', y='Name', orientation='h', text='Qty', color='Qty', color_continuous_scale=px.colors.qualitative.Pastel)
+                fig_bar.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font_color='#0f172a', margin=dict(t=0, b=0, l=0, r=0))
+                st.plotly_chart(fig_bar, use_container_width=True)
+                
+        st.divider()
+        c_search1, c_search2, c_search3 = st.columns([2, 1, 1])
+        with c_search1: search_q = st.text_input("🔍 搜尋商品", placeholder="輸入貨號或品名...")
+        with c_search2: filter_cat = st.selectbox("📂 分類篩選", ["全部"] + CAT_LIST)
+        with c_search3: 
+            st.markdown("<br>", unsafe_allow_html=True) 
+            show_low_stock = st.toggle("🚨 僅顯示低庫存警報", value=False)
+            
+        # 款式索引每個 Items 版本只建一次；篩選只算出列遮罩，分頁是對款式清單切片
+        style_idx = items.styles; gallery_mask = None
+        if search_q: gallery_mask = style_idx.select(search_idx.search(search_q))
+        if filter_cat != "全部": gallery_mask = (df['Category'] == filter_cat).to_numpy() & (True if gallery_mask is None else gallery_mask)
+        if show_low_stock: gallery_mask = (df['Qty'] < df['Safe_Level']).to_numpy() & (True if gallery_mask is None else gallery_mask)
+        gallery_styles = style_idx.styles(gallery_mask)
+        
+        if len(gallery_styles):
+            items_per_page = 10
+            total_pages = math.ceil(len(gallery_styles) / items_per_page)
+            curr_page = st.session_state.get('inv_page', 1)
+            if curr_page > total_pages: curr_page = total_pages
+            if curr_page < 1: curr_page = 1
+            st.session_state['inv_page'] = curr_page
+            
+            c_p1, c_p2, c_p3 = st.columns([1, 2, 1])
+            with c_p1: 
+                if st.button("◀", key="p_up_prev", use_container_width=True, disabled=(curr_page==1)): st.session_state['inv_page'] -= 1; st.rerun(scope="fragment")
+            with c_p2: st.markdown(f"<div style='text-align:center;font-weight:bold;padding-top:10px;'>第 {curr_page} / {total_pages} 頁</div>", unsafe_allow_html=True)
+            with c_p3:
+                if st.button("▶", key="p_up_next", use_container_width=True, disabled=(curr_page==total_pages)): st.session_state['inv_page'] += 1; st.rerun(scope="fragment")
+
+            start_idx = (curr_page - 1) * items_per_page
+            end_idx = start_idx + items_per_page
+            page_groups, page_totals = style_idx.page(df, gallery_styles[start_idx:end_idx], gallery_mask, exact=not stock_overlay)
+
+            for g_i, (style_id, style_rows) in enumerate(page_groups):
+                name = style_idx.names[style_id]
+                sorted_group = df.iloc[style_rows]
+                first_row = df.iloc[style_rows.min()]; img = render_image_url(first_row['Image_URL'], "thumb"); price = int(first_row['Price'])
+                display_sku = str(first_row['SKU'])
+                total_qty_tw = int(page_totals['tw'][g_i]); total_qty_cn = int(page_totals['cn'][g_i])
+                has_warning = bool(page_totals['warn'][g_i]); restock_advice = int(page_totals['restock'][g_i])
+                
+                stock_badges = "".join(
+                    f"<span class='stock-tag {'has-stock' if q > 0 and q >= sl else 'no-stock'}'><span>{sz}:{q}</span></span>"
+                    for sz, q, sl in zip(sorted_group['Size'].astype(str).tolist(), sorted_group['Qty'].tolist(), sorted_group['Safe_Level'].tolist()))
+
+                warning_html = f"<span style='color:#ef4444; font-weight:bold; font-size:0.8rem; margin-left:10px;'>⚠️ 需補貨 (建議補 {restock_advice} 件)</span>" if has_warning else ""
+
+                with st.container(border=True):
+                    st.markdown(f"""
+                    <div class='inv-row'>
+                        <img src='{img}' class='inv-img'>
+                        <div class='inv-info'>
+                            <div class='inv-title'>{name} {warning_html}</div>
+                            <div class='inv-meta'>{display_sku} | ${price}</div>
+                            <div class='stock-tag-row'>{stock_badges}</div>
+                            <div style='font-size:0.8rem; color:#64748b; margin-top:4px;'>
+                                🇹🇼 總庫存: <b>{total_qty_tw}</b> | 🇨🇳 中國倉: <b>{total_qty_cn}</b>
+                            </div>
+                        </div>
+                    </div>
+                    """, unsafe_allow_html=True)
+
+                    with st.expander("⚙️ 進階編輯與庫存管理"):
+                        tab_qty, tab_info, tab_del = st.tabs(["📦 數量微調", "✏️ 基礎資訊修改 (全尺寸套用)", "🗑️ 徹底刪除此款"])
+                        
+                        with tab_qty:
+                            with st.form(f"qty_{name}"):
+                                i_tw = {}; i_cn = {}; g_cols = st.columns(4)
+                                for idx, r_data in enumerate(sorted_group.iterrows()):
+                                    _, row = r_data
+                                    with g_cols[idx%4]: 
+                                        lbl = row['Size']; i_tw[row['SKU']] = st.number_input(f"TW {lbl}", value=int(row['Qty']), key=f"t_{row['SKU']}"); i_cn[row['SKU']] = st.number_input(f"CN {lbl}", value=int(row['Qty_CN']), key=f"c_{row['SKU']}")
+                                if st.form_submit_button("💾 儲存庫存變更", use_container_width=True):
+                                    with st.spinner("雲端聯動中..."):
+                                        # 以畫面上的數字為基準換算增減量走 CAS：編輯期間其他終端的銷售不會被覆蓋，也不會寫入被租用中的列
+                                        deltas = {}
+                                        for _, row in sorted_group.iterrows():
+                                            d = {5: i_tw[row['SKU']] - int(row['Qty']), 13: i_cn[row['SKU']] - int(row['Qty_CN'])}
+                                            if any(d.values()): deltas[row['SKU']] = d
+                                        status, _ = commit_stock_deltas(ws_items, deltas, guard=False, skip_missing=True) if deltas else ("ok", None)
+                                        if status == "ok": st.success("數量已瞬間更新！"); time.sleep(0.5); st.rerun()
+                                        elif status == "busy": st.error("❌ 其他終端正在異動相同商品，請稍後再試一次。")
+                                        else: st.error("⚠️ 連線忙碌，請重試")
+
+                        with tab_info:
+                            with st.form(f"info_{name}"):
+                                st.caption(f"修改此處資訊將絕對精準同步至「{name}」的所有尺寸，不再波及無關商品！")
+                                c_i1, c_i2 = st.columns(2)
+                                new_name = c_i1.text_input("品名", value=name)
+                                new_cat = c_i2.selectbox("分類", CAT_LIST, index=CAT_LIST.index(first_row['Category']) if first_row['Category'] in CAT_LIST else 0)
+                                
+                                c_i3, c_i4 = st.columns(2)
+                                new_price = c_i3.number_input("終端售價", value=int(first_row['Price']))
+                                new_orig_curr = c_i4.selectbox("原幣別", ["TWD", "CNY"], index=["TWD", "CNY"].index(first_row['Orig_Currency']) if first_row['Orig_Currency'] in ["TWD", "CNY"] else 0)
+                                
+                                c_i5, c_i6 = st.columns(2)
+                                new_orig_cost = c_i5.number_input("原幣成本", value=int(first_row['Orig_Cost']))
+                                new_safe = c_i6.number_input("安全庫存警告線", value=int(first_row['Safety_Stock']))
+                                
+                                new_img_url = st.text_input("直接輸入圖片網址 (若有)", value=first_row['Image_URL'])
+                                new_img_file = st.file_uploader("或上傳新圖片覆蓋 (內建快取圖床引擎)", key=f"img_{name}")
+                                
+                                if st.form_submit_button("✅ 儲存商品資訊覆蓋", type="primary", use_container_width=True):
+                                    with st.spinner("圖片壓縮與雲端寫入中..."):
+                                        batch = SheetBatch()
+                                        uploaded_ref = process_image_to_ref(new_img_file, get_worksheet_safe(sh, "Images", IMAGE_HEADERS), batch) if new_img_file else None
+                                        final_img = uploaded_ref if uploaded_ref else new_img_url
+                                        
+                                        final_cost = int(new_orig_cost * st.session_state['exchange_rate']) if new_orig_curr == "CNY" else new_orig_cost
+                                        
+                                        cell_list = []
+                                        for row_num, _ in locate_group_rows(ws_items, name): # 精準比對
+                                            cell_list.extend([
+                                                gspread.Cell(row_num, 2, new_name),
+                                                gspread.Cell(row_num, 3, new_cat),
+                                                gspread.Cell(row_num, 6, new_price),
+                                                gspread.Cell(row_num, 7, final_cost),
+                                                gspread.Cell(row_num, STAMP_COL, new_version_stamp()),
+                                                gspread.Cell(row_num, 9, final_img),
+                                                gspread.Cell(row_num, 10, new_safe),
+                                                gspread.Cell(row_num, 11, new_orig_curr),
+                                                gspread.Cell(row_num, 12, new_orig_cost)
+                                            ])
+                                        if cell_list:
+                                            batch.update_cells(ws_items, cell_list)
+                                            if batch.commit(): st.success("商品資訊已全數精準更新！"); time.sleep(1); st.rerun()
+
+                        with tab_del:
+                            st.warning("🔴 警告：按下此按鈕將永久刪除此款式的所有庫存資料。")
+                            if st.button(f"🗑️ 確認刪除所有 {name}", key=f"del_{name}", use_container_width=True):
+                                batch = SheetBatch()
+                                for row_num, _ in locate_group_rows(ws_items, name): batch.delete_row(ws_items, row_num)
+                                if batch.commit(): st.success(f"{name} 已徹底刪除"); time.sleep(1); st.rerun()
+
+            c_p4, c_p5, c_p6 = st.columns([1, 2, 1])
+            with c_p4: 
+                if st.button("◀", key="p_dn_prev", use_container_width=True, disabled=(curr_page==1)): st.session_state['inv_page'] -= 1; st.rerun(scope="fragment")
+            with c_p5: st.markdown(f"<div style='text-align:center;font-weight:bold;padding-top:10px;'>{curr_page} / {total_pages}</div>", unsafe_allow_html=True)
+            with c_p6:
+                if st.button("▶", key="p_dn_next", use_container_width=True, disabled=(curr_page==total_pages)): st.session_state['inv_page'] += 1; st.rerun(scope="fragment")
+
+        else: st.info("查無符合條件的商品")
+
+    with inv_t2:
+        st.markdown("#### 💰 成本與定價總覽矩陣 (Cost & Margin Matrix)")
+        st.markdown("此頁面統一匯總所有商品的 **人民幣成本 (RMB) / 台幣成本 (TWD) / 定價 / 單件毛利**，方便老闆隨時掌控利潤空間。")
+        if not df.empty:
+            cost_df = df[['SKU', 'Name', 'Category', 'Orig_Currency', 'Orig_Cost', 'Cost', 'Price', 'Qty', 'Qty_CN']].copy()
+            cost_df['毛利 (TWD)'] = cost_df['Price'] - cost_df['Cost']
+            cost_df['毛利率 (%)'] = (cost_df['毛利 (TWD)'] / cost_df['Price'] * 100).fillna(0).round(1).astype(str) + "%"
+            cost_df.columns = ['貨號 (SKU)', '品名', '分類', '原幣別', '原幣成本(¥/NT$)', '台幣成本($)', '終端定價($)', 'TW現貨', 'CN現貨', '單件毛利($)', '毛利率(%)']
+            st.dataframe(cost_df, use_container_width=True, hide_index=True)
+            
+            c_dl1, c_dl2 = st.columns([1, 1])
+            with c_dl1:
+                st.download_button("📥 下載完整 Excel 報表 (防亂碼)", data=cost_df.to_csv(index=False).encode('utf-8-sig'), file_name=f"Cost_Matrix_{date.today()}.csv", mime="text/csv", use_container_width=True)
+            with st.expander("📋 手機/電腦 一鍵複製表格數據 (防跑版)"):
+                st.caption("💡 點擊下方黑框【右上角的複製圖示】，即可完美貼上至 Excel、Google Sheets 或 LINE，欄位絕對對齊。")
+                st.code(cost_df.to_csv(index=False, sep='\t'), language="text")
+            
+            st.divider()
+            st.markdown("#### ⚡ 全域庫存與財務極速控制台 (Omni-Data Hub)")
+            st.info("💡 在此直接選擇單一 SKU，即可瞬間修改該尺寸的所有核心數據，並自動聯動計算毛利與營收。")
+            
+            c_sel, c_blank = st.columns([2, 2])
+            edit_sku = c_sel.selectbox("選擇要獨立修正的商品 (單一 SKU)", ["..."] + df['SKU'].tolist())
+            
+            if edit_sku != "...":
+                tgt_row = items.row(edit_sku)
+                tgt_name = tgt_row['Name']
+                
+                with st.form("quick_cost_edit"):
+                    st.markdown(f"**正在編輯：{tgt_name} ({edit_sku})**")
+                    
+                    c1, c2, c3 = st.columns(3)
+                    n_qty_tw = c1.number_input("TW 台灣現貨", value=int(tgt_row['Qty']), min_value=0)
+                    n_qty_cn = c2.number_input("CN 中國現貨", value=int(tgt_row['Qty_CN']), min_value=0)
+                    n_safe = c3.number_input("安全庫存警告線", value=int(tgt_row['Safety_Stock']), min_value=0)
+                    
+                    st.markdown("---")
+                    c4, c5, c6 = st.columns(3)
+                    n_curr = c4.selectbox("原幣別", ["CNY", "TWD"], index=["CNY", "TWD"].index(tgt_row['Orig_Currency']) if tgt_row['Orig_Currency'] in ["CNY", "TWD"] else 0)
+                    n_ocost = c5.number_input("原幣成本", value=int(tgt_row['Orig_Cost']), min_value=0)
+                    n_price = c6.number_input("終端定價", value=int(tgt_row['Price']), min_value=0)
+                    
+                    apply_style = st.checkbox(f"✅ 同步套用【成本與定價】至所有品名為 ({tgt_name}) 的尺寸 (庫存數量不會同步)", value=True)
+                    
+                    if st.form_submit_button("💾 確認更新全域數據", type="primary", use_container_width=True):
+                        with st.spinner("雲端批次聯動更新中..."):
+                            new_twd_cost = int(n_ocost * st.session_state['exchange_rate']) if n_curr == "CNY" else n_ocost
+                            # 同款各尺寸只改成本與定價 (庫存增減量 0)，一樣經 CAS 租約寫入，不會蓋掉其他終端正在提交的庫存
+                            deltas = {str(r_data[0]).strip(): {5: 0} for _, r_data in (locate_group_rows(ws_items, tgt_name) if apply_style else [])}
+                            deltas[edit_sku] = {5: n_qty_tw - int(tgt_row['Qty']), 13: n_qty_cn - int(tgt_row['Qty_CN'])}
+
+                            def build(batch, live):
+                                for curr_sku, (row_num, _) in live.items():
+                                    if curr_sku == edit_sku: batch.update(ws_items, row_num, 10, n_safe)
+                                    for col, val in ((6, n_price), (7, new_twd_cost), (11, n_curr), (12, n_ocost)): batch.update(ws_items, row_num, col, val)
+                            status, live = commit_stock_deltas(ws_items, deltas, build=build, guard=False, skip_missing=True)
+                            if status == "ok" and live:
+                                st.success(f"更新成功！已聯動修改 {len(live)} 筆商品資料，毛利與庫存計算已全域同步。")
+                                time.sleep(1.5)
+                                st.rerun()
+                            elif status == "ok": st.error("找不到該商品SKU")
+                            elif status == "busy": st.error("❌ 其他終端正在異動相同商品，請稍後再試一次。")
+                            else: st.error("⚠️ 連線忙碌，請重試")
+        else:
+            st.info("尚無商品數據。")
+
+@st.fragment
+def render_rapid_scan(wss):
+    v = AppView(wss); items, df = v.items, v.df
+    if 'scan_buffer' not in st.session_state: st.session_state['scan_buffer'] = ScanBuffer()
+    buf = st.session_state['scan_buffer']
+    def on_scan():
+        buf.feed(st.session_state['scan_code'], items.sku_pos); st.session_state['scan_code'] = ""
+    st.text_input("🎯 連續掃描 (每掃一件只更新此區，支援掃描槍連續輸入)", key="scan_code", on_change=on_scan)
+
+    if buf.notice: st.info(buf.notice); buf.notice = None
+    st.markdown(f"<div style='font-size:1.6rem; font-weight:900; color:#0f172a;'>已掃 {buf.total} 件 <span style='font-size:0.9rem; color:#64748b;'>/ {len(buf.counts)} 款</span></div>", unsafe_allow_html=True)
+    if buf.recent: st.caption("最近：" + "、".join(f"{items.product_map.get(s, s)} x{buf.counts.get(s, 0)}" for s in reversed(buf.recent)))
+    if buf.unknown: st.warning(f"⚠️ 找不到條碼：{', '.join(buf.unknown)}")
+
+    c_s1, c_s2 = st.columns(2)
+    if c_s1.button("🛒 全部加入購物車", key="scan_flush", type="primary", use_container_width=True, disabled=not buf.counts):
+        added, over = buf.flush(st.session_state['pos_cart'], df, items.sku_pos)
+        buf.notice = f"✅ 已加入 {added} 件" + (f"；庫存不足未加入：{', '.join(f'{items.product_map.get(s, s)} x{n}' for s, n in over.items())}" if over else "")
+        st.rerun()
+    if c_s2.button("↩️ 清除暫存", key="scan_clear", use_container_width=True, disabled=not (buf.counts or buf.unknown)): buf.clear(); st.rerun(scope="fragment")
+
+@st.fragment
+def render_pos_tab(wss):
+    v = AppView(wss); ws_items, ws_logs = wss["Items"], wss["Logs"]
+    items, df, stock_overlay, search_idx, staff_list = v.items, v.df, v.stock_overlay, v.items.search, v.staff_list
+    journal, journal_counts = get_sale_journal(), v.journal_counts
+    cart = st.session_state['pos_cart']
+    c_l, c_r = st.columns([3, 2])
+    with c_l:
+        st.markdown("##### 🛍️ POS 快速結帳區")
+        
+        st.markdown("<div class='barcode-form'>", unsafe_allow_html=True)
+        if st.toggle("⚡ 連續掃描模式 (掃描先暫存，掃完一次加入購物車)", key="pos_rapid"): render_rapid_scan(wss)
+        else:
+            with st.form("barcode_scanner", clear_on_submit=True):
+                bc_input = st.text_input("🎯 條碼/貨號快速掃描 (支援掃描槍，按 Enter 直接加入)")
+                bc_submit = st.form_submit_button("掃描")
+                if bc_submit and bc_input:
+                    bc_item = items.row(bc_input.strip())
+                    if bc_item is not None:
+                        if bc_item['Qty'] + stock_overlay.get(bc_item['SKU'], {}).get(5, 0) > cart.qty(bc_item['SKU']):
+                            cart.add(bc_item['SKU'])
+                            st.success(f"✅ 已掃描加入: {bc_item['Name']} ({bc_item['Size']}) x{cart.qty(bc_item['SKU'])}")
+                        else:
+                            st.error(f"❌ 庫存不足: {bc_item['Name']} 已售完")
+                    else:
+                        st.error(f"⚠️ 找不到條碼: {bc_input}")
+        st.markdown("</div>", unsafe_allow_html=True)
+
+        cats_available = list(df['Category'].unique()) if not df.empty else []
+        all_cats = sorted(list(set(CAT_LIST + cats_available)))
+        col_s1, col_s2 = st.columns([2,1])
+        q = col_s1.text_input("手動搜尋 (品名/貨號)", placeholder="輸入關鍵字...", label_visibility="collapsed")
+        cat = col_s2.selectbox("POS分類", ["全部"] + all_cats, label_visibility="collapsed")
+        
+        if q:
+            q_pos, q_tier = search_idx.lookup(q)
+            vdf = df.iloc[q_pos].assign(_tier=q_tier)
+        else: vdf = df.assign(_tier=2)
+        if cat != "全部": vdf = vdf[vdf['Category'] == cat]
+        
+        if not vdf.empty:
+            vdf = vdf.sort_values(['_tier', 'Name', 'Size'])
+            vdf = vdf.head(40)
+            rows = [vdf.iloc[i:i+3] for i in range(0, len(vdf), 3)]
+            for r in rows:
+                cols = st.columns(3)
+                for i, (_, item) in enumerate(r.iterrows()):
+                    with cols[i]:
+                        stock_clr = "#166534" if item['Qty'] > 0 else "#991b1b"
+                        st.markdown(f"""
+                        <div class='pos-card'>
+                            <div class='pos-img'><img src='{render_image_url(item['Image_URL'], "card")}' style='width:100%;height:100%;object-fit:cover;'></div>
+                            <div class='pos-content'>
+                                <div class='pos-title'>{item['Name']}</div>
+                                <div class='pos-meta'>{item['Size']} | {item['Category']}</div>
+                                <div class='pos-price-row'>
+                                    <div class='pos-price'>${item['Price']}</div>
+                                    <div class='pos-stock' style='color:{stock_clr}; font-weight:bold;'>現貨:{item['Qty']}</div>
+                                </div>
+                            </div>
+                        </div>
+                        """, unsafe_allow_html=True)
+                        
+                        if item['Qty'] > 0:
+                            if st.button("➕ 加入購物車", key=f"add_{item['SKU']}", use_container_width=True):
+                                if item['Qty'] > cart.qty(item['SKU']): cart.add(item['SKU']); st.toast(f"已加入 {item['Name']} x{cart.qty(item['SKU'])}")
+                                else: st.toast(f"⚠️ {item['Name']} 現貨只有 {item['Qty']} 件")
+                        else:
+                            st.button("❌ 已售完", key=f"out_{item['SKU']}", use_container_width=True, disabled=True)
+        else: st.info("無商品")
+    
+    with c_r:
+        st.markdown("##### 🧾 當前購物車 (實時毛利試算)")
+        if journal_counts:
+            with st.expander(f"📮 離線佇列：待同步 {journal_counts.get('pending', 0)} 筆 / 衝突 {journal_counts.get('conflict', 0)} 筆", expanded=bool(journal_counts.get('conflict'))):
+                replayer = get_sale_replayer()
+                if replayer.last_error: st.caption(f"最近一次同步錯誤：{replayer.last_error}")
+                for e in journal.entries(*JOURNAL_OPEN):
+                    if e['status'] == "pending": st.caption(f"⏳ {e['ts']} {e['content'][:60]}")
+                    else:
+                        st.error(f"⚠️ {e['ts']} {e['error']}\n\n{e['content']}")
+                        c_j1, c_j2 = st.columns(2)
+                        if c_j1.button("強制入帳 (允許負庫存)", key=f"jf_{e['id']}"): journal.mark([e['id']], "pending", "force"); replayer.kick(ws_items, ws_logs); st.rerun()
+                        if c_j2.button("作廢此單", key=f"jv_{e['id']}"): journal.mark([e['id']], "void"); st.rerun()
+                if st.button("🔄 立即同步佇列"): replayer.kick(ws_items, ws_logs); st.rerun()
+        with st.container():
+            st.markdown("<div class='cart-box'>", unsafe_allow_html=True)
+            if cart:
+                lines = cart.frame(df, items.sku_pos)
+                base_raw = int(lines['subtotal'].sum())
+                st.markdown("".join(f"<div class='cart-item'><span>{r.Name} ({r.Size}) x{r.qty}</span><b>${int(r.subtotal)}</b></div>" if pd.notna(r.Qty) else
+                                    f"<div class='cart-item'><span>⚠️ {r.SKU} (已下架) x{r.qty}</span><b>-</b></div>" for r in lines.itertuples()), unsafe_allow_html=True)
+                if st.button("🗑️ 清空購物車"): cart.clear(); st.rerun(scope="fragment")
+                st.markdown("---")
+                
+                col_d1, col_d2 = st.columns(2)
+                use_bundle = col_d1.checkbox("啟用組合價")
+                bundle_val = col_d2.number_input("組合總價", value=base_raw) if use_bundle else 0
+                calc_base = bundle_val if use_bundle else base_raw
+                
+                st.markdown("---")
+                col_disc1, col_disc2 = st.columns(2)
+                disc_mode = col_disc1.radio("優惠方式", ["無", "7折", "8折", "自訂折數%", "直接輸入結帳總額"], horizontal=True)
+                
+                final_total = calc_base
+                note_arr = []
+                if use_bundle: note_arr.append(f"(組合價${bundle_val})")
+                
+                if disc_mode == "7折": 
+                    final_total = int(round(calc_base * 0.7)); note_arr.append("(7折)")
+                elif disc_mode == "8折": 
+                    final_total = int(round(calc_base * 0.8)); note_arr.append("(8折)")
+                elif disc_mode == "自訂折數%":
+                    cust_off = col_disc2.number_input("輸入折數 % (例:95=95折)", 1, 100, 95)
+                    final_total = int(round(calc_base * (cust_off/100))); note_arr.append(f"({cust_off}折)")
+                elif disc_mode == "直接輸入結帳總額":
+                    cust_price = col_disc2.number_input("輸入最終結帳金額 ($)", value=int(calc_base), min_value=0)
+                    final_total = int(cust_price); note_arr.append("(手動改總價)")
+                
+                total_cart_cost = int((lines['Cost'] * lines['qty']).sum())
+                
+                est_profit = final_total - total_cart_cost
+                est_margin = round((est_profit / final_total * 100), 1) if final_total > 0 else 0
+                
+                note_str = " ".join(note_arr)
+                st.markdown(f"<div style='font-size:2rem; font-weight:900; color:#0f172a; text-align:right;'>應收: ${final_total}</div>", unsafe_allow_html=True)
+                st.markdown(f"<div style='text-align:right; color:#059669; font-weight:bold; margin-bottom:15px;'>💡 本單預估毛利: ${est_profit} ({est_margin}%)</div>", unsafe_allow_html=True)
+                
+                sale_who = st.selectbox("經手人員", [st.session_state['user_name']] + [u for u in staff_list if u != st.session_state['user_name']])
+                sale_ch = st.selectbox("銷售通路", ["門市","官網","直播","網路","其他"]) 
+                pay = st.selectbox("付款方式", ["現金","刷卡","轉帳","禮券","其他"])
+                note = st.text_input("備註說明")
+                offline = st.toggle("⚡ 離線優先結帳 (先記入本地佇列，背景同步雲端)", value=True, key="pos_offline")
+                
+                if st.button("✅ 確認結帳 (防超賣批次驗證)", type="primary", use_container_width=True):
+                    deltas = cart.deltas()
+                    logs = [f"{sku} x{q}" for sku, q in cart.lines.items()]
+                    content = f"Sale | Total:${final_total} | Items:{','.join(logs)} | Note:{note} {note_str} | Pay:{pay} | Channel:{sale_ch} | By:{sale_who}"
+                    names = dict(zip(lines['SKU'].tolist(), lines['Name'].astype(object).fillna(lines['SKU']).tolist())); jid = new_journal_id()
+                    if offline:
+                        # 以本地鏡像 + 佇列疊加後的庫存一次比對整張購物車，不等網路
+                        status, info = validate_cart(lines)
+                    else:
+                        with st.spinner("交易鎖定，庫存核對中..."), api_priority(PRIORITY_HIGH):
+                            status, info = commit_stock_deltas(ws_items, deltas, build=lambda batch, live: log_event(ws_logs, st.session_state['user_name'], "Sale", f"{content} | Ref:{jid}", batch=batch))
+                    if (offline and status == "ok") or status == "failed":
+                        # 線上提交失敗時可能已寫入一半，標記為不確定：重播前先到雲端 Logs 比對 Ref
+                        journal.add(st.session_state['user_name'], deltas, content, jid, None if offline or info == "read" else "uncertain"); get_sale_replayer().kick(ws_items, ws_logs)
+                        cart.clear()
+                        st.balloons(); st.success("結帳成功！已記入本地佇列，背景同步雲端中" if offline else "雲端忙碌，此單已轉入離線佇列，背景自動補送"); time.sleep(1.5); st.rerun()
+                    elif status == "ok":
+                        cart.clear()
+                        st.balloons(); st.success("結帳成功！批次庫存已同步"); time.sleep(1.5); st.rerun()
+                    elif status == "short": st.error(f"❌ 防禦攔截：{names[info[0]]} {'庫存' if offline else '雲端庫存'}已被買走，目前剩餘 {info[1]} 件。")
+                    elif status == "missing": st.error(f"❌ 找不到商品：{names[info]}")
+                    elif status == "busy": st.error("❌ 其他終端正在結帳相同商品，請稍後再試一次。")
+            else: st.info("🛒 目前購物車是空的")
+            st.markdown("</div>", unsafe_allow_html=True)
+
+@st.fragment
+def render_sales_hub(sh, wss):
+    v = AppView(wss); ws_items, ws_logs = wss["Items"], wss["Logs"]
+    df, product_map, sales_df, archive, staff_list = v.df, v.items.product_map, v.sales_df, v.archive, v.staff_list
+    realized_revenue, rmb_stock_value = v.metrics["revenue"], v.rmb_stock_value
+    st.subheader("📈 營運戰情室 (Financial Hub)")
+    rev = (df['Qty'] * df['Price']).sum() if not df.empty else 0
+    cost = ((df['Qty'] + df['Qty_CN']) * df['Cost']).sum() if not df.empty else 0
+    profit = rev - (df['Qty'] * df['Cost']).sum() if not df.empty else 0
+    real = realized_revenue
+    
+    m1, m2, m3, m4 = st.columns(4)
+    m1.markdown(f"<div class='metric-card'><div class='metric-label'>總預估營收</div><div class='metric-value'>${rev:,}</div></div>", unsafe_allow_html=True)
+    m2.markdown(f"<div class='metric-card'><div class='metric-label'>庫存總成本 (TWD)</div><div class='metric-value'>${cost:,}</div><div style='font-size:10px;'>含 RMB 原幣: ¥{rmb_stock_value:,}</div></div>", unsafe_allow_html=True)
+    m3.markdown(f"<div class='metric-card'><div class='metric-label'>潛在最高毛利</div><div class='metric-value' style='color:#d97706'>${profit:,}</div></div>", unsafe_allow_html=True)
+    m4.markdown(f"<div class='metric-card'><div class='metric-label'>已入帳營收 (實際)</div><div class='metric-value' style='color:#059669'>${real:,}</div></div>", unsafe_allow_html=True)
+    st.markdown("---")
+    
+    st.markdown("##### 📅 結算週期與財務篩選 (全自動透視)")
+    c_date1, c_date2 = st.columns(2)
+    start_d = c_date1.date_input("分析起始日期", value=date.today().replace(day=1))
+    end_d = c_date2.date_input("分析結束日期", value=date.today())
+    
+    in_range = sales_in_range(sh, archive, sales_df, start_d, end_d)
+    # 使用 DataFrame 的真實 Index + 2 對應到 Google Sheet 行號
+    sdf = pd.DataFrame({
+        "_SheetRow": in_range['_SheetRow'], "日期": in_range['Timestamp'], "金額": in_range['total'], "通路": in_range['channel'],
+        "付款": in_range['payment'], "銷售員": in_range['seller'],
+        "明細": in_range['items'].map(lambda its: ", ".join(f"{product_map.get(k, k)} x{q}" for k, q in its) if its else "-"),
+        "原始Log": in_range['raw']
+    }).reset_index(drop=True)
+    
+    if not sdf.empty:
+        range_metrics = summarize_sales(in_range)
+        pay_stats = range_metrics["by_payment"]
+        fc1, fc2, fc3, fc4 = st.columns(4)
+        fc1.markdown(f"<div class='finance-card'><div class='finance-lbl'>💰 現金收入</div><div class='finance-val'>${pay_stats.get('現金', 0):,}</div></div>", unsafe_allow_html=True)
+        fc2.markdown(f"<div class='finance-card'><div class='finance-lbl'>🏦 轉帳收入</div><div class='finance-val'>${pay_stats.get('轉帳', 0):,}</div></div>", unsafe_allow_html=True)
+        fc3.markdown(f"<div class='finance-card'><div class='finance-lbl'>💳 刷卡收入</div><div class='finance-val'>${pay_stats.get('刷卡', 0):,}</div></div>", unsafe_allow_html=True)
+        fc4.markdown(f"<div class='finance-card'><div class='finance-lbl'>🎫 禮券/其他</div><div class='finance-val'>${pay_stats.get('禮券', 0) + pay_stats.get('其他', 0):,}</div></div>", unsafe_allow_html=True)
+        st.markdown("---")
+
+        c1, c2 = st.columns(2)
+        with c1: 
+            px = load_px()
+            fig = px.pie(sdf, names='通路', values='金額', hole=0.4, title="📊 通路營收佔比", color_discrete_sequence=px.colors.qualitative.Pastel)
+            fig.update_traces(textposition='inside', textinfo='percent+label')
+            fig.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font_color='#0f172a', margin=dict(t=0, b=0, l=0, r=0))
+            st.plotly_chart(fig, use_container_width=True)
+        with c2: 
+            fig2 = px.bar(pd.DataFrame(list(range_metrics["by_staff"].items()), columns=['銷售員', '金額']), x='銷售員', y='金額', title="🏆 人員業績排行", color='金額', color_continuous_scale=px.colors.sequential.Teal)
+            fig2.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font_color='#0f172a', margin=dict(t=0, b=0, l=0, r=0))
+            st.plotly_chart(fig2, use_container_width=True)
+        
+        st.markdown("##### 📝 銷售明細總表 (含售後管理)")
+        clean_sdf = sdf.drop(columns=['原始Log', '_SheetRow'])
+        st.dataframe(clean_sdf, use_container_width=True, hide_index=True)
+
+        c_dl1, c_dl2 = st.columns([1, 1])
+        with c_dl1:
+            st.download_button("📥 下載銷售明細 (防亂碼)", data=clean_sdf.to_csv(index=False).encode('utf-8-sig'), file_name=f"Sales_{date.today()}.csv", mime="text/csv", use_container_width=True)
+        with st.expander("📋 手機/電腦 一鍵複製表格數據 (防跑版)"):
+            st.caption("💡 點擊下方黑框【右上角的複製圖示】，即可完美貼上至 Excel、Google Sheets 或 LINE，欄位絕對對齊。")
+            st.code(clean_sdf.to_csv(index=False, sep='\t'), language="text")
+
+        # V130.0 單點狙擊刪除與業績自由轉移
+        with st.expander("🛠️ 編輯/刪除作廢訂單 (自動回補庫存與業績轉移)"):
+            st.info("💡 系統已注入絕對行號鎖定技術，防範同分同秒重複訂單錯殺。更可直接修改銷售員歸屬，重算業績。")
+            if archive.hot_start and start_d < archive.hot_start: st.caption(f"🗄️ {archive.hot_start} 之前的訂單已封存，僅供查詢，無法在此編修。")
+            editable = sdf[sdf['_SheetRow'] > 0]
+            sale_opts = editable.apply(lambda x: f"[單號: {x['_SheetRow']}] {x['日期']} | ${x['金額']} | {x['明細'][:30]}...", axis=1).tolist() if not editable.empty else []
+            sel_sale = st.selectbox("選擇要處理的歷史訂單", ["..."] + sale_opts)
+            
+            if sel_sale != "...":
+                target_row_idx = int(re.search(r'\[單號:\s*(\d+)\]', sel_sale).group(1))
+                target_row = sdf[sdf['_SheetRow'] == target_row_idx].iloc[0]
+                target_key = log_row_key(v.logs_df.loc[target_row_idx - 2, LOG_HEADERS])
+                raw_log = target_row['原始Log']
+                
+                curr_note = ""; curr_ch = ""; curr_pay = ""; curr_items_str = ""
+                try:
+                    curr_items_str = re.search(r'Items:(.*?) \|', raw_log).group(1)
+                    if "Note:" in raw_log: curr_note = re.search(r'Note:(.*?) \|', raw_log + " |").group(1).strip()
+                    if "Channel:" in raw_log: curr_ch = re.search(r'Channel:(.*?) \|', raw_log + " |").group(1).strip()
+                    if "Pay:" in raw_log: curr_pay = re.search(r'Pay:(.*?) \|', raw_log + " |").group(1).strip()
+                except: pass
+                
+                curr_who = target_row['銷售員']
+
+                with st.form("edit_sale_form"):
+                    e_items = st.text_area("商品內容 (請保持原本的「SKU x數量」格式，逗號分隔)", value=curr_items_str)
+                    c_e1, c_e2, c_e3, c_e4 = st.columns(4)
+                    e_total = c_e1.number_input("總金額", value=int(target_row['金額']))
+                    e_ch = c_e2.selectbox("通路", ["門市","官網","直播","網路","其他"], index=["門市","官網","直播","網路","其他"].index(curr_ch) if curr_ch in ["門市","官網","直播","網路","其他"] else 0)
+                    e_pay = c_e3.selectbox("付款", ["現金","刷卡","轉帳","禮券","其他"], index=["現金","刷卡","轉帳","禮券","其他"].index(curr_pay) if curr_pay in ["現金","刷卡","轉帳","禮券","其他"] else 0)
+                    e_who = c_e4.selectbox("銷售人員 (修改將轉移業績)", staff_list, index=staff_list.index(curr_who) if curr_who in staff_list else 0)
+                    e_note = st.text_input("備註", value=curr_note)
+                    
+                    c_act1, c_act2 = st.columns(2)
+                    if c_act1.form_submit_button("✅ 儲存修改 (精準聯動庫存)"):
+                        try:
+                            def parse_parts(txt):
+                                out = []
+                                for part in txt.split(','):
+                                    clean_part = re.sub(r'\s*\(\$.*?\)', '', part).strip()
+                                    if ' x' in clean_part: out.append((clean_part.split(' x')[0].strip(), int(clean_part.split(' x')[1].strip())))
+                                return out
+                            old_parts, new_parts = parse_parts(curr_items_str), parse_parts(e_items)
+                            deltas = {}
+                            for p_sku, p_qty in old_parts: deltas.setdefault(p_sku, {5: 0})[5] += p_qty  # 補回庫存
+                            for p_sku, p_qty in new_parts: deltas.setdefault(p_sku, {5: 0})[5] -= p_qty  # 扣除新庫存
+
+                            def build(batch, live):
+                                # 絕對行號刪除 (刪除前先確認該列仍是這筆訂單)
+                                if not verify_log_rows(ws_logs, {target_row_idx: target_key}): return False
+                                batch.delete_row(ws_logs, target_row_idx)
+                                new_items_list = [f"{p_sku} x{p_qty}" for p_sku, p_qty in new_parts if p_sku in live]
+                                new_content = f"Sale | Total:${int(e_total)} | Items:{','.join(new_items_list)} | Note:{e_note} | Pay:{e_pay} | Channel:{e_ch} | By:{e_who} (Edited)"
+                                log_event(ws_logs, st.session_state['user_name'], "Sale", new_content, batch=batch)
+                            status, _ = commit_stock_deltas(ws_items, deltas, build=build, guard=False, skip_missing=True)
+                            if status == "ok": st.success("✅ 訂單已修正且庫存聯動完畢！"); time.sleep(1.5); st.rerun()
+                            elif status == "busy": st.error("❌ 其他終端正在異動相同商品，請稍後再試一次。")
+                            elif status == "stale": st.error(STALE_LOG_MSG)
+                        except Exception as e: st.error(f"系統錯誤: {e}")
+
+                    if c_act2.form_submit_button("🗑️ 整筆作廢 (刪除並全數退回庫存)"):
+                        try:
+                            deltas = {}
+                            for part in curr_items_str.split(','):
+                                clean_part = re.sub(r'\s*\(\$.*?\)', '', part).strip()
+                                if ' x' in clean_part:
+                                    p_sku = clean_part.split(' x')[0].strip(); p_qty = int(clean_part.split(' x')[1].strip())
+                                    deltas.setdefault(p_sku, {5: 0})[5] += p_qty
+                            # 絕對行號刪除，秒殺重複資料 (刪除前先確認該列仍是這筆訂單)
+                            def build(batch, live):
+                                if not verify_log_rows(ws_logs, {target_row_idx: target_key}): return False
+                                batch.delete_row(ws_logs, target_row_idx)
+                            status, _ = commit_stock_deltas(ws_items, deltas, build=build, guard=False, skip_missing=True)
+                            if status == "ok": st.success("已精準作廢此筆訂單！商品已退回庫存"); time.sleep(1.5); st.rerun()
+                            elif status == "busy": st.error("❌ 其他終端正在異動相同商品，請稍後再試一次。")
+                            elif status == "stale": st.error(STALE_LOG_MSG)
+                        except Exception: st.error("作廢失敗")
+
+    else: st.info("📊 本區間尚無銷售數據")
+
+@st.fragment
+def render_audit_board(sh, wss):
+    v = AppView(wss); ws_items, ws_logs = wss["Items"], wss["Logs"]
+    items, df, product_map, internal_df, archive, staff_list = v.items, v.df, v.items.product_map, v.internal_df, v.archive, v.staff_list
+    st.markdown("### 🎁 領用與稽核戰情中心 (Audit Command Center)")
+    
+    c_add, c_board = st.columns([1, 2.5])
+    
+    with c_add:
+        st.markdown("#### ➕ 快速領用登記")
+        opts = (df['SKU'] + " | " + df['Name'].astype(str) + " " + df['Size'].astype(str)).tolist() if not df.empty else []
+        sel = st.selectbox("選擇商品 (將自動扣除庫存)", ["..."] + opts)
+        if sel != "...":
+            tsku = sel.split(" | ")[0]; tr = items.row(tsku); st.info(f"當前台灣現貨: {tr['Qty']}")
+            with st.form("internal"):
+                q = st.number_input("申請數量", 1); who = st.selectbox("領用人員", staff_list); rsn = st.selectbox("事由", ["公務", "公關", "福利", "報廢", "樣品", "遺失", "其他"]); n = st.text_input("專案/詳細備註")
+                if st.form_submit_button("✅ 送出並扣庫存", use_container_width=True):
+                    status, info = commit_stock_deltas(ws_items, {tsku: {5: -q}}, build=lambda batch, live: log_event(ws_logs, st.session_state['user_name'], "Internal_Use", f"{tsku} -{q} | {who} | {rsn} | {n} | Cost:{tr['Cost']}", batch=batch))
+                    if status == "ok": st.success("登記成功！庫存已同步減少。"); time.sleep(1); st.rerun()
+                    elif status == "missing": st.error("找不到該商品SKU")
+                    elif status == "short": st.error(f"庫存不足，無法領用！(雲端即時庫存剩餘: {info[1]})")
+                    elif status == "busy": st.error("❌ 其他終端正在異動相同商品，請稍後再試一次。")
+
+    with c_board:
+        # 預設看熱表涵蓋的期間；往前選到封存月份時才讀取對應分區
+        first_day = archive.hot_start or pd.to_datetime(internal_df['Timestamp'].astype(str).str[:10], format="%Y-%m-%d", errors="coerce").min()
+        if pd.isna(first_day): first_day = date.today()
+        a_d1, a_d2 = st.columns(2)
+        a_start = a_d1.date_input("稽核起始日期", value=pd.Timestamp(first_day).date(), key="audit_start")
+        a_end = a_d2.date_input("稽核結束日期", value=date.today(), key="audit_end")
+        internal_rng = internal_use_in_range(sh, archive, internal_df, items.cost_map, a_start, a_end)
+        audit_src = internal_rng[internal_rng['has_detail']]
+        audit_df = None
+        if internal_rng.empty: st.info("此期間尚無任何領用紀錄。")
+        elif audit_src.empty: st.info("資料格式舊版，無法生成圖表。未來的領用將以新格式完美呈現。")
+        else:
+            audit_df = pd.DataFrame({
+                "_SheetRow": audit_src['_SheetRow'], "時間": audit_src['Timestamp'], "商品": audit_src['sku'].map(product_map).fillna(audit_src['sku']), "SKU": audit_src['sku'],
+                "數量": audit_src['qty'], "領用人": audit_src['user'], "原因": audit_src['reason'], "備註": audit_src['note'],
+                "單位成本": audit_src['unit_cost'], "總消耗成本": audit_src['total_cost']
+            }).reset_index(drop=True)
+            total_items_used = audit_df['數量'].sum()
+            total_cost_used = audit_df['總消耗成本'].sum()
+            
+            k1, k2 = st.columns(2)
+            k1.markdown(f"<div class='metric-card' style='background:#fef2f2 !important;'><div class='metric-label'>📦 區間累計領用總件數</div><div class='metric-value' style='color:#b91c1c !important;'>{total_items_used} 件</div></div>", unsafe_allow_html=True)
+            k2.markdown(f"<div class='metric-card' style='background:#fffbeb !important;'><div class='metric-label'>💸 區間累計消耗總成本</div><div class='metric-value' style='color:#b45309 !important;'>${total_cost_used:,}</div></div>", unsafe_allow_html=True)
+            st.markdown("---")
+            
+            c_chart1, c_chart2 = st.columns(2)
+            with c_chart1:
+                px = load_px()
+                fig_r = px.pie(audit_df, names='原因', values='數量', title="📊 領用原因佔比 (數量)", hole=0.3, color_discrete_sequence=px.colors.qualitative.Set2)
+                fig_r.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font_color='#0f172a', margin=dict(t=0, b=0, l=0, r=0))
+                st.plotly_chart(fig_r, use_container_width=True)
+            with c_chart2:
+                user_cost = audit_df.groupby('領用人')['總消耗成本'].sum().reset_index()
+                fig_u = px.bar(user_cost, x='領用人', y='總消耗成本', title="👤 人員消耗成本排行", color='總消耗成本', color_continuous_scale='Reds')
+                fig_u.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font_color='#0f172a', margin=dict(t=0, b=0, l=0, r=0))
+                st.plotly_chart(fig_u, use_container_width=True)
+
+            st.markdown("#### 📜 領用流水帳與細節 (可點擊表頭排序)")
+            clean_audit_df = audit_df[['時間', '商品', '數量', '領用人', '原因', '總消耗成本', '備註']]
+            st.dataframe(clean_audit_df, use_container_width=True, hide_index=True)
+
+            c_dl1, c_dl2 = st.columns([1, 1])
+            with c_dl1:
+                st.download_button("📥 下載領用稽核表 (防亂碼)", data=clean_audit_df.to_csv(index=False).encode('utf-8-sig'), file_name=f"Audit_{date.today()}.csv", mime="text/csv", use_container_width=True)
+            with st.expander("📋 手機/電腦 一鍵複製表格數據 (防跑版)"):
+                st.caption("💡 點擊下方黑框【右上角的複製圖示】，即可完美貼上至 Excel、Google Sheets 或 LINE，欄位絕對對齊。")
+                st.code(clean_audit_df.to_csv(index=False, sep='\t'), language="text")
+
+    st.divider()
+    with st.expander("🛠️ 修正或刪除錯誤的領用紀錄 (系統將自動歸還庫存)"):
+        if audit_df is not None:
+            if archive.hot_start and a_start < archive.hot_start: st.caption(f"🗄️ {archive.hot_start} 之前的紀錄已封存，僅供查詢，無法在此修正。")
+            editable = audit_df[audit_df['_SheetRow'] > 0]
+            rev_opts = editable.apply(lambda x: f"[單號:{x['_SheetRow']}] {x['時間']} | {x['商品']} | 數量:{x['數量']} | {x['領用人']}", axis=1).tolist() if not editable.empty else []
+            sel_rev = st.selectbox("選擇要精準修正的紀錄", ["..."] + rev_opts)
+            
+            if sel_rev != "...":
+                target_row_idx = int(re.search(r'\[單號:(\d+)\]', sel_rev).group(1))
+                tgt_audit = audit_df[audit_df['_SheetRow'] == target_row_idx].iloc[0]
+                target_key = log_row_key(v.logs_df.loc[target_row_idx - 2, LOG_HEADERS])
+                orig_sku = tgt_audit['SKU']
+                orig_qty = tgt_audit['數量']
+                orig_who = tgt_audit['領用人']
+                orig_reason = tgt_audit['原因']
+                orig_note = tgt_audit['備註']
+                orig_cost = tgt_audit['單位成本']
+
+                with st.form("edit_internal_log"):
+                    st.info(f"正在編輯: {product_map.get(orig_sku, orig_sku)} (原數量: {orig_qty})")
+                    new_q = st.number_input("修正為正確數量", value=orig_qty, min_value=1)
+                    new_who = st.selectbox("修正領用人", staff_list, index=staff_list.index(orig_who) if orig_who in staff_list else 0)
+                    new_rsn = st.selectbox("修正原因", ["公務", "公關", "福利", "報廢", "樣品", "遺失", "其他"], index=["公務", "公關", "福利", "報廢", "樣品", "遺失", "其他"].index(orig_reason) if orig_reason in ["公務", "公關", "福利", "報廢", "樣品", "遺失", "其他"] else 0)
+                    new_note = st.text_input("修正備註", value=orig_note)
+                    
+                    c_edit_1, c_edit_2 = st.columns(2)
+                    if c_edit_1.form_submit_button("✅ 更新紀錄並同步庫存"):
+                        def build(batch, live):
+                            if not verify_log_rows(ws_logs, {target_row_idx: target_key}): return False
+                            batch.delete_row(ws_logs, target_row_idx)
+                            log_event(ws_logs, st.session_state['user_name'], "Internal_Use", f"{orig_sku} -{new_q} | {new_who} | {new_rsn} | {new_note} | Cost:{orig_cost}", batch=batch)
+                        status, _ = commit_stock_deltas(ws_items, {orig_sku: {5: orig_qty - new_q}}, build=build, guard=False)
+                        if status == "ok": st.success("紀錄已完美更新！"); time.sleep(1); st.rerun()
+                        elif status == "missing": st.error("找不到該商品SKU")
+                        elif status == "busy": st.error("❌ 其他終端正在異動相同商品，請稍後再試一次。")
+                        elif status == "stale": st.error(STALE_LOG_MSG)
+
+                    if c_edit_2.form_submit_button("🗑️ 撤銷此單 (全數歸還庫存)"):
+                        def revert(batch, live):
+                            if not verify_log_rows(ws_logs, {target_row_idx: target_key}): return False
+                            batch.delete_row(ws_logs, target_row_idx)
+                        status, _ = commit_stock_deltas(ws_items, {orig_sku: {5: orig_qty}}, build=revert, guard=False)
+                        if status == "ok": st.success("已精準撤銷！庫存已歸還！"); time.sleep(1); st.rerun()
+                        elif status == "busy": st.error("❌ 其他終端正在異動相同商品，請稍後再試一次。")
+                        elif status == "stale": st.error(STALE_LOG_MSG)
+
+@st.fragment
+def render_matrix_tab(sh, wss):
+    v = AppView(wss); ws_items, ws_logs = wss["Items"], wss["Logs"]
+    items, df = v.items, v.df
+    st.markdown("<div class='mgmt-box'>", unsafe_allow_html=True)
+    st.markdown("<div class='mgmt-title'>矩陣管理中心</div>", unsafe_allow_html=True)
+    st.info("💡 提醒：庫存區的卡片已支援【單一商品的修改與刪除】，此處用於大批量的全域操作。")
+    mt1, mt2, mt3 = st.tabs(["✨ 批量衍生商品", "⚡ 雙向調撥", "🖼️ 批量上傳圖片"])
+    
+    with mt1:
+        mode = st.radio("模式", ["新系列", "衍生"], horizontal=True)
+        a_sku, a_name = "", ""
+        if mode == "新系列":
+            c = st.selectbox("分類", CAT_LIST)
+            if st.button("生成智慧貨號"): st.session_state['base'] = generate_smart_style_code(c, df['SKU'].tolist())
+            if 'base' in st.session_state: a_sku = st.session_state['base']
+        else:
+            p_opts = (df['SKU'] + " | " + df['Name'].astype(str)).tolist()
+            p = st.selectbox("母商品", ["..."] + p_opts)
+            if p != "...": 
+                p_sku = p.split(" | ")[0]
+                pr = items.row(p_sku); a_sku = get_style_code(p_sku)+"-NEW"; a_name = pr['Name']
+        
+        with st.form("add_m"):
+            c1, c2 = st.columns(2); bs = c1.text_input("Base SKU", value=a_sku); nm = c2.text_input("品名", value=a_name)
+            c3, c4 = st.columns(2); pr = c3.number_input("售價", 0); co = c4.number_input("原幣成本", 0)
+            cur = st.selectbox("幣別 (若選 CNY 系統將依左側匯率自動換算台幣成本)", ["TWD", "CNY"]); 
+            img = st.file_uploader("上傳圖片 (自建圖床引擎)")
+            sz = {}; cols = st.columns(5)
+            for i, s in enumerate(SIZE_ORDER): sz[s] = cols[i%5].number_input(s, min_value=0)
+            if st.form_submit_button("寫入資料庫"):
+                with st.spinner("建立商品與寫入資料中..."):
+                    batch = SheetBatch()
+                    url = (process_image_to_ref(img, get_worksheet_safe(sh, "Images", IMAGE_HEADERS), batch) or "") if img else ""
+                    fc = int(co * st.session_state['exchange_rate']) if cur == "CNY" else co
+                    rows_to_add = []
+                    for s, q in sz.items():
+                        if q > 0:
+                            rows_to_add.append([f"{bs}-{s}", nm, "New", s, q, pr, fc, get_taiwan_time_str(), url, 5, cur, co, 0])
+                    if rows_to_add: batch.append_rows(ws_items, rows_to_add)
+                    if batch.commit(): st.success("商品新增完成！成本已同步記錄。"); time.sleep(1); st.rerun()
+    
+    with mt2:
+        st.info("💡 兩地倉庫雙向調撥。系統將自動增減兩地庫存數字。")
+        t_opts = (df['SKU'] + " | " + df['Name'].astype(str) + " " + df['Size'].astype(str) + " (TW:" + df['Qty'].astype(str) + " / CN:" + df['Qty_CN'].astype(str) + ")").tolist()
+        sel = st.selectbox("選擇要調撥的商品", ["..."] + t_opts)
+        if sel != "...":
+            sel_sku = sel.split(" | ")[0]
+            c1, c2 = st.columns(2)
+            q = c1.number_input("調撥數量", 1)
+            c_act1, c_act2 = st.columns(2)
+            if c_act1.button("TW ➡️ CN (台灣轉中國)"): 
+                status, _ = commit_stock_deltas(ws_items, {sel_sku: {5: -q, 13: q}}, build=lambda batch, live: log_event(ws_logs, st.session_state['user_name'], "Transfer", f"{sel_sku} TW to CN qty:{q}", batch=batch), guard=False)
+                if status == "ok": st.success("調撥完成"); st.rerun()
+                elif status == "missing": st.error("找不到該商品SKU")
+                elif status == "busy": st.error("❌ 其他終端正在異動相同商品，請稍後再試一次。")
+            if c_act2.button("CN ➡️ TW (中國轉台灣)"):
+                status, _ = commit_stock_deltas(ws_items, {sel_sku: {5: q, 13: -q}}, build=lambda batch, live: log_event(ws_logs, st.session_state['user_name'], "Transfer", f"{sel_sku} CN to TW qty:{q}", batch=batch), guard=False)
+                if status == "ok": st.success("調撥完成"); st.rerun()
+                elif status == "missing": st.error("找不到該商品SKU")
+                elif status == "busy": st.error("❌ 其他終端正在異動相同商品，請稍後再試一次。")
+
+    with mt3:
+        st.info("💡 檔名請用款式代碼或任一尺寸的 SKU (例：TOP-2410-001.jpg)，同款所有尺寸共用一張圖；系統會在背景產生縮圖 / 卡片 / 大圖三種尺寸。")
+        with st.form("bulk_img", clear_on_submit=True):
+            ups = st.file_uploader("選擇多張圖片", type=["jpg", "jpeg", "png", "webp"], accept_multiple_files=True)
+            if st.form_submit_button("🚀 開始背景處理") and ups:
+                st.session_state['img_job'] = ImageJob([(u.name, u.getvalue()) for u in ups])
+        job = st.session_state.get('img_job')
+        if job is not None:
+            if job.finished: render_bulk_image_job(sh, ws_items, df)
+            else: st.fragment(run_every=1.0)(_poll_bulk_image_job)(sh, ws_items, df)
+
+@st.fragment
+def render_logs_tab(wss):
+    v = AppView(wss); items, logs_df, archive = v.items, v.logs_df, v.archive
+    st.subheader("📝 系統全域日誌 (Log System)")
+    if archive.months: st.caption(f"🗄️ {archive.months[0]}～{archive.months[-1]} 共 {len(archive.months)} 個月 ({archive.rows:,} 筆) 已封存於 {COLD_PREFIX}YYYYMM 分頁；此處只顯示 {archive.hot_start} 起的當期日誌。")
+    l_q = st.text_input("🔍 搜尋關鍵字 (人員/動作/品名/金額)")
+    if not logs_df.empty:
+        view_df = logs_df.sort_index(ascending=False).copy()
+        view_df.columns = ['時間', '操作人員', '動作類型', '內容詳情']
+        action_map = {"Sale": "💰 銷售結帳", "Internal_Use": "🎁 內部領用", "Login": "🔑 登入", "Transfer": "📦 調撥", "Batch": "⚡ 批量"}
+        view_df['動作類型'] = view_df['動作類型'].map(action_map).fillna(view_df['動作類型'])
+        
+        view_df['內容詳情'] = items.translator.translate_series(view_df['內容詳情'])
+        
+        if l_q: view_df = view_df[view_df.astype(str).apply(lambda x: x.str.contains(l_q, case=False)).any(axis=1)]
+        st.dataframe(view_df, use_container_width=True, hide_index=True)
+
+@st.fragment
+def render_admin_tab(sh, wss):
+    v = AppView(wss); ws_items, ws_users, ws_logs, ws_archive = wss["Items"], wss["Users"], wss["Logs"], wss[ARCHIVE_INDEX]
+    items, df, users_df, logs_df, archive = v.items, v.df, v.users_df, v.logs_df, v.archive
+    st.subheader("👥 人員與權限管理 (Admin Matrix)")
+    if st.session_state['user_role'] == 'Admin':
+        admin_view = users_df.copy()
+        admin_view.columns = ['員工帳號', '密碼(已加密Hash)', '權限等級', '狀態', '建立時間']
+        st.dataframe(admin_view, use_container_width=True, hide_index=True)
+        
+        c_u1, c_u2 = st.columns(2)
+        with c_u1:
+            with st.expander("➕ 新增員工"):
+                with st.form("new_user"):
+                    nu = st.text_input("設定帳號"); np = st.text_input("設定密碼"); nr = st.selectbox("權限", ["Staff", "Admin"])
+                    if st.form_submit_button("開通帳號"):
+                        retry_action(ws_users.append_row, [nu, make_hash(np), nr, "Active", get_taiwan_time_str()])
+                        refresh_mirror("Users"); st.success("帳號已開通"); st.rerun()
+        with c_u2:
+            with st.expander("🗑️ 刪除員工"):
+                du = st.selectbox("選擇要註銷的帳號", users_df['Name'].tolist())
+                if st.button("確認註銷此員工"):
+                    live_hit = locate_rows(ws_users, [du])
+                    if live_hit is None: st.error("⚠️ 連線忙碌，請重試")
+                    elif du in live_hit:
+                        retry_action(ws_users.delete_rows, live_hit[du][0])
+                        refresh_mirror("Users"); st.success("帳號已註銷"); st.rerun()
+                    else: st.error("找不到該帳號")
+
+        inline_cnt = int(df['Image_URL'].astype(str).str.startswith("data:image").sum()) if not df.empty else 0
+        with st.expander(f"🖼️ 圖庫遷移 (舊版內嵌圖片: {inline_cnt} 筆)"):
+            st.caption("將儲存格內的 base64 圖片轉存至內容定址圖庫，Items 只保留短參照；相同圖片只存一份。")
+            if st.button("🚀 開始遷移", disabled=(inline_cnt == 0)):
+                bar = st.progress(0.0)
+                done, failed = migrate_inline_images(ws_items, get_worksheet_safe(sh, "Images", IMAGE_HEADERS), df, progress=bar.progress)
+                if failed: st.warning(f"已遷移 {done} 筆，{failed} 批寫入失敗，可再次執行續傳。")
+                else: st.success(f"已遷移 {done} 筆圖片"); time.sleep(1); st.rerun()
+
+        cutoff = archive_cutoff()
+        ts = logs_df['Timestamp'].astype(str) if not logs_df.empty else pd.Series([], dtype=str)
+        closed_cnt = int((ts.str.match(ARCHIVE_TS.pattern) & (ts < cutoff)).sum())
+        with st.expander(f"🗄️ 日誌歸檔 (熱表 {len(logs_df):,} 筆，可封存 {closed_cnt:,} 筆)"):
+            st.caption(f"把 {cutoff[:7]} 之前已結束月份的日誌逐月搬到 {COLD_PREFIX}YYYYMM 分頁並記入 {ARCHIVE_INDEX}，Logs 只保留當期；"
+                       f"月底後保留 {ARCHIVE_GRACE // 86400} 天才封存。已封存 {len(archive.months)} 個月 ({archive.rows:,} 筆)。建議於非營業時間執行。")
+            if st.button("🚀 開始歸檔", disabled=(closed_cnt == 0 or ws_archive is None)):
+                bar = st.progress(0.0)
+                moved, done, failed = archive_closed_logs(sh, ws_logs, ws_archive, items.cost_map, st.session_state['user_name'], progress=bar.progress)
+                if failed: st.warning(f"已封存 {done} 個月 ({moved} 筆)，{failed} 寫入失敗，可再次執行續做。")
+                else: st.success(f"已封存 {done} 個月 ({moved} 筆)"); time.sleep(1); st.rerun()
+    else:
+        st.error("🔒 權限不足。僅 Admin 可訪問此區域。")
+
 # --- 主程式 ---
 def main():
     if 'logged_in' not in st.session_state: st.session_state['logged_in'] = False; st.session_state['user_name'] = ""
-    if 'pos_cart' not in st.session_state: st.session_state['pos_cart'] = []
+    if 'pos_cart' not in st.session_state: st.session_state['pos_cart'] = Cart()
     if 'exchange_rate' not in st.session_state:
         l_rate, succ = get_live_rate()
         st.session_state['exchange_rate'] = l_rate
@@ -602,9 +2981,10 @@ def main():
     sh = init_db()
     if not sh: st.error("Database Connection Failed"); st.stop()
 
-    ws_items = get_worksheet_safe(sh, "Items", SHEET_HEADERS)
-    ws_logs = get_worksheet_safe(sh, "Logs", ["Timestamp", "User", "Action", "Details"])
-    ws_users = get_worksheet_safe(sh, "Users", ["Name", "Password", "Role", "Status", "Created_At"])
+    # 分頁由註冊表一次解析 (缺少的一次建立)，需要同步的表再一次 values_batch_get 取回
+    wss = get_registry(sh).resolve({"Items": SHEET_HEADERS, "Logs": LOG_HEADERS, "Users": USER_HEADERS, "Shifts": SHIFT_HEADERS, ARCHIVE_INDEX: ARCHIVE_INDEX_HEADERS})
+    ws_items, ws_logs, ws_users = wss["Items"], wss["Logs"], wss["Users"]
+    sync_sheets_batch(sh, [t for t, ws in wss.items() if ws is not None])
 
     if not st.session_state['logged_in']:
         c1, c2, c3 = st.columns([1, 2, 1])
@@ -616,11 +2996,11 @@ def main():
                 u = st.text_input("帳號 (ID)"); p = st.text_input("密碼 (Password)", type="password")
                 if st.form_submit_button("登入 (LOGIN)", type="primary"):
                     with st.spinner("Secure Login..."):
-                        users_df = get_data_safe(ws_users, ["Name", "Password", "Role", "Status", "Created_At"])
+                        users_df = get_data_safe(ws_users, USER_HEADERS)
                         u = u.strip(); p = p.strip()
                         if users_df.empty and u == "Boss" and p == "1234":
                             retry_action(ws_users.append_row, ["Boss", make_hash("1234"), "Admin", "Active", get_taiwan_time_str()])
-                            st.cache_data.clear(); st.success("Boss Created"); time.sleep(1); st.rerun()
+                            refresh_mirror("Users"); st.success("Boss Created"); time.sleep(1); st.rerun()
                         
                         if not users_df.empty and 'Name' in users_df.columns:
                             tgt = users_df[(users_df['Name'] == u) & (users_df['Status'] == 'Active')]
@@ -637,24 +3017,12 @@ def main():
     user_initial = st.session_state['user_name'][0].upper()
     render_navbar(user_initial)
 
-    # QUANTUM DATA FETCH (V126.0 純淨基底無 _RowIdx)
-    df = get_data_safe(ws_items, SHEET_HEADERS)
-    logs_df = get_data_safe(ws_logs, ["Timestamp", "User", "Action", "Details"]) 
-    users_df = get_data_safe(ws_users, ["Name", "Password", "Role", "Status", "Created_At"])
-    staff_list = users_df['Name'].tolist() if not users_df.empty and 'Name' in users_df.columns else []
-
-    # QUANTUM TYPE CASTING
-    for c in ["SKU", "Name", "Category", "Size", "Last_Updated", "Image_URL", "Orig_Currency"]: 
-        if c not in df.columns: df[c] = ""
-    for num in ['Qty', 'Price', 'Cost', 'Safety_Stock', 'Orig_Cost', 'Qty_CN']:
-        if num not in df.columns: df[num] = 0
-        df[num] = pd.to_numeric(df[num], errors='coerce').fillna(0).astype(int)
-    
-    df['Safe_Level'] = df['Safety_Stock'].apply(lambda x: 5 if x == 0 else x)
-    df['SKU'] = df['SKU'].astype(str)
-    
-    product_map = {r['SKU']: f"{r['Name']} ({r['Size']})" for _, r in df.iterrows()} if not df.empty else {}
-    cost_map = {r['SKU']: r['Cost'] for _, r in df.iterrows()} if not df.empty else {}
+    # QUANTUM DATA FETCH (V126.0 純淨基底無 _RowIdx；型別轉換已於快照內完成，所有連線共用同一份唯讀資料)
+    # 離線佇列：未上雲的結帳先疊加到畫面庫存 (AppView.df)，並確保背景重播器在跑
+    view = AppView(wss); items, df = view.items, view.df
+    if view.journal_counts.get("pending"): get_sale_replayer().kick(ws_items, ws_logs)
+    if get_image_store().missing(items.image_refs):
+        with st.spinner("正在還原商品圖庫..."): get_image_store().ensure(items.image_refs, get_worksheet_safe(sh, "Images", IMAGE_HEADERS))
 
     with st.sidebar:
         st.markdown(f"### 👤 {st.session_state['user_name']}")
@@ -667,6 +3035,13 @@ def main():
             if st.button("🔄 更新即時匯率"): 
                 l_rate, succ = get_live_rate()
                 st.session_state['exchange_rate'] = l_rate; st.rerun()
+        if st.session_state['user_role'] == 'Admin':
+            with st.expander("📡 雲端 API 配額"):
+                api = get_limiter().snapshot()
+                st.caption(f"讀取 {api['calls']['read']} 次 / 寫入 {api['calls']['write']} 次 (本行程累計)")
+                st.caption(f"剩餘權杖：讀 {api['tokens']['read']} / 寫 {api['tokens']['write']} ｜ 排隊中 {api['queued']}")
+                st.caption(f"限流等待 {api['throttled']} 次 (共 {api['wait_s']:.1f}s) ｜ 重試 {api['retried']} ｜ 失敗 {api['failed']}")
+                if api['backoff_s'] > 0: st.warning(f"⏳ 全域退避中，{api['backoff_s']:.0f}s 後恢復")
         st.markdown("---")
         if st.button("🚪 登出系統"): st.session_state['logged_in'] = False; st.rerun()
 
@@ -677,13 +3052,7 @@ def main():
     total_cost = ((df['Qty'] + df['Qty_CN']) * df['Cost']).sum() if not df.empty else 0
     total_rev = (df['Qty'] * df['Price']).sum() if not df.empty else 0
     profit = total_rev - (df['Qty'] * df['Cost']).sum() if not df.empty else 0
-    realized_revenue = calculate_realized_revenue(logs_df)
-    sunk_cost = calculate_sunk_cost(logs_df, cost_map)
-    
-    rmb_stock_value = 0
-    if not df.empty and 'Orig_Currency' in df.columns:
-        rmb_items = df[df['Orig_Currency'] == 'CNY']
-        if not rmb_items.empty: rmb_stock_value = ((rmb_items['Qty'] + rmb_items['Qty_CN']) * rmb_items['Orig_Cost']).sum()
+    realized_revenue, sunk_cost, rmb_stock_value = view.metrics["revenue"], view.metrics["sunk_cost"], view.rmb_stock_value
 
     m1, m2, m3, m4, m5, m6 = st.columns(6)
     with m1: st.markdown(f"<div class='metric-card'><div class='metric-label'>📦 總庫存 (TW+CN)</div><div class='metric-value'>{total_qty:,}</div><div style='font-size:10px; color:#64748b;'>🇹🇼:{total_qty_tw} | 🇨🇳:{total_qty_cn}</div></div>", unsafe_allow_html=True)
@@ -694,853 +3063,19 @@ def main():
     with m6: st.markdown(f"<div class='metric-card realized-card'><div class='metric-label'>💵 實際營收 (已售)</div><div class='metric-value' style='color:#059669 !important'>${realized_revenue:,}</div></div>", unsafe_allow_html=True)
 
     st.markdown("---")
-    tabs = st.tabs(["📊 視覺庫存", "🛒 POS", "📈 銷售戰情", "🎁 領用/稽核看板", "👔 矩陣管理", "📝 日誌", "👥 Admin", "🗓️ 排班"])
-
-    with tabs[0]:
-        inv_t1, inv_t2 = st.tabs(["📦 庫存巡報區 (Smart Alert)", "💰 成本與毛利總覽矩陣 (Cost Matrix)"])
-        
-        with inv_t1:
-            if not df.empty:
-                c1, c2 = st.columns([1, 1])
-                with c1:
-                    fig_pie = px.pie(df, names='Category', values='Qty', hole=0.5, color_discrete_sequence=px.colors.qualitative.Pastel)
-                    fig_pie.update_traces(textposition='inside', textinfo='percent+label')
-                    fig_pie.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font_color='#0f172a', margin=dict(t=0, b=0, l=0, r=0))
-                    st.plotly_chart(fig_pie, use_container_width=True)
-                with c2:
-                    top = df.groupby(['Name']).agg({'Qty':'sum'}).reset_index().sort_values(by='Qty', ascending=False).head(10)
-                    fig_bar = px.bar(top, x='Qty', y='Name', orientation='h', text='Qty', color='Qty', color_continuous_scale=px.colors.qualitative.Pastel)
-                    fig_bar.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font_color='#0f172a', margin=dict(t=0, b=0, l=0, r=0))
-                    st.plotly_chart(fig_bar, use_container_width=True)
-                    
-            st.divider()
-            c_search1, c_search2, c_search3 = st.columns([2, 1, 1])
-            with c_search1: search_q = st.text_input("🔍 搜尋商品", placeholder="輸入貨號或品名...")
-            with c_search2: filter_cat = st.selectbox("📂 分類篩選", ["全部"] + CAT_LIST)
-            with c_search3: 
-                st.markdown("<br>", unsafe_allow_html=True) 
-                show_low_stock = st.toggle("🚨 僅顯示低庫存警報", value=False)
-                
-            gallery_df = df.copy()
-            if search_q: gallery_df = gallery_df[gallery_df.apply(lambda x: search_q.lower() in str(x.values).lower(), axis=1)]
-            if filter_cat != "全部": gallery_df = gallery_df[gallery_df['Category'] == filter_cat]
-            if show_low_stock: gallery_df = gallery_df[gallery_df['Qty'] < gallery_df['Safe_Level']]
-            
-            if not gallery_df.empty:
-                items_per_page = 10
-                grouped_names = list(gallery_df.groupby('Name').groups.keys())
-                total_pages = math.ceil(len(grouped_names) / items_per_page)
-                curr_page = st.session_state.get('inv_page', 1)
-                if curr_page > total_pages: curr_page = total_pages
-                if curr_page < 1: curr_page = 1
-                st.session_state['inv_page'] = curr_page
-                
-                c_p1, c_p2, c_p3 = st.columns([1, 2, 1])
-                with c_p1: 
-                    if st.button("◀", key="p_up_prev", use_container_width=True, disabled=(curr_page==1)): st.session_state['inv_page'] -= 1; st.rerun()
-                with c_p2: st.markdown(f"<div style='text-align:center;font-weight:bold;padding-top:10px;'>第 {curr_page} / {total_pages} 頁</div>", unsafe_allow_html=True)
-                with c_p3:
-                    if st.button("▶", key="p_up_next", use_container_width=True, disabled=(curr_page==total_pages)): st.session_state['inv_page'] += 1; st.rerun()
-
-                start_idx = (curr_page - 1) * items_per_page
-                end_idx = start_idx + items_per_page
-                page_names = grouped_names[start_idx:end_idx]
-
-                for name in page_names:
-                    group = gallery_df[gallery_df['Name'] == name]
-                    first_row = group.iloc[0]; img = render_image_url(first_row['Image_URL']); price = int(first_row['Price'])
-                    display_sku = str(first_row['SKU'])
-                    total_qty_tw = group['Qty'].sum(); total_qty_cn = group['Qty_CN'].sum()
-                    
-                    group_safe = group.copy()
-                    group_safe['size_sort'] = group_safe['Size'].apply(get_size_sort_key)
-                    sorted_group = group_safe.sort_values('size_sort')
-                    
-                    stock_badges = ""
-                    has_warning = False
-                    restock_advice = 0
-                    
-                    for _, r in sorted_group.iterrows():
-                        cls = "has-stock" if r['Qty'] > 0 else "no-stock"
-                        if r['Qty'] < r['Safe_Level']: 
-                            cls = "no-stock"
-                            has_warning = True
-                            restock_advice += (r['Safe_Level'] - r['Qty'])
-                        stock_badges += f"<span class='stock-tag {cls}'><span>{r['Size']}:{r['Qty']}</span></span>"
-
-                    warning_html = f"<span style='color:#ef4444; font-weight:bold; font-size:0.8rem; margin-left:10px;'>⚠️ 需補貨 (建議補 {restock_advice} 件)</span>" if has_warning else ""
-
-                    with st.container(border=True):
-                        st.markdown(f"""
-                        <div class='inv-row'>
-                            <img src='{img}' class='inv-img'>
-                            <div class='inv-info'>
-                                <div class='inv-title'>{name} {warning_html}</div>
-                                <div class='inv-meta'>{display_sku} | ${price}</div>
-                                <div class='stock-tag-row'>{stock_badges}</div>
-                                <div style='font-size:0.8rem; color:#64748b; margin-top:4px;'>
-                                    🇹🇼 總庫存: <b>{total_qty_tw}</b> | 🇨🇳 中國倉: <b>{total_qty_cn}</b>
-                                </div>
-                            </div>
-                        </div>
-                        """, unsafe_allow_html=True)
-
-                        with st.expander("⚙️ 進階編輯與庫存管理"):
-                            tab_qty, tab_info, tab_del = st.tabs(["📦 數量微調", "✏️ 基礎資訊修改 (全尺寸套用)", "🗑️ 徹底刪除此款"])
-                            
-                            with tab_qty:
-                                with st.form(f"qty_{name}"):
-                                    i_tw = {}; i_cn = {}; g_cols = st.columns(4)
-                                    for idx, r_data in enumerate(sorted_group.iterrows()):
-                                        _, row = r_data
-                                        with g_cols[idx%4]: 
-                                            lbl = row['Size']; i_tw[row['SKU']] = st.number_input(f"TW {lbl}", value=int(row['Qty']), key=f"t_{row['SKU']}"); i_cn[row['SKU']] = st.number_input(f"CN {lbl}", value=int(row['Qty_CN']), key=f"c_{row['SKU']}")
-                                    if st.form_submit_button("💾 儲存庫存變更", use_container_width=True):
-                                        with st.spinner("雲端聯動中..."):
-                                            all_item_vals = ws_items.get_all_values()
-                                            live_df = pd.DataFrame(all_item_vals[1:], columns=all_item_vals[0])
-                                            cell_list = []
-                                            for tsku, n_tw in i_tw.items():
-                                                if tsku in df['SKU'].tolist():
-                                                    try:
-                                                        row_idx = live_df.index[live_df['SKU'] == tsku].tolist()[0] + 2 
-                                                        n_cn = i_cn[tsku]
-                                                        cell_list.extend([
-                                                            gspread.Cell(row_idx, 5, n_tw),
-                                                            gspread.Cell(row_idx, 13, n_cn),
-                                                            gspread.Cell(row_idx, 8, get_taiwan_time_str())
-                                                        ])
-                                                    except: pass
-                                            if cell_list:
-                                                retry_action(ws_items.update_cells, cell_list)
-                                                st.cache_data.clear(); st.success("數量已瞬間更新！"); time.sleep(0.5); st.rerun()
-
-                            with tab_info:
-                                with st.form(f"info_{name}"):
-                                    st.caption(f"修改此處資訊將絕對精準同步至「{name}」的所有尺寸，不再波及無關商品！")
-                                    c_i1, c_i2 = st.columns(2)
-                                    new_name = c_i1.text_input("品名", value=name)
-                                    new_cat = c_i2.selectbox("分類", CAT_LIST, index=CAT_LIST.index(first_row['Category']) if first_row['Category'] in CAT_LIST else 0)
-                                    
-                                    c_i3, c_i4 = st.columns(2)
-                                    new_price = c_i3.number_input("終端售價", value=int(first_row['Price']))
-                                    new_orig_curr = c_i4.selectbox("原幣別", ["TWD", "CNY"], index=["TWD", "CNY"].index(first_row['Orig_Currency']) if first_row['Orig_Currency'] in ["TWD", "CNY"] else 0)
-                                    
-                                    c_i5, c_i6 = st.columns(2)
-                                    new_orig_cost = c_i5.number_input("原幣成本", value=int(first_row['Orig_Cost']))
-                                    new_safe = c_i6.number_input("安全庫存警告線", value=int(first_row['Safety_Stock']))
-                                    
-                                    new_img_url = st.text_input("直接輸入圖片網址 (若有)", value=first_row['Image_URL'])
-                                    new_img_file = st.file_uploader("或上傳新圖片覆蓋 (內建快取圖床引擎)", key=f"img_{name}")
-                                    
-                                    if st.form_submit_button("✅ 儲存商品資訊覆蓋", type="primary", use_container_width=True):
-                                        with st.spinner("圖片壓縮與雲端寫入中..."):
-                                            uploaded_b64 = process_image_to_base64(new_img_file) if new_img_file else None
-                                            final_img = uploaded_b64 if uploaded_b64 else new_img_url
-                                            
-                                            final_cost = int(new_orig_cost * st.session_state['exchange_rate']) if new_orig_curr == "CNY" else new_orig_cost
-                                            
-                                            cell_list = []
-                                            for idx, r_data in enumerate(ws_items.get_all_values()):
-                                                if idx == 0: continue
-                                                if r_data[1] == name: # 精準比對
-                                                    row_num = idx + 1
-                                                    cell_list.extend([
-                                                        gspread.Cell(row_num, 2, new_name),
-                                                        gspread.Cell(row_num, 3, new_cat),
-                                                        gspread.Cell(row_num, 6, new_price),
-                                                        gspread.Cell(row_num, 7, final_cost),
-                                                        gspread.Cell(row_num, 8, get_taiwan_time_str()),
-                                                        gspread.Cell(row_num, 9, final_img),
-                                                        gspread.Cell(row_num, 10, new_safe),
-                                                        gspread.Cell(row_num, 11, new_orig_curr),
-                                                        gspread.Cell(row_num, 12, new_orig_cost)
-                                                    ])
-                                            if cell_list:
-                                                retry_action(ws_items.update_cells, cell_list)
-                                                st.cache_data.clear(); st.success("商品資訊已全數精準更新！"); time.sleep(1); st.rerun()
-
-                            with tab_del:
-                                st.warning("🔴 警告：按下此按鈕將永久刪除此款式的所有庫存資料。")
-                                if st.button(f"🗑️ 確認刪除所有 {name}", key=f"del_{name}", use_container_width=True):
-                                    all_vals = ws_items.get_all_values()
-                                    rows_to_del = [idx + 1 for idx, r in enumerate(all_vals) if idx > 0 and r[1] == name]
-                                    for r_idx in reversed(rows_to_del): retry_action(ws_items.delete_rows, r_idx)
-                                    st.cache_data.clear(); st.success(f"{name} 已徹底刪除"); time.sleep(1); st.rerun()
-
-                c_p4, c_p5, c_p6 = st.columns([1, 2, 1])
-                with c_p4: 
-                    if st.button("◀", key="p_dn_prev", use_container_width=True, disabled=(curr_page==1)): st.session_state['inv_page'] -= 1; st.rerun()
-                with c_p5: st.markdown(f"<div style='text-align:center;font-weight:bold;padding-top:10px;'>{curr_page} / {total_pages}</div>", unsafe_allow_html=True)
-                with c_p6:
-                    if st.button("▶", key="p_dn_next", use_container_width=True, disabled=(curr_page==total_pages)): st.session_state['inv_page'] += 1; st.rerun()
-
-            else: st.info("查無符合條件的商品")
-
-        with inv_t2:
-            st.markdown("#### 💰 成本與定價總覽矩陣 (Cost & Margin Matrix)")
-            st.markdown("此頁面統一匯總所有商品的 **人民幣成本 (RMB) / 台幣成本 (TWD) / 定價 / 單件毛利**，方便老闆隨時掌控利潤空間。")
-            if not df.empty:
-                cost_df = df[['SKU', 'Name', 'Category', 'Orig_Currency', 'Orig_Cost', 'Cost', 'Price', 'Qty', 'Qty_CN']].copy()
-                cost_df['毛利 (TWD)'] = cost_df['Price'] - cost_df['Cost']
-                cost_df['毛利率 (%)'] = (cost_df['毛利 (TWD)'] / cost_df['Price'] * 100).fillna(0).round(1).astype(str) + "%"
-                cost_df.columns = ['貨號 (SKU)', '品名', '分類', '原幣別', '原幣成本(¥/NT$)', '台幣成本($)', '終端定價($)', 'TW現貨', 'CN現貨', '單件毛利($)', '毛利率(%)']
-                st.dataframe(cost_df, use_container_width=True, hide_index=True)
-                
-                c_dl1, c_dl2 = st.columns([1, 1])
-                with c_dl1:
-                    st.download_button("📥 下載完整 Excel 報表 (防亂碼)", data=cost_df.to_csv(index=False).encode('utf-8-sig'), file_name=f"Cost_Matrix_{date.today()}.csv", mime="text/csv", use_container_width=True)
-                with st.expander("📋 手機/電腦 一鍵複製表格數據 (防跑版)"):
-                    st.caption("💡 點擊下方黑框【右上角的複製圖示】，即可完美貼上至 Excel、Google Sheets 或 LINE，欄位絕對對齊。")
-                    st.code(cost_df.to_csv(index=False, sep='\t'), language="text")
-                
-                st.divider()
-                st.markdown("#### ⚡ 全域庫存與財務極速控制台 (Omni-Data Hub)")
-                st.info("💡 在此直接選擇單一 SKU，即可瞬間修改該尺寸的所有核心數據，並自動聯動計算毛利與營收。")
-                
-                c_sel, c_blank = st.columns([2, 2])
-                edit_sku = c_sel.selectbox("選擇要獨立修正的商品 (單一 SKU)", ["..."] + df['SKU'].tolist())
-                
-                if edit_sku != "...":
-                    tgt_row = df[df['SKU'] == edit_sku].iloc[0]
-                    tgt_name = tgt_row['Name']
-                    
-                    with st.form("quick_cost_edit"):
-                        st.markdown(f"**正在編輯：{tgt_name} ({edit_sku})**")
-                        
-                        c1, c2, c3 = st.columns(3)
-                        n_qty_tw = c1.number_input("TW 台灣現貨", value=int(tgt_row['Qty']), min_value=0)
-                        n_qty_cn = c2.number_input("CN 中國現貨", value=int(tgt_row['Qty_CN']), min_value=0)
-                        n_safe = c3.number_input("安全庫存警告線", value=int(tgt_row['Safety_Stock']), min_value=0)
-                        
-                        st.markdown("---")
-                        c4, c5, c6 = st.columns(3)
-                        n_curr = c4.selectbox("原幣別", ["CNY", "TWD"], index=["CNY", "TWD"].index(tgt_row['Orig_Currency']) if tgt_row['Orig_Currency'] in ["CNY", "TWD"] else 0)
-                        n_ocost = c5.number_input("原幣成本", value=int(tgt_row['Orig_Cost']), min_value=0)
-                        n_price = c6.number_input("終端定價", value=int(tgt_row['Price']), min_value=0)
-                        
-                        apply_style = st.checkbox(f"✅ 同步套用【成本與定價】至所有品名為 ({tgt_name}) 的尺寸 (庫存數量不會同步)", value=True)
-                        
-                        if st.form_submit_button("💾 確認更新全域數據", type="primary", use_container_width=True):
-                            with st.spinner("雲端批次聯動更新中..."):
-                                new_twd_cost = int(n_ocost * st.session_state['exchange_rate']) if n_curr == "CNY" else n_ocost
-                                cell_list = []
-                                updated_count = 0
-                                
-                                for idx, r_data in enumerate(ws_items.get_all_values()):
-                                    if idx == 0: continue
-                                    curr_sku = r_data[0]
-                                    row_num = idx + 1
-                                    
-                                    if curr_sku == edit_sku:
-                                        cell_list.extend([
-                                            gspread.Cell(row_num, 5, n_qty_tw),
-                                            gspread.Cell(row_num, 13, n_qty_cn),
-                                            gspread.Cell(row_num, 10, n_safe)
-                                        ])
-                                        
-                                    should_update_cost = (apply_style and r_data[1] == tgt_name) or (not apply_style and curr_sku == edit_sku)
-                                    if should_update_cost:
-                                        cell_list.extend([
-                                            gspread.Cell(row_num, 6, n_price),
-                                            gspread.Cell(row_num, 7, new_twd_cost),
-                                            gspread.Cell(row_num, 8, get_taiwan_time_str()),
-                                            gspread.Cell(row_num, 11, n_curr),
-                                            gspread.Cell(row_num, 12, n_ocost)
-                                        ])
-                                        updated_count += 1
-                                        
-                                if cell_list:
-                                    retry_action(ws_items.update_cells, cell_list)        
-                                    st.cache_data.clear()
-                                    st.success(f"更新成功！已聯動修改 {updated_count} 筆商品資料，毛利與庫存計算已全域同步。")
-                                    time.sleep(1.5)
-                                    st.rerun()
-            else:
-                st.info("尚無商品數據。")
-
-    with tabs[1]:
-        c_l, c_r = st.columns([3, 2])
-        with c_l:
-            st.markdown("##### 🛍️ POS 快速結帳區")
-            
-            st.markdown("<div class='barcode-form'>", unsafe_allow_html=True)
-            with st.form("barcode_scanner", clear_on_submit=True):
-                bc_input = st.text_input("🎯 條碼/貨號快速掃描 (支援掃描槍，按 Enter 直接加入)")
-                bc_submit = st.form_submit_button("掃描")
-                if bc_submit and bc_input:
-                    bc_match = df[df['SKU'] == bc_input.strip()]
-                    if not bc_match.empty:
-                        bc_item = bc_match.iloc[0]
-                        if bc_item['Qty'] > 0:
-                            st.session_state['pos_cart'].append({"sku":bc_item['SKU'],"name":bc_item['Name'],"size":bc_item['Size'],"price":bc_item['Price'],"qty":1,"subtotal":bc_item['Price']})
-                            st.success(f"✅ 已掃描加入: {bc_item['Name']} ({bc_item['Size']})")
-                        else:
-                            st.error(f"❌ 庫存不足: {bc_item['Name']} 已售完")
-                    else:
-                        st.error(f"⚠️ 找不到條碼: {bc_input}")
-            st.markdown("</div>", unsafe_allow_html=True)
-
-            cats_available = list(df['Category'].unique()) if not df.empty else []
-            all_cats = sorted(list(set(CAT_LIST + cats_available)))
-            col_s1, col_s2 = st.columns([2,1])
-            q = col_s1.text_input("手動搜尋 (品名/貨號)", placeholder="輸入關鍵字...", label_visibility="collapsed")
-            cat = col_s2.selectbox("POS分類", ["全部"] + all_cats, label_visibility="collapsed")
-            
-            vdf = df.copy()
-            if cat != "全部": vdf = vdf[vdf['Category'] == cat]
-            if q: vdf = vdf[vdf.apply(lambda x: q.lower() in str(x.values).lower(), axis=1)]
-            
-            if not vdf.empty:
-                vdf = vdf.sort_values(['Name', 'Size'])
-                vdf = vdf.head(40)
-                rows = [vdf.iloc[i:i+3] for i in range(0, len(vdf), 3)]
-                for r in rows:
-                    cols = st.columns(3)
-                    for i, (_, item) in enumerate(r.iterrows()):
-                        with cols[i]:
-                            stock_clr = "#166534" if item['Qty'] > 0 else "#991b1b"
-                            st.markdown(f"""
-                            <div class='pos-card'>
-                                <div class='pos-img'><img src='{render_image_url(item['Image_URL'])}' style='width:100%;height:100%;object-fit:cover;'></div>
-                                <div class='pos-content'>
-                                    <div class='pos-title'>{item['Name']}</div>
-                                    <div class='pos-meta'>{item['Size']} | {item['Category']}</div>
-                                    <div class='pos-price-row'>
-                                        <div class='pos-price'>${item['Price']}</div>
-                                        <div class='pos-stock' style='color:{stock_clr}; font-weight:bold;'>現貨:{item['Qty']}</div>
-                                    </div>
-                                </div>
-                            </div>
-                            """, unsafe_allow_html=True)
-                            
-                            if item['Qty'] > 0:
-                                if st.button("➕ 加入購物車", key=f"add_{item['SKU']}", use_container_width=True):
-                                    st.session_state['pos_cart'].append({"sku":item['SKU'],"name":item['Name'],"size":item['Size'],"price":item['Price'],"qty":1,"subtotal":item['Price']})
-                                    st.toast(f"已加入 {item['Name']}")
-                            else:
-                                st.button("❌ 已售完", key=f"out_{item['SKU']}", use_container_width=True, disabled=True)
-            else: st.info("無商品")
-        
-        with c_r:
-            st.markdown("##### 🧾 當前購物車 (實時毛利試算)")
-            with st.container():
-                st.markdown("<div class='cart-box'>", unsafe_allow_html=True)
-                if st.session_state['pos_cart']:
-                    base_raw = sum(i['subtotal'] for i in st.session_state['pos_cart'])
-                    for i in st.session_state['pos_cart']: 
-                        st.markdown(f"<div class='cart-item'><span>{i['name']} ({i['size']}) x{i['qty']}</span><b>${i['subtotal']}</b></div>", unsafe_allow_html=True)
-                    if st.button("🗑️ 清空購物車"): st.session_state['pos_cart']=[]; st.rerun()
-                    st.markdown("---")
-                    
-                    col_d1, col_d2 = st.columns(2)
-                    use_bundle = col_d1.checkbox("啟用組合價")
-                    bundle_val = col_d2.number_input("組合總價", value=base_raw) if use_bundle else 0
-                    calc_base = bundle_val if use_bundle else base_raw
-                    
-                    st.markdown("---")
-                    col_disc1, col_disc2 = st.columns(2)
-                    disc_mode = col_disc1.radio("優惠方式", ["無", "7折", "8折", "自訂折數%", "直接輸入結帳總額"], horizontal=True)
-                    
-                    final_total = calc_base
-                    note_arr = []
-                    if use_bundle: note_arr.append(f"(組合價${bundle_val})")
-                    
-                    if disc_mode == "7折": 
-                        final_total = int(round(calc_base * 0.7)); note_arr.append("(7折)")
-                    elif disc_mode == "8折": 
-                        final_total = int(round(calc_base * 0.8)); note_arr.append("(8折)")
-                    elif disc_mode == "自訂折數%":
-                        cust_off = col_disc2.number_input("輸入折數 % (例:95=95折)", 1, 100, 95)
-                        final_total = int(round(calc_base * (cust_off/100))); note_arr.append(f"({cust_off}折)")
-                    elif disc_mode == "直接輸入結帳總額":
-                        cust_price = col_disc2.number_input("輸入最終結帳金額 ($)", value=int(calc_base), min_value=0)
-                        final_total = int(cust_price); note_arr.append(f"(手動改總價)")
-                    
-                    total_cart_cost = 0
-                    for cart_item in st.session_state['pos_cart']:
-                        match_item = df[df['SKU'] == cart_item['sku']]
-                        if not match_item.empty:
-                            total_cart_cost += int(match_item['Cost'].values[0]) * cart_item['qty']
-                    
-                    est_profit = final_total - total_cart_cost
-                    est_margin = round((est_profit / final_total * 100), 1) if final_total > 0 else 0
-                    
-                    note_str = " ".join(note_arr)
-                    st.markdown(f"<div style='font-size:2rem; font-weight:900; color:#0f172a; text-align:right;'>應收: ${final_total}</div>", unsafe_allow_html=True)
-                    st.markdown(f"<div style='text-align:right; color:#059669; font-weight:bold; margin-bottom:15px;'>💡 本單預估毛利: ${est_profit} ({est_margin}%)</div>", unsafe_allow_html=True)
-                    
-                    sale_who = st.selectbox("經手人員", [st.session_state['user_name']] + [u for u in staff_list if u != st.session_state['user_name']])
-                    sale_ch = st.selectbox("銷售通路", ["門市","官網","直播","網路","其他"]) 
-                    pay = st.selectbox("付款方式", ["現金","刷卡","轉帳","禮券","其他"])
-                    note = st.text_input("備註說明")
-                    
-                    if st.button("✅ 確認結帳 (防超賣批次驗證)", type="primary", use_container_width=True):
-                        with st.spinner("交易鎖定，庫存核對中..."):
-                            logs = []
-                            valid = True
-                            cell_list = []
-                            
-                            all_item_vals = ws_items.get_all_values()
-                            live_df = pd.DataFrame(all_item_vals[1:], columns=all_item_vals[0])
-                            
-                            for item in st.session_state['pos_cart']:
-                                try:
-                                    live_qty = int(live_df.loc[live_df['SKU'] == item['sku'], 'Qty'].values[0])
-                                    live_row_idx = live_df.index[live_df['SKU'] == item['sku']].tolist()[0] + 2
-                                    
-                                    if live_qty >= item['qty']:
-                                        cell_list.append(gspread.Cell(live_row_idx, 5, live_qty - item['qty']))
-                                        logs.append(f"{item['sku']} x{item['qty']}")
-                                    else: 
-                                        st.error(f"❌ 防禦攔截：{item['name']} 雲端庫存已被買走，目前剩餘 {live_qty} 件。")
-                                        valid = False; break
-                                except:
-                                    st.error(f"❌ 找不到商品：{item['name']}")
-                                    valid = False; break
-                                    
-                            if valid and cell_list:
-                                retry_action(ws_items.update_cells, cell_list)
-                                content = f"Sale | Total:${final_total} | Items:{','.join(logs)} | Note:{note} {note_str} | Pay:{pay} | Channel:{sale_ch} | By:{sale_who}"
-                                log_event(ws_logs, st.session_state['user_name'], "Sale", content)
-                                st.session_state['pos_cart'] = []
-                                st.cache_data.clear(); st.balloons(); st.success("結帳成功！批次庫存已同步"); time.sleep(1.5); st.rerun()
-                else: st.info("🛒 目前購物車是空的")
-                st.markdown("</div>", unsafe_allow_html=True)
-
-    with tabs[2]:
-        st.subheader("📈 營運戰情室 (Financial Hub)")
-        rev = (df['Qty'] * df['Price']).sum() if not df.empty else 0
-        cost = ((df['Qty'] + df['Qty_CN']) * df['Cost']).sum() if not df.empty else 0
-        profit = rev - (df['Qty'] * df['Cost']).sum() if not df.empty else 0
-        real = calculate_realized_revenue(logs_df)
-        
-        m1, m2, m3, m4 = st.columns(4)
-        m1.markdown(f"<div class='metric-card'><div class='metric-label'>總預估營收</div><div class='metric-value'>${rev:,}</div></div>", unsafe_allow_html=True)
-        m2.markdown(f"<div class='metric-card'><div class='metric-label'>庫存總成本 (TWD)</div><div class='metric-value'>${cost:,}</div><div style='font-size:10px;'>含 RMB 原幣: ¥{rmb_stock_value:,}</div></div>", unsafe_allow_html=True)
-        m3.markdown(f"<div class='metric-card'><div class='metric-label'>潛在最高毛利</div><div class='metric-value' style='color:#d97706'>${profit:,}</div></div>", unsafe_allow_html=True)
-        m4.markdown(f"<div class='metric-card'><div class='metric-label'>已入帳營收 (實際)</div><div class='metric-value' style='color:#059669'>${real:,}</div></div>", unsafe_allow_html=True)
-        st.markdown("---")
-        
-        st.markdown("##### 📅 結算週期與財務篩選 (全自動透視)")
-        c_date1, c_date2 = st.columns(2)
-        start_d = c_date1.date_input("分析起始日期", value=date.today().replace(day=1))
-        end_d = c_date2.date_input("分析結束日期", value=date.today())
-        
-        sales_data = []
-        if not logs_df.empty:
-            s_logs = logs_df[logs_df['Action'] == 'Sale']
-            for idx, row in s_logs.iterrows():
-                try:
-                    ts_str = str(row['Timestamp']).split(' ')[0]
-                    try:
-                        log_date = datetime.strptime(ts_str, "%Y-%m-%d").date()
-                    except ValueError:
-                        continue
-                    
-                    if start_d <= log_date <= end_d:
-                        d = str(row['Details'])
-                        total_m = re.search(r'Total:\s*\$?\s*(\d+)', d)
-                        total_v = int(total_m.group(1)) if total_m else 0
-                        
-                        ch_v = "未分類"
-                        if "Channel:" in d: ch_m = re.search(r'Channel:(.*?) \|', d + " |"); ch_v = ch_m.group(1).strip() if ch_m else "未分類"
-                        elif " | " in d: ch_m = re.search(r' \| (門市|官網|直播|網路|其他)', d); ch_v = ch_m.group(1) if ch_m else "未分類"
-
-                        pay_v = "未分類"
-                        if "Pay:" in d: pay_m = re.search(r'Pay:(.*?) \|', d + " |"); pay_v = pay_m.group(1).strip() if pay_m else "未分類"
-
-                        by_v = str(row['User'])
-                        if "By:" in d: 
-                            by_m = re.search(r'By:([a-zA-Z0-9_\u4e00-\u9fa5]+)', d)
-                            by_v = by_m.group(1) if by_m else str(row['User'])
-                        
-                        items_v = "-"
-                        if "Items:" in d: 
-                            items_str = re.search(r'Items:(.*?) \|', d).group(1)
-                            parsed_items = []
-                            for part in items_str.split(','):
-                                p_sku = part.split(' x')[0].strip()
-                                p_qty = part.split(' x')[1].strip() if ' x' in part else "?"
-                                p_name = product_map.get(p_sku, p_sku)
-                                parsed_items.append(f"{p_name} x{p_qty}")
-                            items_v = ", ".join(parsed_items)
-
-                        if total_v > 0: 
-                            # 使用 DataFrame 的真實 Index + 2 對應到 Google Sheet 行號
-                            sales_data.append({"_SheetRow": idx + 2, "日期":row['Timestamp'],"金額":total_v,"通路":ch_v,"付款":pay_v,"銷售員":by_v,"明細":items_v, "原始Log": d})
-                except Exception as ex: 
-                    pass
-        sdf = pd.DataFrame(sales_data)
-        
-        if not sdf.empty:
-            pay_stats = sdf.groupby('付款')['金額'].sum().to_dict()
-            fc1, fc2, fc3, fc4 = st.columns(4)
-            fc1.markdown(f"<div class='finance-card'><div class='finance-lbl'>💰 現金收入</div><div class='finance-val'>${pay_stats.get('現金', 0):,}</div></div>", unsafe_allow_html=True)
-            fc2.markdown(f"<div class='finance-card'><div class='finance-lbl'>🏦 轉帳收入</div><div class='finance-val'>${pay_stats.get('轉帳', 0):,}</div></div>", unsafe_allow_html=True)
-            fc3.markdown(f"<div class='finance-card'><div class='finance-lbl'>💳 刷卡收入</div><div class='finance-val'>${pay_stats.get('刷卡', 0):,}</div></div>", unsafe_allow_html=True)
-            fc4.markdown(f"<div class='finance-card'><div class='finance-lbl'>🎫 禮券/其他</div><div class='finance-val'>${pay_stats.get('禮券', 0) + pay_stats.get('其他', 0):,}</div></div>", unsafe_allow_html=True)
-            st.markdown("---")
-
-            c1, c2 = st.columns(2)
-            with c1: 
-                fig = px.pie(sdf, names='通路', values='金額', hole=0.4, title="📊 通路營收佔比", color_discrete_sequence=px.colors.qualitative.Pastel)
-                fig.update_traces(textposition='inside', textinfo='percent+label')
-                fig.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font_color='#0f172a', margin=dict(t=0, b=0, l=0, r=0))
-                st.plotly_chart(fig, use_container_width=True)
-            with c2: 
-                fig2 = px.bar(sdf.groupby('銷售員')['金額'].sum().reset_index(), x='銷售員', y='金額', title="🏆 人員業績排行", color='金額', color_continuous_scale=px.colors.sequential.Teal)
-                fig2.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font_color='#0f172a', margin=dict(t=0, b=0, l=0, r=0))
-                st.plotly_chart(fig2, use_container_width=True)
-            
-            st.markdown("##### 📝 銷售明細總表 (含售後管理)")
-            clean_sdf = sdf.drop(columns=['原始Log', '_SheetRow'])
-            st.dataframe(clean_sdf, use_container_width=True, hide_index=True)
-
-            c_dl1, c_dl2 = st.columns([1, 1])
-            with c_dl1:
-                st.download_button("📥 下載銷售明細 (防亂碼)", data=clean_sdf.to_csv(index=False).encode('utf-8-sig'), file_name=f"Sales_{date.today()}.csv", mime="text/csv", use_container_width=True)
-            with st.expander("📋 手機/電腦 一鍵複製表格數據 (防跑版)"):
-                st.caption("💡 點擊下方黑框【右上角的複製圖示】，即可完美貼上至 Excel、Google Sheets 或 LINE，欄位絕對對齊。")
-                st.code(clean_sdf.to_csv(index=False, sep='\t'), language="text")
-
-            # V130.0 單點狙擊刪除與業績自由轉移
-            with st.expander("🛠️ 編輯/刪除作廢訂單 (自動回補庫存與業績轉移)"):
-                st.info("💡 系統已注入絕對行號鎖定技術，防範同分同秒重複訂單錯殺。更可直接修改銷售員歸屬，重算業績。")
-                sale_opts = sdf.apply(lambda x: f"[單號: {x['_SheetRow']}] {x['日期']} | ${x['金額']} | {x['明細'][:30]}...", axis=1).tolist()
-                sel_sale = st.selectbox("選擇要處理的歷史訂單", ["..."] + sale_opts)
-                
-                if sel_sale != "...":
-                    target_row_idx = int(re.search(r'\[單號:\s*(\d+)\]', sel_sale).group(1))
-                    target_row = sdf[sdf['_SheetRow'] == target_row_idx].iloc[0]
-                    raw_log = target_row['原始Log']
-                    
-                    curr_note = ""; curr_ch = ""; curr_pay = ""; curr_items_str = ""
-                    try:
-                        curr_items_str = re.search(r'Items:(.*?) \|', raw_log).group(1)
-                        if "Note:" in raw_log: curr_note = re.search(r'Note:(.*?) \|', raw_log + " |").group(1).strip()
-                        if "Channel:" in raw_log: curr_ch = re.search(r'Channel:(.*?) \|', raw_log + " |").group(1).strip()
-                        if "Pay:" in raw_log: curr_pay = re.search(r'Pay:(.*?) \|', raw_log + " |").group(1).strip()
-                    except: pass
-                    
-                    curr_who = target_row['銷售員']
-
-                    with st.form("edit_sale_form"):
-                        e_items = st.text_area("商品內容 (請保持原本的「SKU x數量」格式，逗號分隔)", value=curr_items_str)
-                        c_e1, c_e2, c_e3, c_e4 = st.columns(4)
-                        e_total = c_e1.number_input("總金額", value=int(target_row['金額']))
-                        e_ch = c_e2.selectbox("通路", ["門市","官網","直播","網路","其他"], index=["門市","官網","直播","網路","其他"].index(curr_ch) if curr_ch in ["門市","官網","直播","網路","其他"] else 0)
-                        e_pay = c_e3.selectbox("付款", ["現金","刷卡","轉帳","禮券","其他"], index=["現金","刷卡","轉帳","禮券","其他"].index(curr_pay) if curr_pay in ["現金","刷卡","轉帳","禮券","其他"] else 0)
-                        e_who = c_e4.selectbox("銷售人員 (修改將轉移業績)", staff_list, index=staff_list.index(curr_who) if curr_who in staff_list else 0)
-                        e_note = st.text_input("備註", value=curr_note)
-                        
-                        c_act1, c_act2 = st.columns(2)
-                        if c_act1.form_submit_button("✅ 儲存修改 (精準聯動庫存)"):
-                            try:
-                                all_item_vals = ws_items.get_all_values()
-                                live_df = pd.DataFrame(all_item_vals[1:], columns=all_item_vals[0])
-                                cell_list = []
-                                # 補回庫存
-                                for part in curr_items_str.split(','):
-                                    clean_part = re.sub(r'\s*\(\$.*?\)', '', part).strip()
-                                    if ' x' in clean_part:
-                                        p_sku = clean_part.split(' x')[0].strip(); p_qty = int(clean_part.split(' x')[1].strip())
-                                        try:
-                                            curr_q = int(live_df.loc[live_df['SKU'] == p_sku, 'Qty'].values[0])
-                                            row_i = live_df.index[live_df['SKU'] == p_sku].tolist()[0] + 2
-                                            cell_list.append(gspread.Cell(row_i, 5, curr_q + p_qty))
-                                            live_df.loc[live_df['SKU'] == p_sku, 'Qty'] = curr_q + p_qty 
-                                        except: pass
-                                
-                                new_items_list = []
-                                # 扣除新庫存
-                                for part in e_items.split(','):
-                                    clean_part = re.sub(r'\s*\(\$.*?\)', '', part).strip()
-                                    if ' x' in clean_part:
-                                        p_sku = clean_part.split(' x')[0].strip(); p_qty = int(clean_part.split(' x')[1].strip())
-                                        try:
-                                            curr_q = int(live_df.loc[live_df['SKU'] == p_sku, 'Qty'].values[0])
-                                            row_i = live_df.index[live_df['SKU'] == p_sku].tolist()[0] + 2
-                                            cell_list.append(gspread.Cell(row_i, 5, curr_q - p_qty))
-                                            new_items_list.append(f"{p_sku} x{p_qty}")
-                                        except: pass
-                                
-                                if cell_list: retry_action(ws_items.update_cells, cell_list)
-                                # 絕對行號刪除
-                                retry_action(ws_logs.delete_rows, target_row_idx)
-                                new_content = f"Sale | Total:${int(e_total)} | Items:{','.join(new_items_list)} | Note:{e_note} | Pay:{e_pay} | Channel:{e_ch} | By:{e_who} (Edited)"
-                                log_event(ws_logs, st.session_state['user_name'], "Sale", new_content)
-                                st.success("✅ 訂單已修正且庫存聯動完畢！"); time.sleep(1.5); st.rerun()
-                            except Exception as e: st.error(f"系統錯誤: {e}")
-
-                        if c_act2.form_submit_button("🗑️ 整筆作廢 (刪除並全數退回庫存)"):
-                            try:
-                                all_item_vals = ws_items.get_all_values()
-                                live_df = pd.DataFrame(all_item_vals[1:], columns=all_item_vals[0])
-                                cell_list = []
-                                for part in curr_items_str.split(','):
-                                    clean_part = re.sub(r'\s*\(\$.*?\)', '', part).strip()
-                                    if ' x' in clean_part:
-                                        p_sku = clean_part.split(' x')[0].strip(); p_qty = int(clean_part.split(' x')[1].strip())
-                                        try:
-                                            curr_q = int(live_df.loc[live_df['SKU'] == p_sku, 'Qty'].values[0])
-                                            row_i = live_df.index[live_df['SKU'] == p_sku].tolist()[0] + 2
-                                            cell_list.append(gspread.Cell(row_i, 5, curr_q + p_qty))
-                                        except: pass
-                                if cell_list: retry_action(ws_items.update_cells, cell_list)
-                                
-                                # 絕對行號刪除，秒殺重複資料
-                                retry_action(ws_logs.delete_rows, target_row_idx)
-                                st.success("已精準作廢此筆訂單！商品已退回庫存"); time.sleep(1.5); st.rerun()
-                            except: st.error("作廢失敗")
-
-        else: st.info("📊 本區間尚無銷售數據")
-
-    with tabs[3]:
-        st.markdown("### 🎁 領用與稽核戰情中心 (Audit Command Center)")
-        
-        c_add, c_board = st.columns([1, 2.5])
-        
-        with c_add:
-            st.markdown("#### ➕ 快速領用登記")
-            opts = df.apply(lambda x: f"{x['SKU']} | {x['Name']} {x['Size']}", axis=1).tolist() if not df.empty else []
-            sel = st.selectbox("選擇商品 (將自動扣除庫存)", ["..."] + opts)
-            if sel != "...":
-                tsku = sel.split(" | ")[0]; tr = df[df['SKU'] == tsku].iloc[0]; st.info(f"當前台灣現貨: {tr['Qty']}")
-                with st.form("internal"):
-                    q = st.number_input("申請數量", 1); who = st.selectbox("領用人員", staff_list); rsn = st.selectbox("事由", ["公務", "公關", "福利", "報廢", "樣品", "遺失", "其他"]); n = st.text_input("專案/詳細備註")
-                    if st.form_submit_button("✅ 送出並扣庫存", use_container_width=True):
-                        cell = ws_items.find(tsku)
-                        live_stock = int(ws_items.cell(cell.row, 5).value)
-                        if live_stock >= q:
-                            retry_action(ws_items.update_cell, cell.row, 5, live_stock - q)
-                            log_event(ws_logs, st.session_state['user_name'], "Internal_Use", f"{tsku} -{q} | {who} | {rsn} | {n} | Cost:{tr['Cost']}")
-                            st.cache_data.clear(); st.success("登記成功！庫存已同步減少。"); time.sleep(1); st.rerun()
-                        else:
-                            st.error(f"庫存不足，無法領用！(雲端即時庫存剩餘: {live_stock})")
-
-        with c_board:
-            if not logs_df.empty:
-                int_df = logs_df[logs_df['Action'] == "Internal_Use"].copy()
-                if not int_df.empty:
-                    parsed_data = []
-                    for idx, r in int_df.iterrows():
-                        d = str(r['Details'])
-                        try:
-                            parts = d.split(' | ')
-                            sku = parts[0].split(' -')[0].strip()
-                            qty = int(parts[0].split(' -')[1])
-                            user = parts[1].strip()
-                            reason = parts[2].strip()
-                            note = parts[3].strip() if len(parts) > 3 else ""
-                            
-                            unit_cost = 0
-                            if len(parts) > 4 and "Cost:" in parts[4]:
-                                unit_cost = int(parts[4].replace("Cost:", "").strip())
-                            else:
-                                unit_cost = cost_map.get(sku, 0)
-                                
-                            total_cost = unit_cost * qty
-                            item_name = product_map.get(sku, sku)
-                            
-                            parsed_data.append({
-                                "_SheetRow": idx + 2, "時間": r['Timestamp'], "商品": item_name, "SKU": sku, 
-                                "數量": qty, "領用人": user, "原因": reason, "備註": note, 
-                                "單位成本": unit_cost, "總消耗成本": total_cost
-                            })
-                        except: pass
-                    
-                    if parsed_data:
-                        audit_df = pd.DataFrame(parsed_data)
-                        total_items_used = audit_df['數量'].sum()
-                        total_cost_used = audit_df['總消耗成本'].sum()
-                        
-                        k1, k2 = st.columns(2)
-                        k1.markdown(f"<div class='metric-card' style='background:#fef2f2 !important;'><div class='metric-label'>📦 歷史累計領用總件數</div><div class='metric-value' style='color:#b91c1c !important;'>{total_items_used} 件</div></div>", unsafe_allow_html=True)
-                        k2.markdown(f"<div class='metric-card' style='background:#fffbeb !important;'><div class='metric-label'>💸 歷史累計消耗總成本</div><div class='metric-value' style='color:#b45309 !important;'>${total_cost_used:,}</div></div>", unsafe_allow_html=True)
-                        st.markdown("---")
-                        
-                        c_chart1, c_chart2 = st.columns(2)
-                        with c_chart1:
-                            fig_r = px.pie(audit_df, names='原因', values='數量', title="📊 領用原因佔比 (數量)", hole=0.3, color_discrete_sequence=px.colors.qualitative.Set2)
-                            fig_r.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font_color='#0f172a', margin=dict(t=0, b=0, l=0, r=0))
-                            st.plotly_chart(fig_r, use_container_width=True)
-                        with c_chart2:
-                            user_cost = audit_df.groupby('領用人')['總消耗成本'].sum().reset_index()
-                            fig_u = px.bar(user_cost, x='領用人', y='總消耗成本', title="👤 人員消耗成本排行", color='總消耗成本', color_continuous_scale='Reds')
-                            fig_u.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font_color='#0f172a', margin=dict(t=0, b=0, l=0, r=0))
-                            st.plotly_chart(fig_u, use_container_width=True)
-
-                        st.markdown("#### 📜 領用流水帳與細節 (可點擊表頭排序)")
-                        clean_audit_df = audit_df[['時間', '商品', '數量', '領用人', '原因', '總消耗成本', '備註']]
-                        st.dataframe(clean_audit_df, use_container_width=True, hide_index=True)
-
-                        c_dl1, c_dl2 = st.columns([1, 1])
-                        with c_dl1:
-                            st.download_button("📥 下載領用稽核表 (防亂碼)", data=clean_audit_df.to_csv(index=False).encode('utf-8-sig'), file_name=f"Audit_{date.today()}.csv", mime="text/csv", use_container_width=True)
-                        with st.expander("📋 手機/電腦 一鍵複製表格數據 (防跑版)"):
-                            st.caption("💡 點擊下方黑框【右上角的複製圖示】，即可完美貼上至 Excel、Google Sheets 或 LINE，欄位絕對對齊。")
-                            st.code(clean_audit_df.to_csv(index=False, sep='\t'), language="text")
-
-                    else:
-                        st.info("資料格式舊版，無法生成圖表。未來的領用將以新格式完美呈現。")
-                else:
-                    st.info("尚無任何領用紀錄。")
-            else:
-                st.info("尚無任何領用紀錄。")
-
-        st.divider()
-        with st.expander("🛠️ 修正或刪除錯誤的領用紀錄 (系統將自動歸還庫存)"):
-            if not logs_df.empty and 'int_df' in locals() and not int_df.empty and 'audit_df' in locals():
-                rev_opts = audit_df.apply(lambda x: f"[單號:{x['_SheetRow']}] {x['時間']} | {x['商品']} | 數量:{x['數量']} | {x['領用人']}", axis=1).tolist()
-                sel_rev = st.selectbox("選擇要精準修正的紀錄", ["..."] + rev_opts)
-                
-                if sel_rev != "...":
-                    target_row_idx = int(re.search(r'\[單號:(\d+)\]', sel_rev).group(1))
-                    tgt_audit = audit_df[audit_df['_SheetRow'] == target_row_idx].iloc[0]
-                    orig_sku = tgt_audit['SKU']
-                    orig_qty = tgt_audit['數量']
-                    orig_who = tgt_audit['領用人']
-                    orig_reason = tgt_audit['原因']
-                    orig_note = tgt_audit['備註']
-                    orig_cost = tgt_audit['單位成本']
-
-                    with st.form("edit_internal_log"):
-                        st.info(f"正在編輯: {product_map.get(orig_sku, orig_sku)} (原數量: {orig_qty})")
-                        new_q = st.number_input("修正為正確數量", value=orig_qty, min_value=1)
-                        new_who = st.selectbox("修正領用人", staff_list, index=staff_list.index(orig_who) if orig_who in staff_list else 0)
-                        new_rsn = st.selectbox("修正原因", ["公務", "公關", "福利", "報廢", "樣品", "遺失", "其他"], index=["公務", "公關", "福利", "報廢", "樣品", "遺失", "其他"].index(orig_reason) if orig_reason in ["公務", "公關", "福利", "報廢", "樣品", "遺失", "其他"] else 0)
-                        new_note = st.text_input("修正備註", value=orig_note)
-                        
-                        c_edit_1, c_edit_2 = st.columns(2)
-                        if c_edit_1.form_submit_button("✅ 更新紀錄並同步庫存"):
-                            cell = ws_items.find(orig_sku)
-                            if cell:
-                                curr_stock = int(ws_items.cell(cell.row, 5).value)
-                                final_stock = curr_stock + orig_qty - new_q 
-                                retry_action(ws_items.update_cell, cell.row, 5, final_stock)
-                                
-                                retry_action(ws_logs.delete_rows, target_row_idx)
-                                log_event(ws_logs, st.session_state['user_name'], "Internal_Use", f"{orig_sku} -{new_q} | {new_who} | {new_rsn} | {new_note} | Cost:{orig_cost}")
-                                st.success("紀錄已完美更新！"); time.sleep(1); st.rerun()
-                            else: st.error("找不到該商品SKU")
-
-                        if c_edit_2.form_submit_button("🗑️ 撤銷此單 (全數歸還庫存)"):
-                            cell = ws_items.find(orig_sku)
-                            if cell:
-                                curr_stock = int(ws_items.cell(cell.row, 5).value)
-                                retry_action(ws_items.update_cell, cell.row, 5, curr_stock + orig_qty) 
-                                retry_action(ws_logs.delete_rows, target_row_idx)
-                                st.success("已精準撤銷！庫存已歸還！"); time.sleep(1); st.rerun()
-
-    with tabs[4]:
-        st.markdown("<div class='mgmt-box'>", unsafe_allow_html=True)
-        st.markdown("<div class='mgmt-title'>矩陣管理中心</div>", unsafe_allow_html=True)
-        st.info("💡 提醒：庫存區的卡片已支援【單一商品的修改與刪除】，此處用於大批量的全域操作。")
-        mt1, mt2 = st.tabs(["✨ 批量衍生商品", "⚡ 雙向調撥"])
-        
-        with mt1:
-            mode = st.radio("模式", ["新系列", "衍生"], horizontal=True)
-            a_sku, a_name = "", ""
-            if mode == "新系列":
-                c = st.selectbox("分類", CAT_LIST)
-                if st.button("生成智慧貨號"): st.session_state['base'] = generate_smart_style_code(c, df['SKU'].tolist())
-                if 'base' in st.session_state: a_sku = st.session_state['base']
-            else:
-                p_opts = df.apply(lambda x: f"{x['SKU']} | {x['Name']}", axis=1).tolist()
-                p = st.selectbox("母商品", ["..."] + p_opts)
-                if p != "...": 
-                    p_sku = p.split(" | ")[0]
-                    pr = df[df['SKU']==p_sku].iloc[0]; a_sku = get_style_code(p_sku)+"-NEW"; a_name = pr['Name']
-            
-            with st.form("add_m"):
-                c1, c2 = st.columns(2); bs = c1.text_input("Base SKU", value=a_sku); nm = c2.text_input("品名", value=a_name)
-                c3, c4 = st.columns(2); pr = c3.number_input("售價", 0); co = c4.number_input("原幣成本", 0)
-                cur = st.selectbox("幣別 (若選 CNY 系統將依左側匯率自動換算台幣成本)", ["TWD", "CNY"]); 
-                img = st.file_uploader("上傳圖片 (自建圖床引擎)")
-                sz = {}; cols = st.columns(5)
-                for i, s in enumerate(SIZE_ORDER): sz[s] = cols[i%5].number_input(s, min_value=0)
-                if st.form_submit_button("寫入資料庫"):
-                    with st.spinner("建立商品與寫入資料中..."):
-                        url = process_image_to_base64(img) if img else ""
-                        fc = int(co * st.session_state['exchange_rate']) if cur == "CNY" else co
-                        rows_to_add = []
-                        for s, q in sz.items():
-                            if q > 0:
-                                rows_to_add.append([f"{bs}-{s}", nm, "New", s, q, pr, fc, get_taiwan_time_str(), url, 5, cur, co, 0])
-                        if rows_to_add:
-                            retry_action(ws_items.append_rows, rows_to_add)
-                        st.cache_data.clear(); st.success("商品新增完成！成本已同步記錄。"); time.sleep(1); st.rerun()
-        
-        with mt2:
-            st.info("💡 兩地倉庫雙向調撥。系統將自動增減兩地庫存數字。")
-            t_opts = df.apply(lambda x: f"{x['SKU']} | {x['Name']} {x['Size']} (TW:{x['Qty']} / CN:{x['Qty_CN']})", axis=1).tolist()
-            sel = st.selectbox("選擇要調撥的商品", ["..."] + t_opts)
-            if sel != "...":
-                sel_sku = sel.split(" | ")[0]
-                r = df[df['SKU']==sel_sku].iloc[0]
-                c1, c2 = st.columns(2)
-                q = c1.number_input("調撥數量", 1)
-                c_act1, c_act2 = st.columns(2)
-                if c_act1.button("TW ➡️ CN (台灣轉中國)"): 
-                    row_idx = ws_items.find(sel_sku).row
-                    cell_list = [gspread.Cell(row_idx, 5, int(r['Qty'])-q), gspread.Cell(row_idx, 13, int(r['Qty_CN'])+q)]
-                    retry_action(ws_items.update_cells, cell_list)
-                    log_event(ws_logs, st.session_state['user_name'], "Transfer", f"{sel_sku} TW to CN qty:{q}")
-                    st.cache_data.clear(); st.success("調撥完成"); st.rerun()
-                if c_act2.button("CN ➡️ TW (中國轉台灣)"):
-                    row_idx = ws_items.find(sel_sku).row
-                    cell_list = [gspread.Cell(row_idx, 5, int(r['Qty'])+q), gspread.Cell(row_idx, 13, int(r['Qty_CN'])-q)]
-                    retry_action(ws_items.update_cells, cell_list)
-                    log_event(ws_logs, st.session_state['user_name'], "Transfer", f"{sel_sku} CN to TW qty:{q}")
-                    st.cache_data.clear(); st.success("調撥完成"); st.rerun()
-
-    with tabs[5]: 
-        st.subheader("📝 系統全域日誌 (Log System)")
-        l_q = st.text_input("🔍 搜尋關鍵字 (人員/動作/品名/金額)")
-        if not logs_df.empty:
-            view_df = logs_df.sort_index(ascending=False).copy()
-            view_df.columns = ['時間', '操作人員', '動作類型', '內容詳情']
-            action_map = {"Sale": "💰 銷售結帳", "Internal_Use": "🎁 內部領用", "Login": "🔑 登入", "Transfer": "📦 調撥", "Batch": "⚡ 批量"}
-            view_df['動作類型'] = view_df['動作類型'].map(action_map).fillna(view_df['動作類型'])
-            
-            def translate_details(txt):
-                txt_str = str(txt)
-                for sku, info in product_map.items():
-                    if sku in txt_str: txt_str = txt_str.replace(sku, f"[{info}]")
-                return txt_str
-            view_df['內容詳情'] = view_df['內容詳情'].apply(translate_details)
-            
-            if l_q: view_df = view_df[view_df.astype(str).apply(lambda x: x.str.contains(l_q, case=False)).any(axis=1)]
-            st.dataframe(view_df, use_container_width=True, hide_index=True)
-
-    with tabs[6]: 
-        st.subheader("👥 人員與權限管理 (Admin Matrix)")
-        if st.session_state['user_role'] == 'Admin':
-            admin_view = users_df.copy()
-            admin_view.columns = ['員工帳號', '密碼(已加密Hash)', '權限等級', '狀態', '建立時間']
-            st.dataframe(admin_view, use_container_width=True, hide_index=True)
-            
-            c_u1, c_u2 = st.columns(2)
-            with c_u1:
-                with st.expander("➕ 新增員工"):
-                    with st.form("new_user"):
-                        nu = st.text_input("設定帳號"); np = st.text_input("設定密碼"); nr = st.selectbox("權限", ["Staff", "Admin"])
-                        if st.form_submit_button("開通帳號"):
-                            retry_action(ws_users.append_row, [nu, make_hash(np), nr, "Active", get_taiwan_time_str()])
-                            st.cache_data.clear(); st.success("帳號已開通"); st.rerun()
-            with c_u2:
-                with st.expander("🗑️ 刪除員工"):
-                    du = st.selectbox("選擇要註銷的帳號", users_df['Name'].tolist())
-                    if st.button("確認註銷此員工"):
-                        cell = ws_users.find(du)
-                        retry_action(ws_users.delete_rows, cell.row)
-                        st.cache_data.clear(); st.success("帳號已註銷"); st.rerun()
-        else:
-            st.error("🔒 權限不足。僅 Admin 可訪問此區域。")
-    
-    with tabs[7]:
-        render_roster_system(sh, staff_list, st.session_state['user_name'])
+    # 只渲染目前選取的功能區；各區為 fragment，區內互動只重跑該區
+    sections = {
+        "📊 視覺庫存": lambda: render_inventory_tab(sh, wss),
+        "🛒 POS": lambda: render_pos_tab(wss),
+        "📈 銷售戰情": lambda: render_sales_hub(sh, wss),
+        "🎁 領用/稽核看板": lambda: render_audit_board(sh, wss),
+        "👔 矩陣管理": lambda: render_matrix_tab(sh, wss),
+        "📝 日誌": lambda: render_logs_tab(wss),
+        "👥 Admin": lambda: render_admin_tab(sh, wss),
+        "🗓️ 排班": lambda: render_roster_system(sh, view.staff_list, st.session_state['user_name']),
+    }
+    section = st.radio("功能區", list(sections), horizontal=True, key="nav_section", label_visibility="collapsed")
+    sections[section]()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,66 @@
+"""大單購物車效能比較：舊版「每次點擊 append 一列 + 逐列過濾 DataFrame」vs 以 SKU 為鍵的 Cart。
+
+用法 (於專案根目錄)：
+    python benchmarks/bench_cart.py [商品數，預設 5000] [掃描次數，預設 600]
+
+掃描會重複命中同款 (批發 / 直播常見)，量測每次重跑時的毛利試算 + 結帳前庫存檢查。
+"""
+import os, sys, time, random, logging
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+import app  # noqa: E402
+
+# --- 舊版實作 (保留作為對照基準) ---
+def legacy_scan(cart, df, sku):
+    r = df[df['SKU'] == sku].iloc[0]
+    cart.append({"sku": r['SKU'], "name": r['Name'], "size": r['Size'], "price": r['Price'], "qty": 1, "subtotal": r['Price']})
+
+def legacy_rerun(cart, df, live_df):
+    base_raw = sum(i['subtotal'] for i in cart)
+    total_cart_cost = 0
+    for cart_item in cart:
+        hit = df[df['SKU'] == cart_item['sku']]
+        if not hit.empty: total_cart_cost += int(hit['Cost'].iloc[0]) * cart_item['qty']
+    for item in cart:
+        if live_df.loc[live_df['SKU'] == item['sku'], 'Qty'].empty: return base_raw, total_cart_cost, False
+        if int(live_df.loc[live_df['SKU'] == item['sku'], 'Qty'].iloc[0]) < item['qty']: return base_raw, total_cart_cost, False
+    return base_raw, total_cart_cost, True
+
+def new_rerun(cart, items, df):
+    lines = cart.frame(df, items.sku_pos)
+    return int(lines['subtotal'].sum()), int((lines['Cost'] * lines['qty']).sum()), app.validate_cart(lines)[0] == "ok"
+
+def timed(fn, *a):
+    t0 = time.perf_counter(); out = fn(*a); return out, time.perf_counter() - t0
+
+def main():
+    n_items = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    n_scans = int(sys.argv[2]) if len(sys.argv) > 2 else 600
+    rnd = random.Random(5)
+    rows = [[f"TOP-2501-{i // 3:04d}-{'SML'[i % 3]}", f"款{i // 3}", "上衣(Top)", "SML"[i % 3], 999, rnd.randint(290, 1990), rnd.randint(100, 600),
+             "", "", 5, "TWD", 0, 0] for i in range(n_items)]
+    items = app.ItemsSnapshot(pd.DataFrame(rows, columns=app.SHEET_HEADERS)); df = items.df
+    scans = [rnd.choice(rows[:n_items // 20])[0] for _ in range(n_scans)]
+
+    legacy = []
+    t0 = time.perf_counter()
+    for sku in scans: legacy_scan(legacy, df, sku)
+    t_scan_old = time.perf_counter() - t0
+    cart = app.Cart()
+    t0 = time.perf_counter()
+    for sku in scans: cart.add(sku)
+    t_scan_new = time.perf_counter() - t0
+
+    (old, t_old) = timed(legacy_rerun, legacy, df, df)
+    (new, t_new) = timed(new_rerun, cart, items, df)
+    assert old[:2] == new[:2], (old, new)
+
+    print(f"{n_items:,} 個商品，掃描 {n_scans} 次 → 舊版 {len(legacy)} 列 / 新版 {len(cart)} 列 (同款合併)")
+    print(f"掃描累計          : 舊版 {t_scan_old * 1000:8.1f} ms  新版 {t_scan_new * 1000:8.2f} ms")
+    print(f"每次重跑 試算+檢查 : 舊版 {t_old * 1000:8.1f} ms  新版 {t_new * 1000:8.2f} ms  → {t_old / t_new:5.1f}x")
+    print(f"應收 ${new[0]:,} | 成本 ${new[1]:,} (與舊版一致)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""營收 / 沉沒成本引擎效能比較：舊版逐列 iterrows + re.search vs 向量化帳本。
+
+用法 (於專案根目錄)：
+    python benchmarks/bench_log_metrics.py [列數，預設 200000]
+"""
+import os, re, sys, time, random, logging
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+import app  # noqa: E402
+
+# --- 舊版實作 (保留作為對照基準) ---
+def legacy_realized_revenue(logs_df):
+    total = 0
+    sales_logs = logs_df[logs_df['Action'] == 'Sale']
+    for _, row in sales_logs.iterrows():
+        try:
+            match = re.search(r'Total:\s*\$?\s*(\d+)', str(row['Details']))
+            if match: total += int(match.group(1))
+        except: pass
+    return total
+
+def legacy_sunk_cost(logs_df, cost_map):
+    sunk_total = 0
+    int_logs = logs_df[logs_df['Action'] == 'Internal_Use']
+    for _, row in int_logs.iterrows():
+        try:
+            parts = str(row['Details']).split(' | ')
+            sku = parts[0].split(' -')[0].strip()
+            qty = int(parts[0].split(' -')[1])
+            if len(parts) > 4 and "Cost:" in parts[4]: unit_cost = int(parts[4].replace("Cost:", "").strip())
+            else: unit_cost = cost_map.get(sku, 0)
+            sunk_total += (unit_cost * qty)
+        except: pass
+    return sunk_total
+
+def legacy_hub_breakdown(logs_df):
+    rows = []
+    for _, r in logs_df[logs_df['Action'] == 'Sale'].iterrows():
+        d = str(r['Details'])
+        total_m = re.search(r'Total:\s*\$?\s*(\d+)', d)
+        ch_m = re.search(r'Channel:(.*?) \|', d + " |")
+        pay_m = re.search(r'Pay:(.*?) \|', d + " |")
+        by_m = re.search(r'By:([a-zA-Z0-9_一-龥]+)', d)
+        rows.append({"金額": int(total_m.group(1)) if total_m else 0, "通路": ch_m.group(1).strip() if ch_m else "未分類",
+                     "付款": pay_m.group(1).strip() if pay_m else "未分類", "銷售員": by_m.group(1) if by_m else r['User']})
+    sdf = pd.DataFrame(rows)
+    return sdf.groupby('付款')['金額'].sum().to_dict(), sdf.groupby('銷售員')['金額'].sum().to_dict()
+
+# --- 測試資料 ---
+def make_logs(n, seed=7):
+    rnd = random.Random(seed)
+    skus = [f"TOP-2401-{i:03d}-{s}" for i in range(1, 200) for s in ("S", "M", "L")]
+    staff = ["Boss", "Amy", "小美", "Ken"]
+    rows = []
+    for i in range(n):
+        ts = f"2024-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d} {rnd.randint(10, 21):02d}:{rnd.randint(0, 59):02d}:{rnd.randint(0, 59):02d}"
+        k = rnd.random()
+        if k < 0.6:
+            items = ",".join(f"{rnd.choice(skus)} x{rnd.randint(1, 3)}" for _ in range(rnd.randint(1, 4)))
+            d = f"Sale | Total:${rnd.randint(100, 9000)} | Items:{items} | Note: | Pay:{rnd.choice(['現金', '轉帳', '刷卡'])} | Channel:{rnd.choice(['門市', '官網', '直播'])} | By:{rnd.choice(staff)}"
+            rows.append([ts, rnd.choice(staff), "Sale", d])
+        elif k < 0.8:
+            cost = f" | Cost:{rnd.randint(50, 900)}" if rnd.random() < 0.7 else ""
+            rows.append([ts, rnd.choice(staff), "Internal_Use", f"{rnd.choice(skus)} -{rnd.randint(1, 5)} | {rnd.choice(staff)} | 公關 | 備註{cost}"])
+        else:
+            rows.append([ts, rnd.choice(staff), "Restock", f"{rnd.choice(skus)} +{rnd.randint(1, 20)}"])
+    return pd.DataFrame(rows, columns=["Timestamp", "User", "Action", "Details"]), {s: rnd.randint(50, 900) for s in skus}
+
+def timed(fn, *a):
+    t0 = time.perf_counter(); out = fn(*a); return out, time.perf_counter() - t0
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    logs_df, cost_map = make_logs(n)
+    print(f"Logs 列數: {n:,}")
+
+    (rev_old, t_rev_old) = timed(legacy_realized_revenue, logs_df)
+    (sunk_old, t_sunk_old) = timed(legacy_sunk_cost, logs_df, cost_map)
+    ((pay_old, staff_old), t_hub_old) = timed(legacy_hub_breakdown, logs_df)
+    t_old = t_rev_old + t_sunk_old + t_hub_old
+
+    def new_engine(ledger):
+        sales = ledger.frame(logs_df); internal = app.parse_internal_use(logs_df, cost_map)
+        m = app.summarize_sales(sales); m["sunk_cost"] = int(internal['total_cost'].sum())
+        return m
+    ledger = app.SalesLedger()
+    (m, t_cold) = timed(new_engine, ledger)
+    (_, t_warm) = timed(new_engine, ledger)
+
+    assert m["revenue"] == rev_old, (m["revenue"], rev_old)
+    assert m["sunk_cost"] == sunk_old, (m["sunk_cost"], sunk_old)
+    assert m["by_payment"] == pay_old and m["by_staff"] == staff_old
+
+    print(f"舊版 (iterrows + re)    : {t_old * 1000:9.1f} ms  (營收 {t_rev_old * 1000:.0f} / 沉沒 {t_sunk_old * 1000:.0f} / 看板 {t_hub_old * 1000:.0f})")
+    print(f"新版 冷啟動 (全量解析)  : {t_cold * 1000:9.1f} ms  → {t_old / t_cold:5.1f}x")
+    print(f"新版 熱快取 (已解析列)  : {t_warm * 1000:9.1f} ms  → {t_old / t_warm:5.1f}x")
+    print(f"營收 ${m['revenue']:,} | 沉沒成本 ${m['sunk_cost']:,} (與舊版一致)")
+
+if __name__ == "__main__":
+    main()
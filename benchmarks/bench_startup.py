@@ -0,0 +1,45 @@
+"""冷啟動量測：在全新的 Python 行程中匯入 app，記錄耗時與是否載入了重型繪圖套件。
+
+用法 (於專案根目錄)：
+    python benchmarks/bench_startup.py [重複次數，預設 5]
+
+「eager」列為舊版行為的對照：同一行程先匯入 matplotlib.pyplot 與 plotly.express 再匯入 app。
+"""
+import os, sys, json, subprocess, statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ["matplotlib", "matplotlib.pyplot", "plotly.express"]
+
+PROBE = """
+import time, sys, json, logging
+logging.disable(logging.WARNING)
+t0 = time.perf_counter()
+{pre}
+import app
+t1 = time.perf_counter()
+out = {{"import_s": t1 - t0, "heavy": [m for m in {heavy!r} if m in sys.modules]}}
+if {font}:
+    t2 = time.perf_counter(); ok = app.setup_matplotlib_chinese()
+    import matplotlib
+    out.update(font_s=time.perf_counter() - t2, font_ok=ok, font_family=matplotlib.rcParams['font.family'])
+print(json.dumps(out))
+"""
+
+def probe(pre="", font=False):
+    code = PROBE.format(pre=pre, heavy=HEAVY, font=font)
+    r = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, timeout=120)
+    return json.loads(r.stdout.strip().splitlines()[-1])
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    probe()  # 先暖檔案系統快取 / .pyc，避免第一次量測失真
+    lazy = [probe() for _ in range(n)]
+    eager = [probe(pre="import matplotlib.pyplot, plotly.express") for _ in range(n)]
+    t_lazy = statistics.median(r["import_s"] for r in lazy); t_eager = statistics.median(r["import_s"] for r in eager)
+    print(f"匯入 app (延遲載入)      : {t_lazy * 1000:7.0f} ms  (中位數，{n} 次)  已載入重型套件: {lazy[0]['heavy'] or '無'}")
+    print(f"匯入 app (eager 對照)    : {t_eager * 1000:7.0f} ms  → 省下 {(t_eager - t_lazy) * 1000:.0f} ms")
+    f = probe(font=True)
+    print(f"首次載入中文字型 (班表)  : {f['font_s'] * 1000:7.0f} ms  成功={f['font_ok']}  字型={f['font_family']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""多終端同時結帳壓力測試：舊版「讀取→比對→覆寫」vs 版本戳 CAS 協定。
+
+以記憶體內的 Sheets 替身 (每次 API 往返加上模擬延遲) 讓 N 台終端搶購少量熱門 SKU，結束後核對：
+    雲端扣掉的件數 == 成功結帳日誌的件數，且庫存不為負 (沒有超賣 / 覆寫遺失)。
+
+用法 (於專案根目錄)：
+    python benchmarks/load_checkout.py [終端數，預設 10] [每台結帳次數，預設 15]
+    --instances   每台終端各自一把行程鎖 (模擬多個 Streamlit 執行個體，只靠雲端 CAS 互斥)
+"""
+import os, sys, time, random, tempfile, threading, logging, collections
+
+os.environ.setdefault("IFUKUK_READ_QUOTA", "100000"); os.environ.setdefault("IFUKUK_WRITE_QUOTA", "100000")
+os.environ["IFUKUK_MIRROR_DB"] = os.path.join(tempfile.mkdtemp(), "load_mirror.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+import app  # noqa: E402
+
+LATENCY = (0.03, 0.12)   # 秒：每次 API 往返的模擬延遲
+
+# --- 記憶體內 Sheets 替身 ---
+class MemSpreadsheet:
+    def __init__(self):
+        self.lock = threading.Lock(); self.sheets = {}; self.calls = collections.Counter()
+
+    def add(self, title, rows):
+        ws = MemWorksheet(self, title, len(self.sheets) + 1, rows); self.sheets[ws.id] = ws
+        return ws
+
+    def _rtt(self, kind):
+        self.calls[kind] += 1; time.sleep(random.uniform(*LATENCY))
+
+    def batch_update(self, body):
+        self._rtt("write"); replies = []
+        with self.lock:  # 一個 batchUpdate 在伺服器端為原子操作
+            for req in body["requests"]:
+                (kind, spec), = req.items()
+                if kind == "updateCells":
+                    ws = self.sheets[spec["start"]["sheetId"]]
+                    for i, row in enumerate(spec["rows"]):
+                        for j, v in enumerate(row["values"]):
+                            ws.set(spec["start"]["rowIndex"] + i, spec["start"]["columnIndex"] + j, next(iter(v["userEnteredValue"].values())))
+                    replies.append({})
+                elif kind == "appendCells":
+                    ws = self.sheets[spec["sheetId"]]
+                    ws.rows.extend([next(iter(v["userEnteredValue"].values())) for v in row["values"]] for row in spec["rows"]); replies.append({})
+                elif kind == "findReplace":
+                    rg = spec["range"]; ws = self.sheets[rg["sheetId"]]; n = 0
+                    for r in range(rg["startRowIndex"], rg["endRowIndex"]):
+                        for c in range(rg["startColumnIndex"], rg["endColumnIndex"]):
+                            if ws.get(r, c) != "" and ws.get(r, c) == spec["find"]: ws.set(r, c, spec["replacement"]); n += 1
+                    replies.append({"findReplace": {"occurrencesChanged": n} if n else {}})
+                else: raise ValueError(kind)
+        return {"replies": replies}
+
+class MemWorksheet:
+    def __init__(self, ss, title, sid, rows):
+        self.spreadsheet = ss; self.title = title; self.id = sid; self.rows = [list(r) for r in rows]
+
+    def get(self, r, c):
+        return str(self.rows[r][c]) if r < len(self.rows) and c < len(self.rows[r]) else ""
+
+    def set(self, r, c, v):
+        while len(self.rows[r]) <= c: self.rows[r].append("")
+        self.rows[r][c] = v
+
+    def get_all_values(self):
+        self.spreadsheet._rtt("read")
+        with self.spreadsheet.lock: return [[str(x) for x in r] for r in self.rows]
+
+    def batch_get(self, ranges):
+        self.spreadsheet._rtt("read")
+        with self.spreadsheet.lock:
+            out = []
+            for rng in ranges:
+                r = int("".join(ch for ch in rng.split(":")[0] if ch.isdigit()))
+                out.append([[str(x) for x in self.rows[r - 1]]] if r - 1 < len(self.rows) else [])
+            return out
+
+# --- 兩種結帳協定 ---
+def legacy_checkout(ws_items, ws_logs, cart):
+    """舊版：讀即時庫存、比對後直接覆寫 (兩台終端可同時通過檢查並互相覆蓋)。"""
+    live_rows = app.locate_rows(ws_items, [sku for sku, _ in cart]); cells = []
+    for sku, qty in cart:
+        row, vals = live_rows[sku]; q = int(vals[4] or 0)
+        if q < qty: return False
+        cells.append((row, q - qty))
+    batch = app.SheetBatch()
+    for row, v in cells: batch.update(ws_items, row, 5, v)
+    batch.append(ws_logs, ["t", "bench", "Sale", ",".join(f"{s} x{q}" for s, q in cart)])
+    return batch.commit()
+
+def cas_checkout(ws_items, ws_logs, cart):
+    deltas = {}
+    for sku, qty in cart: deltas.setdefault(sku, {5: 0})[5] -= qty
+    status, _ = app.commit_stock_deltas(ws_items, deltas, build=lambda batch, live: batch.append(ws_logs, ["t", "bench", "Sale", ",".join(f"{s} x{q}" for s, q in cart)]))
+    return status == "ok"
+
+def run(protocol, terminals, per_terminal, instances, seed=11):
+    rnd = random.Random(seed)
+    app.get_mirror.clear(); app._build_row_index.clear()
+    app.get_mirror().mark_dirty()
+    ss = MemSpreadsheet()
+    skus = [f"HOT-2501-{i:03d}-M" for i in range(1, 7)]
+    stock = 30
+    ws_items = ss.add("Items", [app.SHEET_HEADERS] + [[s, "熱賣款", "Top", "M", stock, 990, 400, "", "", 5, "TWD", 400, 0] for s in skus])
+    ws_logs = ss.add("Logs", [app.LOG_HEADERS])
+    carts = [[[(s, rnd.randint(1, 2)) for s in rnd.sample(skus, rnd.randint(1, 3))] for _ in range(per_terminal)] for _ in range(terminals)]
+
+    local = threading.local(); real_locks = app.get_sku_locks
+    if instances: app.get_sku_locks = lambda: local.__dict__.setdefault("locks", app.SkuLocks())
+    ok = collections.Counter()
+    def terminal(i):
+        for cart in carts[i]:
+            if protocol(ws_items, ws_logs, cart): ok[i] += 1
+    threads = [threading.Thread(target=terminal, args=(i,)) for i in range(terminals)]
+    t0 = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - t0
+    app.get_sku_locks = real_locks
+
+    sold_logged = sum(int(part.split(" x")[1]) for r in ws_logs.rows[1:] for part in r[3].split(","))
+    final = {r[0]: int(r[4]) for r in ws_items.rows[1:]}
+    sold_stock = sum(stock - q for q in final.values())
+    return {"elapsed": elapsed, "orders": sum(ok.values()), "sold_logged": sold_logged, "sold_stock": sold_stock,
+            "negative": sum(q < 0 for q in final.values()), "calls": dict(ss.calls)}
+
+def report(name, r):
+    lost = r["sold_logged"] - r["sold_stock"]
+    flag = "✅ 正確" if lost == 0 and not r["negative"] else f"❌ 超賣 {lost} 件 / 負庫存 {r['negative']} 款"
+    print(f"{name:<18}: {r['elapsed']:6.2f} s  成功 {r['orders']:3d} 單 ({r['orders'] / r['elapsed']:5.1f} 單/秒)  "
+          f"日誌售出 {r['sold_logged']:3d} / 實扣庫存 {r['sold_stock']:3d}  {flag}  API {r['calls']}")
+    return lost == 0 and not r["negative"]
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    terminals = int(args[0]) if args else 10; per_terminal = int(args[1]) if len(args) > 1 else 15
+    instances = "--instances" in sys.argv
+    print(f"{terminals} 台終端 × {per_terminal} 次結帳，6 款熱門 SKU 各 30 件，往返延遲 {LATENCY[0] * 1000:.0f}-{LATENCY[1] * 1000:.0f} ms"
+          + (" (各終端獨立行程鎖)" if instances else ""))
+    report("舊版 讀取→覆寫", run(legacy_checkout, terminals, per_terminal, instances))
+    assert report("CAS 版本戳", run(cas_checkout, terminals, per_terminal, instances)), "CAS 協定出現超賣"
+
+if __name__ == "__main__":
+    main()